@@ -0,0 +1,90 @@
+import numpy as np
+
+
+class AgentGrid:
+    """
+    1フレーム分のエージェント位置の一様グリッド（CSR）
+    フレームごとに一度だけ作り、各クライアントの表示範囲の問い合わせに使う
+    """
+
+    def __init__(self, xs, ys, resolution=256):
+        self.xs = np.asarray(xs, dtype=np.float64)
+        self.ys = np.asarray(ys, dtype=np.float64)
+        n = len(self.xs)
+        if n:
+            lo = np.array([self.xs.min(), self.ys.min()])
+            hi = np.array([self.xs.max(), self.ys.max()])
+        else:
+            lo, hi = np.zeros(2), np.ones(2)
+        self.origin = lo
+        self.cell_size = max(float(max(hi - lo)) / resolution, 1e-9)
+        self.nx = int((hi[0] - lo[0]) // self.cell_size) + 1
+        self.ny = int((hi[1] - lo[1]) // self.cell_size) + 1
+
+        # 原点からの距離は非負なので切り捨ての astype で floor と同じになる（// より速い）
+        inv = 1.0 / self.cell_size
+        cx = np.minimum(((self.xs - lo[0]) * inv).astype(np.int64), self.nx - 1)
+        cy = np.minimum(((self.ys - lo[1]) * inv).astype(np.int64), self.ny - 1)
+        cell = cy * self.nx + cx
+        # セル内の順序は query で並べ直すので安定ソートでなくてよい
+        self.order = np.argsort(cell)
+        counts = np.bincount(cell, minlength=self.nx * self.ny)
+        self.ptr = np.zeros(self.nx * self.ny + 1, dtype=np.int64)
+        np.cumsum(counts, out=self.ptr[1:])
+        # クラスタ表示用のセルごとの台数と座標の合計
+        self.counts = counts.reshape(self.ny, self.nx)
+        self.sum_x = np.bincount(cell, weights=self.xs, minlength=self.nx * self.ny).reshape(self.ny, self.nx)
+        self.sum_y = np.bincount(cell, weights=self.ys, minlength=self.nx * self.ny).reshape(self.ny, self.nx)
+
+    def _cell_range(self, minx, miny, maxx, maxy):
+        x0 = max(int((minx - self.origin[0]) // self.cell_size), 0)
+        y0 = max(int((miny - self.origin[1]) // self.cell_size), 0)
+        x1 = min(int((maxx - self.origin[0]) // self.cell_size), self.nx - 1)
+        y1 = min(int((maxy - self.origin[1]) // self.cell_size), self.ny - 1)
+        return x0, y0, x1, y1
+
+    def query(self, minx, miny, maxx, maxy):
+        """範囲内のエージェントの添字（元の順）"""
+        x0, y0, x1, y1 = self._cell_range(minx, miny, maxx, maxy)
+        if x0 > x1 or y0 > y1:
+            return np.zeros(0, dtype=np.int64)
+        # 1行のセルは連続しているので行ごとに1回切り出す
+        rows = [self.order[self.ptr[gy * self.nx + x0]:self.ptr[gy * self.nx + x1 + 1]] for gy in range(y0, y1 + 1)]
+        cand = np.sort(np.concatenate(rows))
+        x = self.xs[cand]
+        y = self.ys[cand]
+        return cand[(x >= minx) & (x <= maxx) & (y >= miny) & (y <= maxy)]
+
+    def count(self, minx, miny, maxx, maxy):
+        """範囲に掛かるセルの台数の合計（query より粗いが配列を作らない）"""
+        x0, y0, x1, y1 = self._cell_range(minx, miny, maxx, maxy)
+        if x0 > x1 or y0 > y1:
+            return 0
+        return int(self.counts[y0:y1 + 1, x0:x1 + 1].sum())
+
+    def clusters(self, minx, miny, maxx, maxy, cluster_size):
+        """
+        範囲内を cluster_size 程度のブロックにまとめた台数
+        ブロックの境界はグリッドに揃えるため、端のブロックは範囲の少し外まで含む
+        戻り値: (重心x, 重心y, 台数) の配列（空のブロックは除く）
+        """
+        x0, y0, x1, y1 = self._cell_range(minx, miny, maxx, maxy)
+        if x0 > x1 or y0 > y1:
+            empty = np.zeros(0)
+            return empty, empty, np.zeros(0, dtype=np.int64)
+        f = max(int(round(cluster_size / self.cell_size)), 1)
+        # ブロックの境界をグリッドに揃えて、表示範囲を動かしてもクラスタが揺れないようにする
+        x0, y0 = x0 - x0 % f, y0 - y0 % f
+        w = -(-(x1 + 1 - x0) // f) * f
+        h = -(-(y1 + 1 - y0) // f) * f
+
+        def blocks(values):
+            view = np.zeros((h, w))
+            part = values[y0:y0 + h, x0:x0 + w]
+            view[:part.shape[0], :part.shape[1]] = part
+            return view.reshape(h // f, f, w // f, f).sum(axis=(1, 3)).ravel()
+
+        counts = blocks(self.counts)
+        keep = counts > 0
+        counts = counts[keep]
+        return blocks(self.sum_x)[keep] / counts, blocks(self.sum_y)[keep] / counts, counts.astype(np.int64)
@@ -1,196 +1,455 @@
 import os
 import json
-from flask import Flask, render_template, jsonify, request
-from flask_socketio import SocketIO
+import logging
+import atexit
+import time
+from flask import Flask, Response, render_template, jsonify, request, send_file, abort
+from flask_socketio import SocketIO, emit, join_room, leave_room
 import random
-import math
 import numpy as np
+import transform
+from transform import H, transform_points
+from road_index import SegmentIndex, part_features
+from road_engine import RoadFollowingEngine
+from road_graph import RoadGraph
+from history_store import FrameHistory
+from frame_codec import DeltaFrameEncoder, encode_keyframe
+from broadcaster import FrameBroadcaster
+from density_grid import DensityGrid
+from traffic_counter import TrafficCounter
+from replay import replay_chunks
+from sim_workers import SimulationWorkers
+from frame_bus import FrameBusServer, FrameBusClient, RemoteHistory
+from recording import Recording, RecordingWriter
+from layer_cache import LayerCache
+from metrics import BYTES_BUCKETS, MetricsRegistry, SamplingProfiler
+from ingest_codec import IngestFormatError, columns_to_arrays, decode_msgpack, decode_soa, request_format
+from tiles import TileSet, _geometry_parts
+from building_mesh import BuildingMeshSet
+from layer_store import DEFAULT_ROOT as LAYER_ROOT, open_layer
+
+logging.basicConfig(level=os.environ.get('LOG_LEVEL', 'INFO'))
+logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'secret!'
+# デモの歩進方式: 'scalar'（エージェントごとの参照実装）または 'vector'（NumPyで一括）
+app.config['DEMO_ENGINE'] = os.environ.get('DEMO_ENGINE', 'scalar')
+app.config['DEMO_AGENTS'] = int(os.environ.get('DEMO_AGENTS', 10))
+# メモリに保持する直近フレーム数と、それより古いフレームの書き出し先
+app.config['HISTORY_DEPTH'] = int(os.environ.get('HISTORY_DEPTH', 512))
+app.config['HISTORY_DIR'] = os.environ.get('HISTORY_DIR', os.path.join(os.path.dirname(__file__), 'history'))
+# /tiles の最大ズームとディスクキャッシュの場所
+app.config['TILE_MAX_ZOOM'] = int(os.environ.get('TILE_MAX_ZOOM', 5))
+app.config['TILE_CACHE_DIR'] = os.environ.get('TILE_CACHE_DIR', os.path.join(os.path.dirname(__file__), 'cache', 'tiles'))
+# 地図レイヤの座標系でのGAMAのワールド範囲 "minx,miny,maxx,maxy"
+# 指定するとレイヤ座標をGAMA座標（左上原点, y下向き）に直してからHを掛ける。未指定ならレイヤはGAMA座標とみなす
+app.config['GAMA_ENVELOPE'] = os.environ.get('GAMA_ENVELOPE')
+# preprocess_layers.py の成果物。あれば map/*.json より優先してメモリマップで読む
+app.config['LAYER_DIR'] = os.environ.get('LAYER_DIR', LAYER_ROOT)
+app.config['ROAD_LAYER'] = os.environ.get('ROAD_LAYER', 'complete_roads')
+app.config['BUILDING_LAYER'] = os.environ.get('BUILDING_LAYER', 'complete_building')
+# /buildings3d（押し出した建物メッシュのGLB）の格子のズームと高さの決め方
+# 高さ[m] = 属性 BUILDING_HEIGHT_FIELD の値 × BUILDING_FLOOR_HEIGHT（値が無いか0以下なら BUILDING_DEFAULT_HEIGHT）
+app.config['BUILDING_MESH_ZOOM'] = int(os.environ.get('BUILDING_MESH_ZOOM', 2))
+app.config['BUILDING_MESH_CACHE_DIR'] = os.environ.get('BUILDING_MESH_CACHE_DIR', os.path.join(os.path.dirname(__file__), 'cache', 'meshes'))
+app.config['BUILDING_HEIGHT_FIELD'] = os.environ.get('BUILDING_HEIGHT_FIELD', 'maxhigh')
+app.config['BUILDING_FLOOR_HEIGHT'] = float(os.environ.get('BUILDING_FLOOR_HEIGHT', 3.0))
+app.config['BUILDING_DEFAULT_HEIGHT'] = float(os.environ.get('BUILDING_DEFAULT_HEIGHT', 10.0))
+# 配信: ack が返らないクライアントを取りこぼし扱いにするまでの秒数
+app.config['BROADCAST_ACK_TIMEOUT'] = float(os.environ.get('BROADCAST_ACK_TIMEOUT', 5.0))
+# ヒートマップ: 解像度, 減衰の半減期（秒, 0なら累積）, 配信間隔（秒）, 範囲 "minx,miny,maxx,maxy"（ビューア座標）
+app.config['HEATMAP_RESOLUTION'] = int(os.environ.get('HEATMAP_RESOLUTION', 256))
+app.config['HEATMAP_HALF_LIFE'] = float(os.environ.get('HEATMAP_HALF_LIFE', 30.0))
+app.config['HEATMAP_INTERVAL'] = float(os.environ.get('HEATMAP_INTERVAL', 1.0))
+app.config['HEATMAP_BOUNDS'] = os.environ.get('HEATMAP_BOUNDS')
+# 道路ごとの車両数: 道路を区別する属性, グラフに描くグループ "名前=値,値;名前=値", 記録する変化点の数
+# （道路レイヤとエージェントが同じ座標系であること。preprocess_layers.py は --envelope を渡すとビューア座標で書き出す）
+app.config['TRAFFIC_ROAD_FIELD'] = os.environ.get('TRAFFIC_ROAD_FIELD', 'road_id')
+app.config['TRAFFIC_GROUPS'] = os.environ.get('TRAFFIC_GROUPS')
+app.config['TRAFFIC_GRAPH_NAME'] = os.environ.get('TRAFFIC_GRAPH_NAME', '道路上の車両数')
+app.config['TRAFFIC_WINDOW'] = int(os.environ.get('TRAFFIC_WINDOW', 600))
+# 再生: 1回の要求で送る最大フレーム数（補間フレームを含む）と1チャンクのフレーム数
+app.config['REPLAY_MAX_FRAMES'] = int(os.environ.get('REPLAY_MAX_FRAMES', 4096))
+app.config['REPLAY_CHUNK'] = int(os.environ.get('REPLAY_CHUNK', 32))
+# 表示範囲での絞り込み: 範囲の幅に対する余白の割合, クラスタにするズーム（1単位あたりのピクセル数）の閾値,
+# 範囲内がこれより多ければクラスタにする台数（0なら無制限）, クラスタ1つの画面上の大きさ（ピクセル）
+# 範囲が全エージェントを含むクライアントは絞らず、範囲の無いクライアントと同じストリームで受け取る
+app.config['VIEWPORT_MARGIN'] = float(os.environ.get('VIEWPORT_MARGIN', 0.1))
+app.config['VIEWPORT_CLUSTER_ZOOM'] = float(os.environ.get('VIEWPORT_CLUSTER_ZOOM', 0.1))
+app.config['VIEWPORT_MAX_AGENTS'] = int(os.environ.get('VIEWPORT_MAX_AGENTS', 5000))
+app.config['VIEWPORT_CLUSTER_PIXELS'] = int(os.environ.get('VIEWPORT_CLUSTER_PIXELS', 32))
+# シミュレーションワーカー: プロセス数, 1ステップの間隔（秒）, 既定の種類 'road'（道路に沿うデモ）または 'model'（MinakusaModel）
+app.config['SIM_WORKERS'] = int(os.environ.get('SIM_WORKERS', max(1, (os.cpu_count() or 2) - 1)))
+app.config['SIM_WORKER_INTERVAL'] = float(os.environ.get('SIM_WORKER_INTERVAL', 0.1))
+app.config['SIM_WORKER_KIND'] = os.environ.get('SIM_WORKER_KIND', 'road')
+# 複数プロセス構成: 'standalone'（1プロセス）, 'ingest'（受信して FRAME_BUS_PATH に配る）,
+# 'worker'（FRAME_BUS_PATH を購読してビューアだけを受け持つ。PORT を変えて複数起動する）
+app.config['SERVER_ROLE'] = os.environ.get('SERVER_ROLE', 'standalone')
+app.config['FRAME_BUS_PATH'] = os.environ.get('FRAME_BUS_PATH', '/tmp/mas_viewer_frames.sock')
+app.config['PORT'] = int(os.environ.get('PORT', 8000))
+# 記録: 受信したフレームを RECORD_DIR に recording.py の形式で書く（未指定なら記録しない）, 圧縮方式
+# PLAYBACK_RUN に記録ファイルを指定すると、それを履歴として配信する（受信はしない）
+app.config['RECORD_DIR'] = os.environ.get('RECORD_DIR')
+app.config['RECORD_CODEC'] = os.environ.get('RECORD_CODEC', 'none')
+app.config['PLAYBACK_RUN'] = os.environ.get('PLAYBACK_RUN')
+# 計測: 受信の処理がこれ（ミリ秒）を超えたフレームは段階ごとの内訳をログに出す（0なら出さない）
+# サンプリングプロファイラ（/profiler/*）を使えるようにするか（必要なときだけ 1 にする）
+app.config['METRICS_SLOW_FRAME_MS'] = float(os.environ.get('METRICS_SLOW_FRAME_MS', 250))
+app.config['PROFILER_ENABLED'] = os.environ.get('PROFILER_ENABLED', '0') == '1'
 socketio = SocketIO(app, cors_allowed_origins="*", async_mode='eventlet')
 
 # グローバル変数
-agent_history = []
+metrics = MetricsRegistry()  # /metrics で返す処理時間のヒストグラムなど
+ingest_bytes = metrics.histogram('mas_ingest_bytes', 'Size of request bodies posted to /data_from_gama',
+                                 'format', BYTES_BUCKETS)
+profiler = None           # 動作中の SamplingProfiler
+frame_bus = None          # 'ingest': 配信プロセスへの FrameBusServer
+frame_bus_client = None   # 'worker': 受信プロセスの購読
+recorder = None           # 受信したフレームの RecordingWriter
+agent_history = None      # フレーム履歴（init_server で役割に応じて作る）
 road_data = None
-
-
-def compute_affine_transformation(src_points, dst_points):
+road_index = None
+road_graph = None         # 交差点で接続した道路グラフ（経路探索用）
+traffic_counter = None    # 道路ごとの車両数
+demo_engine = None        # 'vector' モードのRoadFollowingEngine
+demo_engine_frame = None  # demo_engine の状態が対応する履歴フレーム番号
+sim_workers = None        # 別プロセスで歩進中の SimulationWorkers（無ければNone）
+frame_encoder = DeltaFrameEncoder()  # バイナリ形式クライアント向けの差分エンコーダ
+# 前処理済みレイヤ（無ければNone）
+mapped_layers = {
+    'roads': open_layer(app.config['ROAD_LAYER'], app.config['LAYER_DIR']),
+    'buildings': open_layer(app.config['BUILDING_LAYER'], app.config['LAYER_DIR']),
+}
+
+
+def layer_to_viewer(points):
+    """地図レイヤの座標をThree.jsの座標系に変換"""
+    return transform.layer_to_viewer(points, app.config['GAMA_ENVELOPE'])
+
+def mapped_layer_transform(layer):
     """
-    4つの対応する点を使用してアフィン変換行列を計算
-    src_points: 元の座標系の4点 [(x1, y1), (x2, y2), (x3, y3), (x4, y4)]
-    dst_points: 対応する目標座標系の4点 [(x1', y1'), (x2', y2'), (x3', y3'), (x4', y4')]
+    前処理済みレイヤの座標をビューア座標にする関数。変換しないならNone
+    H はGAMA座標に掛けるものなので、--no-transform で書き出したレイヤ（レイヤ座標のまま）は
+    GAMA_ENVELOPE が無ければ H を掛けずにそのまま使う（道路の索引などと同じ座標系にそろえる）
     """
-    # ソースとターゲット座標をNumPy配列に変換
-    src_points = np.array(src_points)
-    dst_points = np.array(dst_points)
-
-    # ソース座標の行列を構築
-    A = []
-    for (x, y), (x_prime, y_prime) in zip(src_points, dst_points):
-        A.append([x, y, 1, 0, 0, 0, -x * x_prime, -y * x_prime])
-        A.append([0, 0, 0, x, y, 1, -x * y_prime, -y * y_prime])
-
-    A = np.array(A)
-
-    # 目標座標のベクトルを構築
-    B = dst_points.flatten()
-
-    # アフィン変換行列の要素を計算
-    H = np.linalg.lstsq(A, B, rcond=None)[0]
-    H = np.append(H, 1).reshape(3, 3)  # 3x3行列に変形
-    return H
-
-def transform_point(P, H):
+    if layer.meta['params'].get('to_viewer'):
+        return None
+    if not app.config['GAMA_ENVELOPE']:
+        logger.warning("Layer %s is in layer coordinates and GAMA_ENVELOPE is not set; "
+                       "serving it untransformed", layer.meta.get('name'))
+        return None
+    return layer_to_viewer
+
+def layer_json_path(name):
+    return os.path.join(os.path.dirname(__file__), 'map', f'{name}.json')
+
+def make_layer_cache(name):
+    """/roads, /buildings の応答キャッシュ（初回リクエスト時に読み込み）"""
+    layer = mapped_layers.get(name)
+    if layer is not None:
+        return LayerCache(layer.meta_path, loader=layer.to_features)
+    return LayerCache(layer_json_path(name))
+
+def make_tile_set(name):
+    """/tiles のタイルセット（座標は layer_to_viewer でThree.jsの座標系に変換）"""
+    layer = mapped_layers.get(name)
+    if layer is not None:
+        return TileSet(name, layer.meta_path, mapped_layer_transform(layer), app.config['TILE_CACHE_DIR'],
+                       max_zoom=app.config['TILE_MAX_ZOOM'], source=layer.iter_parts)
+    return TileSet(name, layer_json_path(name), layer_to_viewer,
+                   app.config['TILE_CACHE_DIR'], max_zoom=app.config['TILE_MAX_ZOOM'])
+
+def make_building_meshes():
+    """/buildings3d の建物メッシュ（高さは layer_to_viewer の拡大率でビューア座標の長さにする）"""
+    field = app.config['BUILDING_HEIGHT_FIELD']
+    layer = mapped_layers.get('buildings')
+    vertical_scale = float(np.sqrt(abs(np.linalg.det(H[:2, :2]))) / abs(H[2, 2]))
+    if layer is not None:
+        to_viewer = mapped_layer_transform(layer)
+        if to_viewer is None and not layer.meta['params'].get('to_viewer'):
+            # レイヤ座標のまま使うので、高さもレイヤ座標の長さ（m）のまま
+            vertical_scale = 1.0
+        path = layer.meta_path
+
+        def source():
+            names = layer.attributes.dtype.names or ()
+            heights = layer.attributes[field].tolist() if field in names else [None] * len(layer)
+            for k in range(len(layer)):
+                yield layer.feature_parts(k), heights[k]
+    else:
+        to_viewer = layer_to_viewer
+        path = layer_json_path('buildings')
+
+        def source():
+            with open(path, 'r', encoding='utf-8') as f:
+                features = json.load(f)
+            for feature in features:
+                kind, parts = _geometry_parts((feature or {}).get('geometry') or {})
+                if kind == 'Polygon':
+                    yield parts, ((feature or {}).get('properties') or {}).get(field)
+    return BuildingMeshSet('buildings', path, source, to_viewer, app.config['BUILDING_MESH_CACHE_DIR'],
+                           zoom=app.config['BUILDING_MESH_ZOOM'],
+                           height_scale=app.config['BUILDING_FLOOR_HEIGHT'],
+                           default_height=app.config['BUILDING_DEFAULT_HEIGHT'],
+                           vertical_scale=vertical_scale)
+
+layer_caches = {name: make_layer_cache(name) for name in ('roads', 'buildings')}
+tile_sets = {name: make_tile_set(name) for name in ('roads', 'buildings')}
+building_meshes = make_building_meshes()
+
+def heatmap_bounds():
+    """ヒートマップの範囲。未指定なら道路レイヤの範囲（道路も無ければ最初のフレームから決める）"""
+    if app.config['HEATMAP_BOUNDS']:
+        return [float(v) for v in app.config['HEATMAP_BOUNDS'].split(',')]
+    return tile_sets['roads'].extent()
+
+density_grid = None       # エージェント密度（init_server で道路の範囲から作る）
+heatmap_task = None
+
+def agents_to_arrays(agents):
     """
-    アフィン変換行列Hを使って点Pを変換
-    P: (x, y) の座標
-    H: 3x3のアフィン変換行列
+    GAMAから受け取ったエージェントのリストを (ids, xy) の連続した配列に変換
+    不正なエージェントは読み飛ばす
     """
-    x, y = P
-    point = np.array([x, y, 1])
-    transformed_point = np.dot(H, point)
-    transformed_point /= transformed_point[2]  # 正規化
-    return transformed_point[:2]
-
-
-#GAMA上の座標とThree.js上の位置合わせのためのアフィン変換行列の計算=====
-#GAMA座標系の4点ABCD
-A = (649.8888940885663,357.4444473045878);
-B = (2463.3611308187246,407.36111437063664);
-C = (2130.472239267081,1724.8333471324295);
-D = (505.63889293558896,1745.250013962388);
-#Three.js座標系の4点EFGH
-E = (-821, -772);
-F = (1232, -702);
-G = (861, 1121);
-H = (-983, 1150);
-# 四角形の4点（元の座標系）
-src_points = [A,B,C,D]
-# 対応する四角形の4点（目標座標系）
-dst_points = [E,F,G,H]
-# アフィン変換行列を計算
-H = compute_affine_transformation(src_points, dst_points)
-#=================================================================
-
-
-
-# 道路データの読み込み
-def load_road_data():
-    global road_data
-    file_path = os.path.join(os.path.dirname(__file__), 'map', 'roads.json')
-    if os.path.exists(file_path):
-        with open(file_path, 'r', encoding='utf-8') as f:
-            road_data = json.load(f)
+    n = len(agents)
+    try:
+        ids = np.fromiter((agent['id'] for agent in agents), dtype=np.int64, count=n)
+        xy = np.fromiter((v for agent in agents for v in (agent['x'], agent['y'])),
+                         dtype=np.float64, count=2 * n).reshape(n, 2)
+        return ids, xy
+    except (KeyError, ValueError, TypeError):
+        pass
+
+    # 一括変換に失敗した場合のみ1件ずつ検証する
+    ids, xy = [], []
+    for agent in agents:
+        try:
+            agent_id = int(agent['id'])  # 明示的に型変換
+            x, y = float(agent['x']), float(agent['y'])
+        except (KeyError, ValueError, TypeError) as e:
+            logger.warning("Error processing agent data: %s (%r)", e, agent)
+            continue
+        ids.append(agent_id)
+        xy.append((x, y))
+    return np.asarray(ids, dtype=np.int64), np.asarray(xy, dtype=np.float64).reshape(-1, 2)
+
+def frame_arrays(agents):
+    """{'id','x','y'} のリストを (ids, xs, ys) の配列にする"""
+    ids = np.array([agent['id'] for agent in agents], dtype=np.int64)
+    xs = np.array([agent['x'] for agent in agents], dtype=np.float64)
+    ys = np.array([agent['y'] for agent in agents], dtype=np.float64)
+    return ids, xs, ys
+
+def frame_agents(ids, xs, ys):
+    """配列のフレームを new_data で送る {'id','x','y'} のリストにする"""
+    return [{'id': i, 'x': x, 'y': y} for i, x, y in zip(ids.tolist(), xs.tolist(), ys.tolist())]
+
+# 受信処理から切り離した配信タスク（最初の publish で起動）
+broadcaster = FrameBroadcaster(socketio, frame_encoder, frame_agents,
+                               ack_timeout=app.config['BROADCAST_ACK_TIMEOUT'],
+                               viewport_margin=app.config['VIEWPORT_MARGIN'],
+                               cluster_zoom=app.config['VIEWPORT_CLUSTER_ZOOM'] or None,
+                               max_agents=app.config['VIEWPORT_MAX_AGENTS'] or None,
+                               cluster_pixels=app.config['VIEWPORT_CLUSTER_PIXELS'],
+                               metrics=metrics)
+
+# 受信したフレームを履歴に加え、配信プロセスとこのプロセスのクライアントに配る
+# shared=True は配列が共有メモリのビュー（すぐ上書きされる）の場合で、以降は履歴に入れたコピーを使う
+# trace（dict）を渡すと段階ごとの時間を足し込む
+def ingest_frame(ids, xs, ys, shared=False, trace=None):
+    with metrics.stage('history_append', trace):
+        frame = agent_history.append(ids, xs, ys)
+    if shared:
+        ids, xs, ys = agent_history.last()
+    if recorder is not None:
+        with metrics.stage('record', trace):
+            recorder.append(frame, {'id': ids, 'x': xs, 'y': ys})
+    if frame_bus is not None:
+        with metrics.stage('bus_publish', trace):
+            frame_bus.publish(frame, len(agent_history), ids, xs, ys)
+    serve_frame(frame, len(agent_history), ids, xs, ys, trace)
+    return frame
+
+# フレームを集計に加え、配信キューに積む（'worker' では購読したフレームごとに呼ぶ）
+def serve_frame(frame, total_frames, ids, xs, ys, trace=None):
+    with metrics.stage('aggregate', trace):
+        density_grid.add(frame, xs, ys)
+        if traffic_counter is not None:
+            delta = traffic_counter.update(frame, xs, ys)
+            # 台数が変わったときだけ購読中のグラフに送る
+            if delta is not None and traffic_subscribers:
+                socketio.emit('update_plot', delta, to='traffic')
+    broadcaster.publish(frame, total_frames, ids, xs, ys)
+
+# 遅かったフレームの段階ごとの内訳をログに出す
+def log_slow_frame(frame, count, trace):
+    limit = app.config['METRICS_SLOW_FRAME_MS']
+    total = sum(trace.values()) * 1000
+    if limit and total > limit:
+        logger.warning("Slow frame %d (%d agents): %.1f ms [%s]", frame, count, total,
+                       ', '.join(f"{name} {seconds * 1000:.1f}" for name, seconds in trace.items()))
+
+def ingest_disabled_error():
+    """'worker' プロセスと記録の再生中はフレームを受け付けない"""
+    if app.config['PLAYBACK_RUN']:
+        return jsonify({"status": "error", "message": "This process is playing back a recording"}), 409
+    if app.config['SERVER_ROLE'] != 'worker':
+        return None
+    return jsonify({"status": "error",
+                    "message": "This process only serves viewers; send frames to the ingest process"}), 409
+
+# 受信プロセスから購読したフレームを取り込む
+def pump_frame_bus():
+    while True:
+        for frame, total_frames, ids, xs, ys in frame_bus_client.poll():
+            serve_frame(frame, total_frames, ids, xs, ys)
+        socketio.sleep(0.005)
+
+def traffic_groups(labels):
+    """TRAFFIC_GROUPS を [(名前, 道路番号のリスト)] にする"""
+    if not app.config['TRAFFIC_GROUPS']:
+        return None
+    by_label = {}
+    for k, label in enumerate(labels):
+        by_label.setdefault(str(label), []).append(k)
+    groups = []
+    for entry in app.config['TRAFFIC_GROUPS'].split(';'):
+        name, _, values = entry.partition('=')
+        roads = [k for value in values.split(',') for k in by_label.get(value.strip(), [])]
+        groups.append((name.strip(), roads))
+    return groups
+
+def make_traffic_counter(layer=None):
+    """道路ごとの車両数の集計器（セグメント → 道路フィーチャの対応と道路のラベルを作る）"""
+    if len(road_index) == 0:
+        return None
+    field = app.config['TRAFFIC_ROAD_FIELD']
+    if layer is not None:
+        segment_road = np.searchsorted(layer.features, road_index.part, side='right') - 1
+        names = layer.attributes.dtype.names or ()
+        labels = layer.attributes[field].tolist() if field in names else list(range(len(layer)))
     else:
+        segment_road = part_features(road_data)[road_index.part]
+        labels = [((feature or {}).get('properties') or {}).get(field, k) for k, feature in enumerate(road_data)]
+    return TrafficCounter(road_index, segment_road, labels, traffic_groups(labels),
+                          window=app.config['TRAFFIC_WINDOW'])
+
+# 道路データの読み込み（セグメント索引と道路グラフもここで一度だけ構築）
+def load_road_data():
+    global road_data, road_index, road_graph, traffic_counter, demo_engine
+    layer = mapped_layers.get('roads')
+    if layer is not None:
+        # 前処理済みの道路をメモリマップから直接索引にする（GeoJSONは読まない）
         road_data = []
+        road_index = SegmentIndex(layer.coords, layer.parts)
+    else:
+        file_path = layer_json_path('roads')
+        if os.path.exists(file_path):
+            with open(file_path, 'r', encoding='utf-8') as f:
+                road_data = json.load(f)
+        else:
+            road_data = []
+        road_index = SegmentIndex.from_features(road_data)
+    road_graph = RoadGraph(road_index)
+    traffic_counter = make_traffic_counter(layer)
+    logger.info("Road graph: %d nodes, %d edges", road_graph.num_nodes, len(road_graph.edge_segment))
+    demo_engine = None
 
 # 道路上のランダムな位置を取得
 def get_random_road_position():
-    if not road_data:
+    if road_index is None or len(road_index) == 0:
         return (13550000, 3480000)  # デフォルト位置
 
-    # ランダムな道路を選択
-    road = random.choice(road_data)
-    if not road.get('geometry') or not road['geometry'].get('coordinates'):
-        return (13550000, 3480000)
-
-    coords = road['geometry']['coordinates']
-    if len(coords) < 2:
-        return (13550000, 3480000)
-
-    # 道路上のランダムな位置を選択
-    idx = random.randint(0, len(coords) - 2)
-    p1 = coords[idx]
-    p2 = coords[idx + 1]
+    # ランダムなセグメント上のランダムな位置を選択
+    segment = random.randrange(len(road_index))
     t = random.random()  # 0から1の間のランダムな値
 
     # 2点間の線形補間
-    x = p1[0] + (p2[0] - p1[0]) * t
-    y = p1[1] + (p2[1] - p1[1]) * t
-
-    return (x, y)
+    p1 = road_index.p1[segment]
+    d = road_index.d[segment]
+    return (float(p1[0] + d[0] * t), float(p1[1] + d[1] * t))
 
 # 道路に沿った次の位置を取得
 def get_next_road_position(current_x, current_y, speed=10):
-    if not road_data:
+    if road_index is None or len(road_index) == 0:
         return (current_x + random.uniform(-speed, speed),
                 current_y + random.uniform(-speed, speed))
 
-    # 最も近い道路セグメントを見つける
-    min_dist = float('inf')
-    next_pos = None
-    direction = None
-
-    for road in road_data:
-        if not road.get('geometry') or not road['geometry'].get('coordinates'):
-            continue
-
-        coords = road['geometry']['coordinates']
-        for i in range(len(coords) - 1):
-            p1 = coords[i]
-            p2 = coords[i + 1]
-
-            # 現在位置から道路セグメントまでの距離を計算
-            dx = p2[0] - p1[0]
-            dy = p2[1] - p1[1]
-            segment_length = math.sqrt(dx * dx + dy * dy)
-            
-            if segment_length == 0:
-                continue
-
-            # 道路セグメントへの投影点を計算
-            t = ((current_x - p1[0]) * dx + (current_y - p1[1]) * dy) / (segment_length * segment_length)
-            t = max(0, min(1, t))
-
-            proj_x = p1[0] + t * dx
-            proj_y = p1[1] + t * dy
-            
-            dist = math.sqrt((current_x - proj_x)**2 + (current_y - proj_y)**2)
-
-            if dist < min_dist:
-                min_dist = dist
-                # 道路に沿って進む方向を計算
-                if t < 0.95:  # セグメントの終点に近づいていない場合
-                    direction = (dx / segment_length, dy / segment_length)
-                else:  # セグメントの終点に近い場合、次のセグメントがあれば使用
-                    if i < len(coords) - 2:
-                        next_dx = coords[i+2][0] - p2[0]
-                        next_dy = coords[i+2][1] - p2[1]
-                        next_length = math.sqrt(next_dx * next_dx + next_dy * next_dy)
-                        direction = (next_dx / next_length, next_dy / next_length)
-                    else:
-                        direction = (dx / segment_length, dy / segment_length)
-
-    if direction:
-        # 現在の位置から道路に沿って移動
-        next_x = current_x + direction[0] * speed
-        next_y = current_y + direction[1] * speed
-        return (next_x, next_y)
-    else:
+    # 索引から最も近い道路セグメントを見つける
+    nearest = road_index.nearest(current_x, current_y)
+    if nearest is None:
         # 道路が見つからない場合はランダムに移動
         return (current_x + random.uniform(-speed, speed),
                 current_y + random.uniform(-speed, speed))
 
+    segment, t, _, _, _ = nearest
+    # 道路に沿って進む方向（終点付近では次のセグメントの方向）
+    direction = road_index.heading(segment, t)
+
+    # 現在の位置から道路に沿って移動
+    next_x = current_x + direction[0] * speed
+    next_y = current_y + direction[1] * speed
+    return (next_x, next_y)
+
 # デモデータ生成用の関数
 def generate_demo_agents(num_agents=10):
     agents = []
-    for i in range(num_agents):
-        x, y = get_random_road_position()
-        agents.append({
-            'id': i,
-            'x': x,
-            'y': y
-        })
+    with metrics.stage('demo_generate'):
+        for i in range(num_agents):
+            x, y = get_random_road_position()
+            agents.append({
+                'id': i,
+                'x': x,
+                'y': y
+            })
     
-    print(f"Generated {num_agents} agents")
-    print(f"Sample agent position: {agents[0]}")
+    logger.info("Generated %d agents", num_agents)
+    logger.debug("Sample agent position: %s", agents[0])
     return agents
 
+initial_demo_data = []    # 最初のデモフレーム（init_server で作る）
+
 # 初期化
-load_road_data()
-initial_demo_data = generate_demo_agents()
-agent_history = [initial_demo_data]
+def init_server():
+    """
+    履歴・記録・フレームバスを作り、道路を読み込んで最初のデモフレームを入れる
+    sim_workers の spawn はこのモジュールを __mp_main__ として読み込み直すので、
+    ソケットやファイルを作る処理はモジュールの読み込みでは行わず、起動時にだけ呼ぶ
+    """
+    global agent_history, frame_bus, frame_bus_client, recorder, density_grid, initial_demo_data
+    if app.config['PLAYBACK_RUN']:
+        agent_history = Recording(app.config['PLAYBACK_RUN'])
+    elif app.config['SERVER_ROLE'] == 'worker':
+        # 履歴は受信プロセスに問い合わせる
+        frame_bus_client = FrameBusClient(app.config['FRAME_BUS_PATH'])
+        agent_history = RemoteHistory(app.config['FRAME_BUS_PATH'], client=frame_bus_client)
+    else:
+        agent_history = FrameHistory(app.config['HISTORY_DEPTH'], app.config['HISTORY_DIR'])
+        # 書き出しファイルは再起動で使わないので、終了時に消す
+        atexit.register(agent_history.close)
+        if app.config['SERVER_ROLE'] == 'ingest':
+            frame_bus = FrameBusServer(app.config['FRAME_BUS_PATH'], agent_history)
+        if app.config['RECORD_DIR']:
+            recorder = RecordingWriter(
+                os.path.join(app.config['RECORD_DIR'], f"run-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}.run"),
+                [('id', '<i4'), ('x', '<f8'), ('y', '<f8')], codec=app.config['RECORD_CODEC'],
+                meta={'source': 'app', 'frame_columns': ['id', 'x', 'y']})
+            # 索引は閉じるときに書くので、終了時に必ず閉じる
+            atexit.register(recorder.close)
+
+    density_grid = DensityGrid(app.config['HEATMAP_RESOLUTION'], heatmap_bounds(),
+                               half_life=app.config['HEATMAP_HALF_LIFE'] or None)
+    load_road_data()
+    initial_demo_data = generate_demo_agents(app.config['DEMO_AGENTS'])
+    if frame_bus_client is not None:
+        frame_bus_client.start()
+        socketio.start_background_task(pump_frame_bus)
+    elif not app.config['PLAYBACK_RUN']:
+        # 以降のフレームと同じく、履歴・記録・ヒートマップ・道路ごとの台数に入れる
+        ingest_frame(*frame_arrays(initial_demo_data))
+    if frame_bus is not None:
+        frame_bus.start()
 
 @app.route('/')
 def index():
@@ -206,125 +465,517 @@ def map_html():
             'total_frames': 1
         })
     except Exception as e:
-        print(f"Error broadcasting initial data: {e}")
+        logger.error("Error broadcasting initial data: %s", e)
     return render_template('map.html')
 
 @app.route('/roads')
 def roads():
-    file_path = os.path.join(os.path.dirname(__file__), 'map', 'roads.json')
-    if not os.path.exists(file_path):
-        return jsonify([])
-    with open(file_path, 'r', encoding='utf-8') as f:
-        data = json.load(f)
-    return jsonify(data)
+    return layer_caches['roads'].response()
 
+# 本体の形式は Content-Type で選ぶ（ingest_codec.py を参照）。既定は JSON
+#   application/x-msgpack     : 列ごとのバイト列 {"id", "x", "y"}（msgpack パッケージが必要）
+#   application/x-agents-soa  : ids int32, xs float64, ys float64 を並べた生のバイト列
 @app.route('/data_from_gama', methods=['POST'])
 def data_from_gama():
+    rejected = ingest_disabled_error()
+    if rejected:
+        return rejected
+    trace = {}
     try:
-        data = request.get_json(force=True)  # force=True を追加
-        if not data:
-            print("No data received")
-            return jsonify({"status": "No data received"}), 400
-
-        # データ形式のデバッグ出力
-        print("Received data type:", type(data))
-        print("Received data:", data[:2] if isinstance(data, list) else data)
-
-        # データを配列に変換
-        agents_data = []
-        for agent in data:
-            agent_xy_transformed = transform_point((agent['x'],agent['y']), H)
-            try:
-                agent_data = {
-                    'id': int(agent['id']),  # 明示的に型変換
-                    'x': float(agent_xy_transformed[0]),
-                    'y': float(agent_xy_transformed[1])
-                }
-                agents_data.append(agent_data)
-            except (KeyError, ValueError, TypeError) as e:
-                print(f"Error processing agent data: {e}")
-                print(f"Problematic agent data: {agent}")
-                continue
-
-        # 履歴に追加
-        agent_history.append(agents_data)
-        current_frame = len(agent_history) - 1
+        fmt = request_format(request.mimetype)
+        if request.content_length:
+            ingest_bytes.observe(request.content_length, fmt)
+        with metrics.stage('decode', trace):
+            if fmt == 'json':
+                data = request.get_json(force=True)  # force=True を追加
+            else:
+                data = request.get_data(cache=False)
+            if not data:
+                logger.warning("No data received")
+                return jsonify({"status": "No data received"}), 400
+
+            # データ形式のデバッグ出力
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug("Received data type: %s (%s)", type(data), fmt)
+                logger.debug("Received data: %s", data[:2] if isinstance(data, list) else data[:64])
+
+            # id と x/y を配列にまとめる
+            if fmt == 'soa':
+                ids, xs, ys = decode_soa(data)
+                xy = np.column_stack([xs, ys])
+            else:
+                if fmt == 'msgpack':
+                    data = decode_msgpack(data)
+                if isinstance(data, dict) and fmt == 'msgpack':
+                    # 列ごとの形式はエージェントごとのオブジェクトを作らずに配列にする
+                    ids, xs, ys = columns_to_arrays(data)
+                    xy = np.column_stack([xs, ys])
+                elif isinstance(data, list):
+                    ids, xy = agents_to_arrays(data)
+                else:
+                    return jsonify({"status": "error", "message": "Expected a list of agents"}), 400
+            ids = ids.astype(np.int64, copy=False)
+        # 全エージェントを1回の行列積で変換
+        with metrics.stage('transform', trace):
+            transformed = transform_points(xy, H)
+            xs, ys = transformed[:, 0], transformed[:, 1]
+
+        # 履歴と集計に追加して配信キューに積む（配信はバックグラウンドに任せてすぐ応答する）
+        current_frame = ingest_frame(ids, xs, ys, trace=trace)
+        metrics.stage_seconds.observe(sum(trace.values()), 'ingest_total')
+        log_slow_frame(current_frame, len(ids), trace)
 
         # デバッグ出力
-        print(f"\n=== Frame {current_frame} ===")
-        print(f"Total agents: {len(agents_data)}")
-        for agent in agents_data[:3]:
-            print(f"Agent {agent['id']}: x={agent['x']:.2f}, y={agent['y']:.2f}")
-
-        # エージェントデータをブロードキャスト
-        socketio.emit('new_data', {
-            'agents': agents_data,
-            'frame': current_frame,
-            'total_frames': len(agent_history)
-        })
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("=== Frame %d === Total agents: %d", current_frame, len(ids))
+            for agent in frame_agents(ids[:3], xs[:3], ys[:3]):
+                logger.debug("Agent %d: x=%.2f, y=%.2f", agent['id'], agent['x'], agent['y'])
 
         return jsonify({
             "status": "success",
             "frame": current_frame,
-            "agent_count": len(agents_data)
+            "agent_count": len(ids)
         }), 200
 
+    except IngestFormatError as e:
+        logger.error("Error decoding request: %s", e)
+        return jsonify({"status": "error", "message": str(e)}), e.status
     except Exception as e:
-        print(f"Error processing request: {str(e)}")
+        logger.error("Error processing request: %s", e)
         return jsonify({"status": "error", "message": str(e)}), 400
 
 @app.route('/buildings')
 def buildings():
-    file_path = os.path.join(os.path.dirname(__file__), 'map', 'buildings.json')
-    if not os.path.exists(file_path):
-        return jsonify([])
-    with open(file_path, 'r', encoding='utf-8') as f:
-        data = json.load(f)
-    return jsonify(data)
+    return layer_caches['buildings'].response()
+
+# タイルの範囲と最大ズーム
+@app.route('/tiles/<layer>/meta')
+def tile_meta(layer):
+    if layer not in tile_sets:
+        abort(404)
+    return jsonify(tile_sets[layer].meta())
+
+# 四分木タイル（初回に作ってディスクにキャッシュ）
+@app.route('/tiles/<layer>/<int:z>/<int:x>/<int:y>')
+def tile(layer, z, x, y):
+    if layer not in tile_sets:
+        abort(404)
+    path = tile_sets[layer].get(z, x, y)
+    if path is None:
+        abort(404)
+    return send_file(path, mimetype='application/json', conditional=True, max_age=0)
+
+# 押し出した建物メッシュの格子と、建物のあるタイルの一覧
+@app.route('/buildings3d/meta')
+def building_mesh_meta():
+    return jsonify(building_meshes.meta())
+
+# タイルの建物を1つにまとめたメッシュ（glTF バイナリ。初回に作ってディスクにキャッシュ）
+@app.route('/buildings3d/<int:x>/<int:y>.glb')
+def building_mesh(x, y):
+    path = building_meshes.get(x, y)
+    if path is None:
+        abort(404)
+    return send_file(path, mimetype='model/gltf-binary', conditional=True, max_age=0)
+
+# 接続時にフレーム形式を選ぶ（io({query: {format: 'binary'}})）。既定はJSON
+@socketio.on('connect')
+def handle_connect():
+    if request.args.get('format') == 'none':
+        # グラフなどフレームを受け取らないクライアント
+        return
+    fmt = 'binary' if request.args.get('format') == 'binary' else 'json'
+    broadcaster.add_client(request.sid, fmt)
+    if fmt == 'binary' and len(agent_history):
+        # 途中から参加したクライアントには最新フレームをキーフレームで送る
+        # （次の配信フレームもこのクライアントにはキーフレームで送られる）
+        payload = encode_keyframe(len(agent_history) - 1, len(agent_history),
+                                  *agent_history.last(), quantum=frame_encoder.quantum)[0]
+        emit('new_data_bin', payload)
+
+@socketio.on('disconnect')
+def handle_disconnect(reason=None):
+    broadcaster.remove_client(request.sid)
+    heatmap_subscribers.discard(request.sid)
+    traffic_subscribers.discard(request.sid)
+    replay_requests.pop(request.sid, None)
+
+# 表示範囲の登録 {'bounds': [minx, miny, maxx, maxy], 'zoom': 1単位あたりのピクセル数}
+# bounds を省略（null）すると解除して全エージェントを受け取る。ack で結果を返す
+@socketio.on('set_viewport')
+def handle_set_viewport(data):
+    data = data or {}
+    try:
+        registered = broadcaster.set_viewport(request.sid, data.get('bounds'), data.get('zoom'))
+    except (TypeError, ValueError) as e:
+        return {'ok': False, 'error': str(e)}
+    return {'ok': registered}
+
+# ヒートマップの購読。購読中のクライアントには HEATMAP_INTERVAL ごとに量子化ラスタを送る
+heatmap_subscribers = set()
+
+@socketio.on('subscribe_heatmap')
+def handle_subscribe_heatmap():
+    global heatmap_task
+    heatmap_subscribers.add(request.sid)
+    join_room('heatmap')
+    if density_grid.bounds is not None:
+        emit('heatmap', density_grid.raster())
+    if heatmap_task is None:
+        heatmap_task = socketio.start_background_task(heatmap_loop)
+
+@socketio.on('unsubscribe_heatmap')
+def handle_unsubscribe_heatmap():
+    heatmap_subscribers.discard(request.sid)
+    leave_room('heatmap')
+
+# 道路ごとの車両数の購読（update_plot の差分を受け取る）
+traffic_subscribers = set()
+
+@socketio.on('subscribe_traffic')
+def handle_subscribe_traffic():
+    traffic_subscribers.add(request.sid)
+    join_room('traffic')
+
+def heatmap_loop():
+    sent_version = None
+    while True:
+        socketio.sleep(app.config['HEATMAP_INTERVAL'])
+        if not heatmap_subscribers or density_grid.version == sent_version:
+            continue
+        sent_version = density_grid.version
+        socketio.emit('heatmap', density_grid.raster(), to='heatmap')
 
+# 1フレームだけ要求したクライアントに返す
 @socketio.on('request_frame')
 def handle_frame_request(frame_number):
-    if 0 <= frame_number < len(agent_history):
-        socketio.emit('new_data', {
-            'agents': agent_history[frame_number],
+    if isinstance(frame_number, int) and 0 <= frame_number < len(agent_history):
+        emit('new_data', {
+            'agents': frame_agents(*agent_history.get(frame_number)),
             'frame': frame_number,
             'total_frames': len(agent_history)
         })
 
+# 再生要求: {request_id, start, end, substeps | fps と cycle_seconds, chunk}
+# 要求したクライアントにだけ frame_chunk をチャンクごとに送る。
+# 同じクライアントの新しい要求が来たら古い要求の送信は打ち切る（スライダー操作など）
+replay_requests = {}  # sid → 送信中の request_id
+
+@socketio.on('request_frames')
+def handle_request_frames(data):
+    data = data or {}
+    try:
+        request_id = data.get('request_id')
+        start = max(int(data.get('start', 0)), 0)
+        end = min(int(data.get('end', start + 1)), len(agent_history))
+        if 'substeps' in data:
+            substeps = int(data['substeps'])
+        else:
+            # GAMAの1サイクルを cycle_seconds 秒で再生するときに fps になる補間数
+            substeps = round(float(data.get('fps', 0)) * float(data.get('cycle_seconds', 0))) or 1
+        chunk = int(data.get('chunk', app.config['REPLAY_CHUNK']))
+    except (TypeError, ValueError) as e:
+        emit('frame_chunk', {'request_id': data.get('request_id'), 'error': str(e), 'done': True})
+        return
+    substeps = min(max(substeps, 1), 60)
+    chunk = min(max(chunk, 1), 256)
+    end = min(end, start + max(app.config['REPLAY_MAX_FRAMES'] // substeps, 1))
+
+    replay_requests[request.sid] = request_id
+    socketio.start_background_task(stream_frames, request.sid, request_id, start, end, substeps, chunk)
+
+def stream_frames(sid, request_id, start, end, substeps, chunk):
+    sent = False
+    if start < end:
+        for message in replay_chunks(agent_history, start, end, substeps, chunk, frame_encoder.quantum):
+            if replay_requests.get(sid) != request_id:
+                return  # 新しい要求に置き換わった・切断した
+            message.update({'request_id': request_id, 'substeps': substeps,
+                            'total_frames': len(agent_history), 'done': False})
+            socketio.emit('frame_chunk', message, to=sid)
+            sent = True
+            socketio.sleep(0)  # 他のクライアントへの配信を止めない
+    if replay_requests.get(sid) == request_id:
+        socketio.emit('frame_chunk', {'request_id': request_id, 'times': [], 'data': [],
+                                      'total_frames': len(agent_history), 'done': True}, to=sid)
+        replay_requests.pop(sid, None)
+    return sent
+
+# エージェントごとに道路上を進める参照実装
+def step_demo_scalar(ids, xs, ys):
+    new_xs = np.empty(len(xs))
+    new_ys = np.empty(len(ys))
+    for i, (x, y) in enumerate(zip(xs.tolist(), ys.tolist())):
+        # 道路に沿って移動
+        new_xs[i], new_ys[i] = get_next_road_position(x, y)
+    return ids, new_xs, new_ys
+
+# 'vector' モードのエンジンを最新フレームの状態にして返す
+def sync_demo_engine(ids, xs, ys):
+    global demo_engine, demo_engine_frame
+
+    if demo_engine is None:
+        demo_engine = RoadFollowingEngine(road_index, graph=road_graph)
+    # エンジンの状態が最新フレームと対応していなければ位置から載せ直す
+    if demo_engine_frame != len(agent_history) - 1:
+        demo_engine.place(ids, xs, ys)
+        demo_engine_frame = len(agent_history) - 1
+    return demo_engine
+
+# 全エージェントを配列で一括して進める
+def step_demo_vector(ids, xs, ys):
+    global demo_engine_frame
+
+    sync_demo_engine(ids, xs, ys).step()
+    demo_engine_frame = len(agent_history)
+    return demo_engine.positions()
+
 # デモ用のデータ更新エンドポイント
 @app.route('/update_demo', methods=['POST'])
 def update_demo():
-    global agent_history
-    
-    last_frame = agent_history[-1]
-    new_frame = []
-    
-    for agent in last_frame:
-        # 道路に沿って移動
-        new_x, new_y = get_next_road_position(agent['x'], agent['y'])
-        new_frame.append({
-            'id': agent['id'],
-            'x': new_x,
-            'y': new_y
-        })
-    
-    agent_history.append(new_frame)
-    current_frame = len(agent_history) - 1
-    
-    print(f"Frame {current_frame}: Updated {len(new_frame)} agents")
-    print(f"Sample agent position: {new_frame[0]}")
+    rejected = ingest_disabled_error()
+    if rejected:
+        return rejected
+    if sim_workers is not None:
+        return jsonify({"status": "error", "message": "Simulation workers are running"}), 409
+    engine = request.args.get('engine', app.config['DEMO_ENGINE'])
+    trace = {}
+    with metrics.stage('demo_step', trace):
+        if engine == 'vector':
+            ids, xs, ys = step_demo_vector(*agent_history.last())
+        else:
+            ids, xs, ys = step_demo_scalar(*agent_history.last())
+
+    current_frame = ingest_frame(ids, xs, ys, trace=trace)
+    log_slow_frame(current_frame, len(ids), trace)
     
-    socketio.emit('new_data', {
-        'agents': new_frame,
-        'frame': current_frame,
-        'total_frames': len(agent_history)
-    })
+    logger.debug("Frame %d: Updated %d agents", current_frame, len(ids))
+    if len(ids) and logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Sample agent position: %s", frame_agents(ids[:1], xs[:1], ys[:1])[0])
     
     return jsonify({
         "status": "success",
         "frame": current_frame,
-        "agent_count": len(new_frame)
+        "agent_count": len(ids)
     })
 
+# デモエージェントに目的地までの経路を割り当てる（'vector' モード）
+# {"destinations": [ノード番号, ...] または ノード番号} 省略時はランダムな目的地
+@app.route('/update_demo/routes', methods=['POST'])
+def assign_demo_routes():
+    if road_graph is None or road_graph.num_nodes == 0:
+        return jsonify({"status": "error", "message": "No road graph"}), 400
+    engine = sync_demo_engine(*agent_history.last())
+    data = request.get_json(silent=True) or {}
+    destinations = data.get('destinations')
+    if destinations is None:
+        destinations = np.random.randint(0, road_graph.num_nodes, len(engine))
+    try:
+        destinations = np.asarray(destinations, dtype=np.int64)
+        if np.any((destinations < 0) | (destinations >= road_graph.num_nodes)):
+            raise ValueError("destination out of range")
+        routed = engine.set_routes(destinations)
+    except (ValueError, TypeError) as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    return jsonify({"status": "success", "routed": routed, "graph": road_graph.stats()})
+
+# シミュレーションを別プロセスのワーカーで進める
+# {"agents": 台数（省略時は最新フレームのエージェント）, "workers": プロセス数, "kind": 'road' | 'model', "interval": 秒}
+@app.route('/workers/start', methods=['POST'])
+def start_workers():
+    global sim_workers
+    rejected = ingest_disabled_error()
+    if rejected:
+        return rejected
+    if sim_workers is not None:
+        return jsonify({"status": "error", "message": "Simulation workers are already running"}), 409
+    data = request.get_json(silent=True) or {}
+    kind = data.get('kind', app.config['SIM_WORKER_KIND'])
+    try:
+        count = data.get('agents')
+        if kind == 'road':
+            spec = {'kind': 'road', 'coords': np.asarray(road_index.coords), 'offsets': np.asarray(road_index.offsets)}
+            if count is None:
+                ids, xs, ys = agent_history.last()
+            else:
+                engine = RoadFollowingEngine(road_index)
+                engine.spawn(int(count))
+                ids, xs, ys = engine.positions()
+        elif kind == 'model':
+            # MinakusaModel と同じく南草津駅周辺に置く
+            spec = {'kind': 'model'}
+            count = int(count or app.config['DEMO_AGENTS'])
+            ids = np.arange(count, dtype=np.int64)
+            xs = 13550000 + np.random.uniform(-100, 100, count)
+            ys = 3480000 + np.random.uniform(-100, 100, count)
+        else:
+            raise ValueError(f"unknown kind: {kind}")
+        workers = SimulationWorkers(spec, ids, xs, ys,
+                                    num_workers=int(data.get('workers', app.config['SIM_WORKERS'])),
+                                    interval=float(data.get('interval', app.config['SIM_WORKER_INTERVAL'])))
+    except (TypeError, ValueError) as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    workers.start()
+    sim_workers = workers
+    socketio.start_background_task(pump_workers, workers)
+    return jsonify({"status": "success", **workers.stats()})
+
+def shutdown_workers():
+    global sim_workers, demo_engine_frame
+    workers, sim_workers = sim_workers, None
+    workers.stop()
+    # 'vector' のデモは最新フレームの位置から載せ直す
+    demo_engine_frame = None
+
+@app.route('/workers/stop', methods=['POST'])
+def stop_workers():
+    if sim_workers is None:
+        return jsonify({"status": "error", "message": "Simulation workers are not running"}), 409
+    shutdown_workers()
+    return jsonify({"status": "success"})
+
+@app.route('/workers/stats')
+def workers_stats():
+    if sim_workers is None:
+        return jsonify({'workers': 0})
+    return jsonify(sim_workers.stats())
+
+# ワーカーが共有メモリに公開したフレームを取り込む（イベントループを止めないよう短く眠りながら見る）
+def pump_workers(workers):
+    poll = min(0.01, workers.interval / 4)
+    while sim_workers is workers:
+        frame = workers.poll()
+        if frame is None:
+            if not workers.alive():
+                logger.error("Simulation worker exited; stopping workers")
+                shutdown_workers()
+                break
+            socketio.sleep(poll)
+            continue
+        seq, ids, xs, ys = frame
+        try:
+            ingest_frame(ids, xs, ys, shared=True)
+        finally:
+            workers.release(seq)
+        socketio.sleep(0)
+
+# 履歴のメモリ使用量
+@app.route('/history/stats')
+def history_stats():
+    return jsonify(agent_history.stats())
+
+# 車両数のグラフ
+@app.route('/graph')
+def graph_html():
+    return render_template('graph.html')
+
+# グラフの初期データ（以降は update_plot の差分で更新）
+@app.route('/get_graph_data')
+def get_graph_data():
+    if traffic_counter is None:
+        return jsonify({'graph_name': app.config['TRAFFIC_GRAPH_NAME'], 'y1': None, 'y2': None,
+                        'x_data': [], 'y_data1': [], 'y_data2': []})
+    return jsonify(traffic_counter.graph_data(app.config['TRAFFIC_GRAPH_NAME']))
+
+# 道路ごとの現在の台数
+@app.route('/traffic/roads')
+def traffic_roads():
+    if traffic_counter is None:
+        return jsonify({'frame': None, 'off_road': 0, 'roads': []})
+    return jsonify(traffic_counter.road_table())
+
+# ヒートマップの集計状態
+@app.route('/heatmap/stats')
+def heatmap_stats():
+    return jsonify(density_grid.stats())
+
+# 複数プロセス構成での受信プロセスとの接続状態
+@app.route('/bus/stats')
+def bus_stats():
+    if frame_bus is not None:
+        return jsonify({'role': 'ingest', **frame_bus.stats()})
+    if frame_bus_client is not None:
+        return jsonify({'role': 'worker', **frame_bus_client.stats()})
+    return jsonify({'role': app.config['SERVER_ROLE']})
+
+# 配信キューの深さ・捨てたフレーム数・送信遅延
+@app.route('/broadcast/stats')
+def broadcast_stats():
+    return jsonify(broadcaster.stats())
+
+# /metrics のゲージとカウンタ（出力のたびに各 stats から読む）
+def client_counts():
+    counts = {'json': 0, 'binary': 0, 'viewport': 0}
+    for state in list(broadcaster.clients.values()):
+        counts['viewport' if state.viewport else state.fmt] += 1
+    return counts
+
+metrics.gauge('mas_connected_clients', 'Connected viewers by frame format', client_counts, label='format')
+metrics.gauge('mas_lagging_clients', 'Viewers still waiting to ack the previous frame',
+              lambda: sum(state.in_flight for state in list(broadcaster.clients.values())))
+metrics.gauge('mas_heatmap_subscribers', 'Viewers subscribed to the heatmap', lambda: len(heatmap_subscribers))
+metrics.gauge('mas_broadcast_queue_depth', 'Frames waiting for the broadcaster', lambda: len(broadcaster._queue))
+metrics.gauge('mas_history_frames', 'Frames in the history', lambda: len(agent_history))
+metrics.gauge('mas_history_memory_bytes', 'Bytes of history frames held in memory',
+              lambda: agent_history.stats().get('memory_bytes'))
+metrics.gauge('mas_history_spill_bytes', 'Bytes of history frames spilled to disk',
+              lambda: agent_history.stats().get('spill_bytes'))
+for name, attr, help in (('mas_frames_published_total', 'published', 'Frames handed to the broadcaster'),
+                         ('mas_frames_broadcast_total', 'broadcasts', 'Frames sent to viewers'),
+                         ('mas_frames_coalesced_total', 'coalesced', 'Frames dropped in favour of a newer one'),
+                         ('mas_client_skipped_frames_total', 'client_skipped', 'Frames not sent to a lagging viewer'),
+                         ('mas_ack_timeouts_total', 'ack_timeouts', 'Viewers that never acked a frame'),
+                         ('mas_keyframes_resent_total', 'keyframes_resent', 'Keyframes resent to viewers that fell behind')):
+    metrics.counter(name, help, lambda attr=attr: getattr(broadcaster, attr))
+
+# Prometheus のテキスト形式
+@app.route('/metrics')
+def metrics_endpoint():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+# サンプリングプロファイラ（PROFILER_ENABLED=1 のときだけ）
+#   POST /profiler/start?interval=0.005 → 計測開始, POST /profiler/stop → 停止
+#   GET /profiler?limit=50 → 多い順の "呼び出し列 件数"（flamegraph.pl にそのまま渡せる）
+def profiler_disabled_error():
+    if app.config['PROFILER_ENABLED']:
+        return None
+    return jsonify({"status": "error", "message": "Set PROFILER_ENABLED=1 to use the profiler"}), 403
+
+@app.route('/profiler/start', methods=['POST'])
+def profiler_start():
+    global profiler
+    rejected = profiler_disabled_error()
+    if rejected:
+        return rejected
+    interval = request.args.get('interval', 0.005, type=float)
+    if not 0.0005 <= interval <= 1.0:
+        return jsonify({"status": "error", "message": "interval must be between 0.0005 and 1 s"}), 400
+    if profiler is not None:
+        profiler.stop()
+    profiler = SamplingProfiler(interval=interval)
+    profiler.start()
+    return jsonify({"status": "success", **profiler.stats()})
+
+@app.route('/profiler/stop', methods=['POST'])
+def profiler_stop():
+    rejected = profiler_disabled_error()
+    if rejected:
+        return rejected
+    if profiler is None:
+        return jsonify({"status": "error", "message": "Profiler is not running"}), 409
+    profiler.stop()
+    return jsonify({"status": "success", **profiler.stats()})
+
+@app.route('/profiler')
+def profiler_report():
+    rejected = profiler_disabled_error()
+    if rejected:
+        return rejected
+    if profiler is None:
+        return jsonify({"status": "error", "message": "Profiler has not been started"}), 409
+    return Response(profiler.collapsed(request.args.get('limit', type=int)), mimetype='text/plain')
+
 if __name__ == '__main__':
-    socketio.run(app, host='0.0.0.0', port=8000, debug=True)
+    init_server()
+    # 'ingest' / 'worker' ではリローダが同じソケットやポートを二重に使わないように debug を切る
+    socketio.run(app, host='0.0.0.0', port=app.config['PORT'], debug=app.config['SERVER_ROLE'] == 'standalone')
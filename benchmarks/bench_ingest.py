@@ -0,0 +1,83 @@
+# benchmarks/bench_ingest.py
+# /data_from_gama の本体の形式ごとの受信処理の時間を比べる
+#   decode : 本体から (ids, xs, ys) の配列にするまで
+#   post   : app.py の /data_from_gama 全体（Flask のテストクライアント。履歴と集計への追加を含む）
+# msgpack が無い環境では json と soa のみ（app.py を読み込むので地図レイヤの読み込み分だけ起動に時間がかかる）
+#
+#   python benchmarks/bench_ingest.py --agents 1000 10000 100000
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from ingest_codec import (SOA_ID, SOA_XY, available_formats, columns_to_arrays,  # noqa: E402
+                          decode_msgpack, decode_soa, msgpack)
+
+CONTENT_TYPES = {'json': 'application/json', 'msgpack': 'application/x-msgpack',
+                 'soa': 'application/x-agents-soa'}
+
+
+def encode(fmt, ids, xs, ys):
+    if fmt == 'json':
+        return json.dumps([{'id': int(i), 'x': float(x), 'y': float(y)}
+                           for i, x, y in zip(ids.tolist(), xs.tolist(), ys.tolist())]).encode('utf-8')
+    if fmt == 'msgpack':
+        return msgpack.packb({'id': ids.astype(SOA_ID).tobytes(), 'x': xs.astype(SOA_XY).tobytes(),
+                              'y': ys.astype(SOA_XY).tobytes()})
+    return ids.astype(SOA_ID).tobytes() + xs.astype(SOA_XY).tobytes() + ys.astype(SOA_XY).tobytes()
+
+
+def decode(fmt, body, agents_to_arrays):
+    """app.data_from_gama と同じ手順で本体を配列にする"""
+    if fmt == 'json':
+        return agents_to_arrays(json.loads(body))
+    if fmt == 'msgpack':
+        return columns_to_arrays(decode_msgpack(body))
+    return decode_soa(body)
+
+
+def best_of(func, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='受信形式のベンチマーク')
+    parser.add_argument('--agents', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    import app
+    app.init_server()
+    client = app.app.test_client()
+
+    formats = [fmt for fmt in ('json', 'msgpack', 'soa') if fmt in available_formats()]
+    rng = np.random.default_rng(0)
+    print(f"{'agents':>8} {'format':>8} {'size[KB]':>9} {'decode[ms]':>11} {'agents/s':>10} {'post[ms]':>9} {'frames/s':>9}")
+    for count in args.agents:
+        ids = np.arange(count)
+        xs = rng.uniform(650, 2460, count)
+        ys = rng.uniform(360, 1720, count)
+        for fmt in formats:
+            body = encode(fmt, ids, xs, ys)
+            t_decode = best_of(lambda: decode(fmt, body, app.agents_to_arrays), args.repeat)
+
+            def post():
+                response = client.post('/data_from_gama', data=body, content_type=CONTENT_TYPES[fmt])
+                assert response.status_code == 200, response.get_json()
+            t_post = best_of(post, args.repeat)
+            print(f"{count:>8} {fmt:>8} {len(body) / 1024:9.0f} {t_decode * 1000:11.2f} "
+                  f"{count / t_decode:10.0f} {t_post * 1000:9.2f} {1 / t_post:9.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,415 @@
+# benchmarks/bench_load.py
+# GAMA の送信を再現して /data_from_gama にフレームを送り続け、viewer.py と同じように受ける
+# ヘッドレスの Socket.IO クライアントで new_data の到着時刻を記録する負荷試験
+# 受信の応答時間, 送信から各クライアントへの到着までの時間（パーセンタイル）, 届かなかったフレーム数,
+# クライアントごとの受信バイト数, サーバの CPU/RSS を測り、結果を JSON に書く
+# （--baseline に前の結果を渡すと p95 を比べ、悪化していれば終了コード1）
+#
+#   python benchmarks/bench_load.py --spawn --agents 1000 10000 --clients 1 10 --rate 10 --frames 100 --output load.json
+#   python benchmarks/bench_load.py --url http://localhost:8000 --server-pid 1234 --recording static/demodata/cars.run
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+
+import numpy as np
+import socketio
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from frame_codec import HEADER  # noqa: E402
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+ROOT = os.path.join(os.path.dirname(__file__), '..')
+# 合成フレームの範囲（GAMA座標, app.py の H の基準点の範囲）
+GAMA_BOUNDS = (650.0, 360.0, 2460.0, 1720.0)
+
+
+# ---------- フレーム ----------
+def synthetic_frames(num_agents, seed=0):
+    """GAMA座標の範囲をランダムに動く num_agents 台のフレームを無限に返す"""
+    rng = np.random.default_rng(seed)
+    minx, miny, maxx, maxy = GAMA_BOUNDS
+    ids = np.arange(num_agents)
+    xs = rng.uniform(minx, maxx, num_agents)
+    ys = rng.uniform(miny, maxy, num_agents)
+    while True:
+        yield ids, xs, ys
+        xs = np.clip(xs + rng.uniform(-5, 5, num_agents), minx, maxx)
+        ys = np.clip(ys + rng.uniform(-5, 5, num_agents), miny, maxy)
+
+
+def recording_frames(path, num_agents=None):
+    """記録ファイル（generate_car_data.py --format run など）のフレームを繰り返し返す"""
+    from recording import Recording
+
+    recording = Recording(path)
+    if not len(recording):
+        raise ValueError(f"{path} has no frames")
+    while True:
+        for position in range(len(recording)):
+            ids, xs, ys = recording.get(position)
+            yield ids[:num_agents], xs[:num_agents], ys[:num_agents]
+
+
+def encode_body(ids, xs, ys):
+    """GAMA と同じ [{"id", "x", "y"}, ...] の JSON"""
+    return json.dumps([{'id': int(i), 'x': float(x), 'y': float(y)}
+                       for i, x, y in zip(ids.tolist(), xs.tolist(), ys.tolist())]).encode('utf-8')
+
+
+# ---------- サーバの CPU / RSS ----------
+def _process_tree(pid):
+    """pid とその子孫の pid（debug のリローダは子プロセスでサーバを動かすため）"""
+    if psutil is not None:
+        try:
+            parent = psutil.Process(pid)
+            return [pid] + [child.pid for child in parent.children(recursive=True)]
+        except psutil.Error:
+            return []
+    children = {}
+    for name in os.listdir('/proc'):
+        if name.isdigit():
+            try:
+                with open(f'/proc/{name}/stat') as f:
+                    ppid = int(f.read().rsplit(')', 1)[1].split()[1])
+            except (OSError, IndexError, ValueError):
+                continue
+            children.setdefault(ppid, []).append(int(name))
+    tree, stack = [], [pid]
+    while stack:
+        current = stack.pop()
+        tree.append(current)
+        stack.extend(children.get(current, []))
+    return tree
+
+
+def _cpu_rss(pid):
+    """(CPU秒, RSSバイト)。psutil が無ければ /proc から読む"""
+    if psutil is not None:
+        try:
+            process = psutil.Process(pid)
+            times = process.cpu_times()
+            return times.user + times.system, process.memory_info().rss
+        except psutil.Error:
+            return 0.0, 0
+    try:
+        with open(f'/proc/{pid}/stat') as f:
+            fields = f.read().rsplit(')', 1)[1].split()
+        with open(f'/proc/{pid}/statm') as f:
+            resident = int(f.read().split()[1])
+    except (OSError, IndexError, ValueError):
+        return 0.0, 0
+    ticks = os.sysconf('SC_CLK_TCK')
+    return (int(fields[11]) + int(fields[12])) / ticks, resident * os.sysconf('SC_PAGE_SIZE')
+
+
+class ProcessMonitor:
+    """サーバのプロセス（と子孫）の CPU 使用率と RSS を interval 秒ごとに記録する"""
+
+    def __init__(self, pid, interval=0.5):
+        self.pid = pid
+        self.interval = interval
+        self.samples = []   # (CPU使用率%, RSSバイト)
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _usage(self):
+        cpu, rss = 0.0, 0
+        for pid in _process_tree(self.pid):
+            c, r = _cpu_rss(pid)
+            cpu += c
+            rss += r
+        return cpu, rss
+
+    def _run(self):
+        last_cpu, last_at = self._usage()[0], time.perf_counter()
+        while not self._stop.wait(self.interval):
+            cpu, rss = self._usage()
+            now = time.perf_counter()
+            self.samples.append((100.0 * (cpu - last_cpu) / (now - last_at), rss))
+            last_cpu, last_at = cpu, now
+
+    def __enter__(self):
+        if self.pid is not None:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def summary(self):
+        if not self.samples:
+            return None
+        cpu = [s[0] for s in self.samples]
+        rss = [s[1] for s in self.samples]
+        return {
+            'cpu_mean_percent': float(np.mean(cpu)),
+            'cpu_max_percent': float(np.max(cpu)),
+            'rss_max_mb': max(rss) / 2 ** 20,
+            'rss_last_mb': rss[-1] / 2 ** 20,
+        }
+
+
+# ---------- 受信側 ----------
+class ViewerClient:
+    """viewer.py と同じく new_data を受けるヘッドレスのクライアント。到着時刻とサイズを記録して ack を返す"""
+
+    def __init__(self, url, fmt):
+        self.url = url
+        self.fmt = fmt
+        self.arrivals = {}   # frame → 到着時刻(perf_counter)
+        self.bytes = 0
+        self.sio = socketio.Client(reconnection=False)
+        self.sio.on('new_data', self.on_new_data)
+        self.sio.on('new_data_bin', self.on_new_data_bin)
+
+    def connect(self):
+        self.sio.connect(f'{self.url}?format={self.fmt}', wait_timeout=10)
+
+    def disconnect(self):
+        self.sio.disconnect()
+
+    def on_new_data(self, data):
+        arrived = time.perf_counter()
+        self.bytes += len(json.dumps(data, separators=(',', ':')))
+        if data and 'frame' in data:
+            self.arrivals.setdefault(data['frame'], arrived)
+        return True
+
+    def on_new_data_bin(self, data):
+        arrived = time.perf_counter()
+        self.bytes += len(data)
+        if len(data) >= HEADER.size:
+            self.arrivals.setdefault(HEADER.unpack_from(data)[3], arrived)
+        return True
+
+
+# ---------- 1回分の計測 ----------
+def post_frame(url, body, timeout):
+    request = urllib.request.Request(f'{url}/data_from_gama', data=body,
+                                     headers={'Content-Type': 'application/json'})
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        return json.loads(response.read())
+
+
+def get_json(url, path):
+    try:
+        with urllib.request.urlopen(f'{url}{path}', timeout=5) as response:
+            return json.loads(response.read())
+    except (OSError, ValueError):
+        return None
+
+
+def percentiles(samples):
+    if not len(samples):
+        return {'count': 0, 'p50_ms': None, 'p95_ms': None, 'p99_ms': None, 'max_ms': None}
+    ms = np.asarray(samples) * 1000.0
+    p50, p95, p99 = np.percentile(ms, [50, 95, 99])
+    return {'count': int(len(ms)), 'p50_ms': float(p50), 'p95_ms': float(p95),
+            'p99_ms': float(p99), 'max_ms': float(ms.max())}
+
+
+def run_load(args, frames, num_agents, num_clients, pid):
+    clients = [ViewerClient(args.url, args.format) for _ in range(num_clients)]
+    for client in clients:
+        client.connect()
+    # エンコードは計測に含めないよう先に済ませる
+    bodies = [encode_body(*next(frames)) for _ in range(min(args.frames, args.unique_frames))]
+
+    sent = {}       # frame → 送信開始時刻
+    ingest = []     # 受信の応答時間
+    errors = 0
+    period = 1.0 / args.rate if args.rate > 0 else 0.0
+    with ProcessMonitor(pid) as monitor:
+        started = time.perf_counter()
+        for k in range(args.frames):
+            # 送れなかった分は詰めずに、予定の時刻から送る
+            delay = started + k * period - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            sent_at = time.perf_counter()
+            try:
+                response = post_frame(args.url, bodies[k % len(bodies)], args.timeout)
+            except (OSError, ValueError) as e:
+                errors += 1
+                if errors == 1:
+                    print(f"  POST failed: {e}", file=sys.stderr)
+                continue
+            ingest.append(time.perf_counter() - sent_at)
+            if 'frame' in response:
+                sent[response['frame']] = sent_at
+        elapsed = time.perf_counter() - started
+        # 配信の遅れを待つ
+        time.sleep(args.drain)
+
+    latencies, received, dropped = [], [], []
+    for client in clients:
+        got = [frame for frame in sent if frame in client.arrivals]
+        latencies.extend(client.arrivals[frame] - sent[frame] for frame in got)
+        received.append(len(got))
+        dropped.append(len(sent) - len(got))
+    broadcast = get_json(args.url, '/broadcast/stats')
+    for client in clients:
+        client.disconnect()
+
+    client_bytes = [client.bytes for client in clients]
+    return {
+        'agents': num_agents,
+        'clients': num_clients,
+        'format': args.format,
+        'target_rate': args.rate,
+        'achieved_rate': len(ingest) / elapsed if elapsed > 0 else None,
+        'frames_posted': len(sent),
+        'post_errors': errors,
+        'ingest_latency': percentiles(ingest),
+        'e2e_latency': percentiles(latencies),
+        'frames_received_mean': float(np.mean(received)) if received else 0.0,
+        'dropped_frames_total': int(sum(dropped)),
+        'dropped_frames_max': int(max(dropped)) if dropped else 0,
+        'bytes_per_client_mean': float(np.mean(client_bytes)) if client_bytes else 0.0,
+        'bytes_per_frame': float(sum(client_bytes) / max(sum(received), 1)),
+        'server': monitor.summary(),
+        'broadcast_stats': broadcast,
+    }
+
+
+# ---------- サーバの起動 ----------
+def spawn_server(port, env_overrides):
+    env = dict(os.environ, PORT=str(port), **env_overrides)
+    process = subprocess.Popen([sys.executable, 'app.py'], cwd=ROOT, env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    url = f'http://127.0.0.1:{port}'
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"app.py exited with status {process.returncode}")
+        if get_json(url, '/broadcast/stats') is not None:
+            return process, url
+        time.sleep(0.5)
+    process.terminate()
+    raise RuntimeError("app.py did not start within 60 s")
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline_path, tolerance):
+    """前回の結果と (agents, clients, format) ごとに p95 を比べる。悪化した組の数を返す"""
+    with open(baseline_path, 'r', encoding='utf-8') as f:
+        baseline = {(r['agents'], r['clients'], r['format']): r for r in json.load(f)['runs']}
+    print(f"\nvs {baseline_path} (tolerance {tolerance:.0%})")
+    print(f"{'agents':>8} {'clients':>7} {'metric':>14} {'base[ms]':>9} {'now[ms]':>9} {'ratio':>6}")
+    regressions = 0
+    for run in results:
+        base = baseline.get((run['agents'], run['clients'], run['format']))
+        if base is None:
+            continue
+        for metric in ('ingest_latency', 'e2e_latency'):
+            before, now = base[metric]['p95_ms'], run[metric]['p95_ms']
+            if not before or now is None:
+                continue
+            ratio = now / before
+            flag = ''
+            if ratio > 1 + tolerance:
+                regressions += 1
+                flag = ' !'
+            print(f"{run['agents']:>8} {run['clients']:>7} {metric:>14} {before:9.1f} {now:9.1f} {ratio:6.2f}{flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='受信から配信までの負荷試験')
+    parser.add_argument('--url', default='http://localhost:8000', help='試験するサーバ（--spawn なら無視）')
+    parser.add_argument('--spawn', action='store_true', help='app.py をこのスクリプトから起動する')
+    parser.add_argument('--port', type=int, default=8765, help='--spawn で使うポート')
+    parser.add_argument('--server-pid', type=int, help='CPU/RSS を測るサーバのプロセス（--spawn なら自動）')
+    parser.add_argument('--agents', type=int, nargs='+', default=[1000, 10000])
+    parser.add_argument('--clients', type=int, nargs='+', default=[1, 10])
+    parser.add_argument('--format', choices=['json', 'binary'], default='json')
+    parser.add_argument('--rate', type=float, default=10.0, help='1秒あたりの送信フレーム数（0 なら待たずに送る）')
+    parser.add_argument('--frames', type=int, default=100, help='1回の計測で送るフレーム数')
+    parser.add_argument('--unique-frames', type=int, default=20, help='事前にエンコードして繰り返し送るフレーム数')
+    parser.add_argument('--recording', help='合成フレームの代わりに送る記録ファイル')
+    parser.add_argument('--drain', type=float, default=2.0, help='送信後に配信を待つ秒数')
+    parser.add_argument('--timeout', type=float, default=30.0)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='結果を書く JSON ファイル（未指定なら標準出力）')
+    parser.add_argument('--baseline', help='比較する前回の結果 JSON')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='p95 の悪化をどこまで許すか（割合）')
+    args = parser.parse_args()
+
+    server = None
+    pid = args.server_pid
+    if args.spawn:
+        server, args.url = spawn_server(args.port, {})
+        pid = server.pid
+
+    results = []
+    try:
+        print(f"{'agents':>8} {'clients':>7} {'rate':>6} {'ingest p50':>10} {'p95':>7} "
+              f"{'e2e p50':>8} {'p95':>7} {'p99':>7} {'dropped':>7} {'KB/client':>9} {'cpu%':>5} {'rss[MB]':>7}")
+        for num_agents in args.agents:
+            frames = (recording_frames(args.recording, num_agents) if args.recording
+                      else synthetic_frames(num_agents, args.seed))
+            for num_clients in args.clients:
+                run = run_load(args, frames, num_agents, num_clients, pid)
+                results.append(run)
+                ingest, e2e, server_usage = run['ingest_latency'], run['e2e_latency'], run['server'] or {}
+
+                def ms(value):
+                    return f"{value:.1f}" if value is not None else '-'
+                print(f"{num_agents:>8} {num_clients:>7} {run['achieved_rate']:6.1f} {ms(ingest['p50_ms']):>10} "
+                      f"{ms(ingest['p95_ms']):>7} {ms(e2e['p50_ms']):>8} {ms(e2e['p95_ms']):>7} "
+                      f"{ms(e2e['p99_ms']):>7} {run['dropped_frames_total']:>7} "
+                      f"{run['bytes_per_client_mean'] / 1024:9.0f} "
+                      f"{ms(server_usage.get('cpu_mean_percent')):>5} {ms(server_usage.get('rss_max_mb')):>7}")
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    report = {
+        'meta': {
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'revision': git_revision(),
+            'url': args.url,
+            'source': args.recording or 'synthetic',
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+            'cpu_count': os.cpu_count(),
+            'args': vars(args),
+        },
+        'runs': results,
+    }
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        print(f"Wrote {args.output}")
+    else:
+        print(json.dumps(report, indent=2))
+
+    if args.baseline and compare(results, args.baseline, args.tolerance):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,49 @@
+# benchmarks/bench_model.py
+# MinakusaModel の1ステップあたりの時間を、エージェントごとの参照実装(scalar)と
+# 座標配列を一括で動かす実装(vector)で比較する
+#
+#   python benchmarks/bench_model.py --agents 1000 10000 100000
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from model import MinakusaModel  # noqa: E402
+
+
+def time_steps(model, steps):
+    start = time.perf_counter()
+    for _ in range(steps):
+        model.step()
+        model.get_agent_positions()
+    return (time.perf_counter() - start) / steps
+
+
+def main():
+    parser = argparse.ArgumentParser(description='MinakusaModel のベンチマーク')
+    parser.add_argument('--agents', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--steps', type=int, default=20)
+    parser.add_argument('--scalar-limit', type=int, default=10000,
+                        help='これ以下のエージェント数でのみ参照実装も計測')
+    args = parser.parse_args()
+
+    print(f"{'agents':>8} {'init[s]':>8} {'vector[ms]':>11} {'steps/s':>8} {'scalar[ms]':>11}")
+    for count in args.agents:
+        start = time.perf_counter()
+        model = MinakusaModel(count, engine='vector', seed=0)
+        t_init = time.perf_counter() - start
+        t_vector = time_steps(model, args.steps)
+
+        if count <= args.scalar_limit:
+            model = MinakusaModel(count, engine='scalar', seed=0)
+            scalar_col = f"{time_steps(model, max(1, args.steps // 10)) * 1000:11.1f}"
+        else:
+            scalar_col = f"{'-':>11}"
+
+        print(f"{count:>8} {t_init:8.2f} {t_vector * 1000:11.2f} {1 / t_vector:8.0f} {scalar_col}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+# benchmarks/bench_road_engine.py
+# デモの1ステップあたりの時間を、エージェントごとの参照実装と
+# NumPyの一括ステッパー(RoadFollowingEngine)で比較する
+#
+#   python benchmarks/bench_road_engine.py --agents 1000 10000 100000
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from road_engine import RoadFollowingEngine  # noqa: E402
+from road_index import SegmentIndex  # noqa: E402
+
+ROAD_FILE = os.path.join(os.path.dirname(__file__), '..', 'static', 'road.json')
+
+
+def scalar_step(index, xs, ys, speed=10):
+    """app.get_next_road_position と同じ処理をエージェントごとに行う"""
+    out = []
+    for x, y in zip(xs, ys):
+        segment, t, _, _, _ = index.nearest(x, y)
+        dx, dy = index.heading(segment, t)
+        out.append((x + dx * speed, y + dy * speed))
+    return out
+
+
+def main():
+    parser = argparse.ArgumentParser(description='デモステッパーのベンチマーク')
+    parser.add_argument('--agents', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--steps', type=int, default=20)
+    parser.add_argument('--scalar-limit', type=int, default=2000,
+                        help='これ以下のエージェント数でのみ参照実装も計測')
+    args = parser.parse_args()
+
+    with open(ROAD_FILE, 'r', encoding='utf-8') as f:
+        index = SegmentIndex.from_features(json.load(f))
+
+    print(f"{'agents':>8} {'vector[ms]':>11} {'fps':>8} {'scalar[ms]':>11}")
+    for count in args.agents:
+        engine = RoadFollowingEngine(index, seed=0)
+        engine.spawn(count)
+
+        start = time.perf_counter()
+        for _ in range(args.steps):
+            engine.step()
+        t_vector = (time.perf_counter() - start) / args.steps
+
+        if count <= args.scalar_limit:
+            xs, ys = engine.x.tolist(), engine.y.tolist()
+            start = time.perf_counter()
+            scalar_step(index, xs, ys)
+            scalar_col = f"{(time.perf_counter() - start) * 1000:11.1f}"
+        else:
+            scalar_col = f"{'-':>11}"
+
+        print(f"{count:>8} {t_vector * 1000:11.2f} {1 / t_vector:8.0f} {scalar_col}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+# benchmarks/bench_road_index.py
+# 最近傍道路セグメント探索の1ティックあたりの時間を、
+# エージェント数とセグメント数を変えて全走査と索引で比較する
+#
+#   python benchmarks/bench_road_index.py
+#   python benchmarks/bench_road_index.py --agents 10 100 1000 --tiles 1 2 4
+import argparse
+import copy
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from road_index import SegmentIndex, scan_nearest_segment  # noqa: E402
+
+ROAD_FILE = os.path.join(os.path.dirname(__file__), '..', 'static', 'road.json')
+
+
+def tile_features(features, n):
+    """道路レイヤをn×n枚並べてセグメント数を増やす"""
+    xs = [p[0] for f in features for p in f['geometry']['coordinates']]
+    ys = [p[1] for f in features for p in f['geometry']['coordinates']]
+    w = max(xs) - min(xs)
+    h = max(ys) - min(ys)
+    tiled = []
+    for i in range(n):
+        for j in range(n):
+            for f in features:
+                g = copy.deepcopy(f)
+                g['geometry']['coordinates'] = [[x + i * w, y + j * h] for x, y in f['geometry']['coordinates']]
+                tiled.append(g)
+    return tiled
+
+
+def random_points(features, count, jitter=20.0):
+    points = []
+    for _ in range(count):
+        coords = random.choice(features)['geometry']['coordinates']
+        x, y = random.choice(coords)[:2]
+        points.append((x + random.uniform(-jitter, jitter), y + random.uniform(-jitter, jitter)))
+    return points
+
+
+def time_tick(fn, points):
+    start = time.perf_counter()
+    for x, y in points:
+        fn(x, y)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description='最近傍道路セグメント探索のベンチマーク')
+    parser.add_argument('--agents', type=int, nargs='+', default=[10, 100, 500, 1000])
+    parser.add_argument('--tiles', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--scan-limit', type=int, default=2_000_000,
+                        help='agents×segments がこれを超える組み合わせは全走査を省略')
+    args = parser.parse_args()
+
+    random.seed(0)
+    with open(ROAD_FILE, 'r', encoding='utf-8') as f:
+        base = [r for r in json.load(f) if r.get('geometry') and r['geometry'].get('coordinates')]
+
+    print(f"{'segments':>9} {'agents':>7} {'build[ms]':>10} {'index[ms]':>10} {'scan[ms]':>10} {'speedup':>8}")
+    for n in args.tiles:
+        features = tile_features(base, n)
+        start = time.perf_counter()
+        index = SegmentIndex.from_features(features)
+        build = time.perf_counter() - start
+
+        for count in args.agents:
+            points = random_points(features, count)
+            t_index = time_tick(index.nearest, points)
+
+            if count * len(index) <= args.scan_limit:
+                t_scan = time_tick(lambda x, y: scan_nearest_segment(features, x, y), points)
+                # 索引の結果が全走査と一致することを確認
+                for x, y in points[:50]:
+                    seg, t, px, py, _ = index.nearest(x, y)
+                    ref = scan_nearest_segment(features, x, y)
+                    assert abs(ref[0] - px) < 1e-6 and abs(ref[1] - py) < 1e-6
+                    assert max(abs(a - b) for a, b in zip(ref[3], index.heading(seg, t))) < 1e-9
+                scan_col = f"{t_scan * 1000:10.1f} {t_scan / t_index:7.1f}x"
+            else:
+                scan_col = f"{'-':>10} {'-':>8}"
+
+            print(f"{len(index):>9} {count:>7} {build * 1000:10.1f} {t_index * 1000:10.1f} {scan_col}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,311 @@
+import logging
+import time
+from collections import deque
+from contextlib import nullcontext
+
+import numpy as np
+
+from agent_grid import AgentGrid
+from frame_codec import KEYFRAME, encode_keyframe
+from metrics import BYTES_BUCKETS
+
+logger = logging.getLogger(__name__)
+
+
+class ClientState:
+    """接続中クライアントごとの送信状態"""
+
+    __slots__ = ('fmt', 'in_flight', 'sent_at', 'synced', 'skipped', 'viewport')
+
+    def __init__(self, fmt):
+        self.fmt = fmt            # 'json' | 'binary'
+        self.in_flight = False    # 送信済みで ack 待ち
+        self.sent_at = 0.0
+        self.synced = False       # バイナリ: 差分エンコーダと同じ状態を持っているか
+        self.skipped = 0          # 遅れのため送らなかったフレーム数
+        self.viewport = None      # (minx, miny, maxx, maxy, zoom)。None なら全エージェントを送る
+
+
+class FrameBroadcaster:
+    """
+    HTTPの受信処理から切り離してフレームを配信するバックグラウンドタスク
+    publish() はキューに積むだけですぐ戻る。配信タスクはキューに溜まったフレームのうち
+    最新の1つだけを送る（古いものは捨てる）
+    クライアントごとに ack を待ち、前のフレームの ack が返っていないクライアントには
+    そのフレームを送らない（バイナリのクライアントは追いついた時点でキーフレームから送り直す）
+    表示範囲を登録したクライアントには、フレームごとに一度作る AgentGrid から範囲（+余白）内の
+    エージェントだけを送る。ズームが小さいとき（zoom は 1ワールド単位あたりのピクセル数）や
+    範囲内が多すぎるときはセルごとの台数（clusters）にまとめる
+    範囲（+余白）が全エージェントを含み、クラスタにするズームでもなければ、範囲の無いクライアントと
+    同じ全体のストリーム（バイナリなら差分フレーム）で送る
+    metrics（MetricsRegistry）を渡すとエンコードと送信の時間、送ったフレームのバイト数を記録する
+    """
+
+    def __init__(self, socketio, encoder, frame_agents, queue_size=64, ack_timeout=5.0,
+                 latency_window=256, viewport_margin=0.1, cluster_zoom=None, max_agents=None,
+                 cluster_pixels=32, grid_resolution=256, metrics=None):
+        self.socketio = socketio
+        self.encoder = encoder
+        self.frame_agents = frame_agents
+        self.ack_timeout = ack_timeout
+        self.clients = {}  # sid → ClientState
+        self.viewport_margin = viewport_margin  # 表示範囲の幅に対する余白の割合
+        self.cluster_zoom = cluster_zoom        # これより小さいズームではクラスタで送る
+        self.max_agents = max_agents            # 範囲内がこれより多ければクラスタで送る
+        self.cluster_pixels = cluster_pixels    # クラスタ1つの画面上の大きさ
+        self.grid_resolution = grid_resolution
+        self._queue = deque(maxlen=queue_size)
+        self._wake = None
+        self._task = None
+
+        self.published = 0
+        self.broadcasts = 0
+        self.coalesced = 0         # 新しいフレームに追い越されて送らなかったフレーム数
+        self.client_skipped = 0    # 遅れているクライアントに送らなかった延べ数
+        self.keyframes_resent = 0
+        self.ack_timeouts = 0
+        self.viewport_frames = 0   # 範囲で絞って送った延べ数
+        self.cluster_frames = 0    # クラスタで送った延べ数
+        self.culled_agents = 0     # 範囲外で送らなかったエージェントの延べ数
+        self._emit_latency = deque(maxlen=latency_window)  # publish から送信完了までの秒数
+        self._ack_latency = deque(maxlen=latency_window)   # 送信から ack までの秒数
+        self.metrics = metrics
+        self._frame_bytes = None
+        if metrics is not None:
+            self._frame_bytes = metrics.histogram('mas_frame_bytes', 'Size of binary frames sent to viewers',
+                                                  'kind', BYTES_BUCKETS)
+
+    def _stage(self, name):
+        return self.metrics.stage(name) if self.metrics is not None else nullcontext()
+
+    def _observe_bytes(self, kind, payload):
+        if self._frame_bytes is not None:
+            self._frame_bytes.observe(len(payload), kind)
+
+    def start(self):
+        if self._task is None:
+            self._wake = self.socketio.server.eio.create_event()
+            self._task = self.socketio.start_background_task(self._run)
+
+    def add_client(self, sid, fmt):
+        self.clients[sid] = ClientState(fmt)
+
+    def remove_client(self, sid):
+        self.clients.pop(sid, None)
+
+    def set_viewport(self, sid, bounds, zoom):
+        """表示範囲 (minx, miny, maxx, maxy) とズームを登録する。bounds が None なら解除"""
+        state = self.clients.get(sid)
+        if state is None:
+            return False
+        if bounds is None:
+            state.viewport = None
+        else:
+            minx, miny, maxx, maxy = (float(v) for v in bounds)
+            if not (minx < maxx and miny < maxy):
+                raise ValueError("invalid viewport bounds")
+            state.viewport = (minx, miny, maxx, maxy, float(zoom) if zoom else 0.0)
+        # 全体の差分ストリームとは別の内容を受け取っていた（受け取る）ので、基準は合っていない
+        state.synced = False
+        return True
+
+    def publish(self, frame, total_frames, ids, xs, ys):
+        """フレームを配信キューに積む（ブロックしない）"""
+        if len(self._queue) == self._queue.maxlen:
+            self.coalesced += 1
+        self._queue.append((time.perf_counter(), frame, total_frames, ids, xs, ys))
+        self.published += 1
+        self.start()
+        self._wake.set()
+
+    def _run(self):
+        while True:
+            self._wake.wait()
+            self._wake.clear()
+            if not self._queue:
+                continue
+            # 溜まっていた古いフレームは捨てて最新だけ送る
+            latest = self._queue.pop()
+            self.coalesced += len(self._queue)
+            self._queue.clear()
+            try:
+                self._broadcast(*latest)
+            except Exception:
+                logger.exception("Broadcast failed")
+
+    def _ready(self, state, now):
+        if not state.in_flight:
+            return True
+        if now - state.sent_at > self.ack_timeout:
+            # ack を返さないクライアントは取りこぼしたものとして扱う
+            self.ack_timeouts += 1
+            state.in_flight = False
+            state.synced = False
+            return True
+        return False
+
+    def _culls(self, state, extent):
+        """表示範囲で絞る（またはクラスタにする）必要があるか。全エージェントが範囲内なら全体のストリームで送る"""
+        minx, miny, maxx, maxy, zoom = state.viewport
+        if self.cluster_zoom and zoom and zoom < self.cluster_zoom:
+            return True
+        if extent is None:
+            return False
+        mx = (maxx - minx) * self.viewport_margin
+        my = (maxy - miny) * self.viewport_margin
+        return not (minx - mx <= extent[0] and miny - my <= extent[1] and
+                    extent[2] <= maxx + mx and extent[3] <= maxy + my)
+
+    def _broadcast(self, queued_at, frame, total_frames, ids, xs, ys):
+        now = time.perf_counter()
+        ready = {'json': [], 'binary': [], 'viewport': []}
+        extent = None
+        if len(xs) and any(state.viewport for state in self.clients.values()):
+            extent = (float(np.min(xs)), float(np.min(ys)), float(np.max(xs)), float(np.max(ys)))
+        for sid, state in list(self.clients.items()):
+            if self._ready(state, now):
+                culled = bool(state.viewport) and self._culls(state, extent)
+                ready['viewport' if culled else state.fmt].append(sid)
+            else:
+                state.skipped += 1
+                self.client_skipped += 1
+
+        if ready['binary']:
+            with self._stage('serialize_binary'):
+                payload = self.encoder.encode(frame, total_frames, ids, xs, ys)
+            is_keyframe = payload[0] == KEYFRAME
+            self._observe_bytes('keyframe' if is_keyframe else 'delta', payload)
+            snapshot = None
+            for sid, state in self.clients.items():
+                if state.fmt == 'binary' and sid not in ready['binary']:
+                    # エンコーダが進んだので、このクライアントの差分の基準はずれた
+                    state.synced = False
+            with self._stage('emit_binary'):
+                for sid in ready['binary']:
+                    state = self.clients.get(sid)
+                    if state is None:
+                        continue
+                    if is_keyframe or state.synced:
+                        self._send(sid, state, 'new_data_bin', payload)
+                    else:
+                        if snapshot is None:
+                            snapshot = self.encoder.snapshot(frame, total_frames)
+                            self._observe_bytes('keyframe', snapshot)
+                            self.keyframes_resent += 1
+                        self._send(sid, state, 'new_data_bin', snapshot)
+                    state.synced = True
+        elif not any(state.fmt == 'binary' and state.synced for state in self.clients.values()):
+            # 差分の基準を持つバイナリのクライアントが居ない間の差分は無効なので、次はキーフレームから
+            self.encoder.force_keyframe()
+
+        if ready['json']:
+            with self._stage('serialize_json'):
+                message = {
+                    'agents': self.frame_agents(ids, xs, ys),
+                    'frame': frame,
+                    'total_frames': total_frames
+                }
+            # JSON への変換は emit の中で行われるので、その時間はここに含まれる
+            with self._stage('emit_json'):
+                for sid in ready['json']:
+                    state = self.clients.get(sid)
+                    if state is not None:
+                        self._send(sid, state, 'new_data', message)
+
+        if ready['viewport']:
+            with self._stage('emit_viewport'):
+                self._send_viewports(ready['viewport'], frame, total_frames, ids, xs, ys)
+
+        self.broadcasts += 1
+        self._emit_latency.append(time.perf_counter() - queued_at)
+
+    def _send_viewports(self, sids, frame, total_frames, ids, xs, ys):
+        with self._stage('viewport_grid'):
+            grid = AgentGrid(xs, ys, self.grid_resolution)
+        for sid in sids:
+            state = self.clients.get(sid)
+            if state is None or not state.viewport:
+                continue
+            minx, miny, maxx, maxy, zoom = state.viewport
+            mx = (maxx - minx) * self.viewport_margin
+            my = (maxy - miny) * self.viewport_margin
+            box = (minx - mx, miny - my, maxx + mx, maxy + my)
+
+            clustered = bool(self.cluster_zoom and zoom and zoom < self.cluster_zoom)
+            if not clustered and self.max_agents is not None:
+                clustered = grid.count(*box) > self.max_agents
+            if clustered:
+                # zoom が無ければ範囲の幅をおよそ64分割する
+                size = self.cluster_pixels / zoom if zoom else max(box[2] - box[0], box[3] - box[1]) / 64
+                cx, cy, counts = grid.clusters(*box, size)
+                self._send(sid, state, 'clusters', {
+                    'frame': frame,
+                    'total_frames': total_frames,
+                    'cell_size': size,
+                    'x': np.round(cx, 2).tolist(),
+                    'y': np.round(cy, 2).tolist(),
+                    'count': counts.tolist(),
+                })
+                state.synced = False
+                self.cluster_frames += 1
+                continue
+
+            inside = grid.query(*box)
+            self.culled_agents += len(ids) - len(inside)
+            if state.fmt == 'binary':
+                # 範囲内のエージェントはフレームごとに変わるので、毎回範囲内だけのキーフレームにする
+                # （全体の差分ストリームに戻るときはキーフレームから送り直す）
+                payload = encode_keyframe(frame, total_frames, ids[inside], xs[inside], ys[inside],
+                                          quantum=self.encoder.quantum)[0]
+                self._observe_bytes('viewport', payload)
+                self._send(sid, state, 'new_data_bin', payload)
+                state.synced = False
+            else:
+                self._send(sid, state, 'new_data', {
+                    'agents': self.frame_agents(ids[inside], xs[inside], ys[inside]),
+                    'frame': frame,
+                    'total_frames': total_frames
+                })
+            self.viewport_frames += 1
+
+    def _send(self, sid, state, event, data):
+        state.in_flight = True
+        state.sent_at = time.perf_counter()
+        self.socketio.emit(event, data, to=sid,
+                           callback=lambda *args, sid=sid, sent_at=state.sent_at: self._ack(sid, sent_at))
+
+    def _ack(self, sid, sent_at):
+        state = self.clients.get(sid)
+        if state is None or state.sent_at != sent_at:
+            return
+        state.in_flight = False
+        self._ack_latency.append(time.perf_counter() - sent_at)
+
+    @staticmethod
+    def _summary(samples):
+        if not samples:
+            return {'count': 0, 'mean_ms': None, 'max_ms': None}
+        return {
+            'count': len(samples),
+            'mean_ms': 1000.0 * sum(samples) / len(samples),
+            'max_ms': 1000.0 * max(samples),
+        }
+
+    def stats(self):
+        return {
+            'clients': len(self.clients),
+            'lagging_clients': sum(state.in_flight for state in self.clients.values()),
+            'queue_depth': len(self._queue),
+            'published': self.published,
+            'broadcasts': self.broadcasts,
+            'coalesced_frames': self.coalesced,
+            'client_skipped_frames': self.client_skipped,
+            'keyframes_resent': self.keyframes_resent,
+            'ack_timeouts': self.ack_timeouts,
+            'viewport_clients': sum(bool(state.viewport) for state in self.clients.values()),
+            'viewport_frames': self.viewport_frames,
+            'cluster_frames': self.cluster_frames,
+            'culled_agents': self.culled_agents,
+            'emit_latency': self._summary(self._emit_latency),
+            'ack_latency': self._summary(self._ack_latency),
+        }
@@ -0,0 +1,372 @@
+import hashlib
+import json
+import os
+import struct
+
+import numpy as np
+
+# glTF 2.0 バイナリ（GLB）の定数
+GLB_MAGIC = 0x46546C67      # 'glTF'
+CHUNK_JSON = 0x4E4F534A
+CHUNK_BIN = 0x004E4942
+FLOAT = 5126
+UNSIGNED_INT = 5125
+ARRAY_BUFFER = 34962
+ELEMENT_ARRAY_BUFFER = 34963
+
+
+def _clean_ring(ring):
+    """閉じた点（末尾＝先頭）と連続する重複点を除いた (x, y) のリスト"""
+    points = [(float(x), float(y)) for x, y in np.asarray(ring, dtype=np.float64)[:, :2]]
+    cleaned = []
+    for p in points:
+        if not cleaned or p != cleaned[-1]:
+            cleaned.append(p)
+    if len(cleaned) > 1 and cleaned[0] == cleaned[-1]:
+        cleaned.pop()
+    return cleaned
+
+
+def _signed_area(ring):
+    area = 0.0
+    for (x0, y0), (x1, y1) in zip(ring, ring[1:] + ring[:1]):
+        area += x0 * y1 - x1 * y0
+    return area / 2
+
+
+def _contains(ring, point):
+    """点が多角形の内側か（偶奇規則）"""
+    x, y = point
+    inside = False
+    for (x0, y0), (x1, y1) in zip(ring, ring[1:] + ring[:1]):
+        if (y0 > y) != (y1 > y) and x < x0 + (y - y0) * (x1 - x0) / (y1 - y0):
+            inside = not inside
+    return inside
+
+
+def group_polygons(rings):
+    """
+    リングを [外周, 穴, ...] の多角形に分ける
+    シェープファイル（外周が時計回り）と GeoJSON（反時計回り）のどちらでも使えるよう、向きではなく包含で判断する
+    外周は反時計回り、穴は時計回りにそろえる
+    """
+    rings = [r for r in (_clean_ring(r) for r in rings) if len(r) >= 3]
+    rings = [r for r in rings if _signed_area(r) != 0]
+    rings.sort(key=lambda r: -abs(_signed_area(r)))
+    polygons = []
+    for ring in rings:
+        # この点を含む外周のうち最も小さいもの（大きい順に見ているので最後に見つかったもの）
+        owner = None
+        for polygon in polygons:
+            if _contains(polygon[0], ring[0]):
+                owner = polygon
+        if owner is None:
+            polygons.append([ring if _signed_area(ring) > 0 else ring[::-1]])
+        else:
+            owner.append(ring if _signed_area(ring) < 0 else ring[::-1])
+    return polygons
+
+
+def _cross(o, a, b):
+    return (a[0] - o[0]) * (b[1] - o[1]) - (a[1] - o[1]) * (b[0] - o[0])
+
+
+def _in_triangle(p, a, b, c):
+    return _cross(a, b, p) >= 0 and _cross(b, c, p) >= 0 and _cross(c, a, p) >= 0
+
+
+def _segments_cross(p1, p2, q1, q2):
+    """2本の線分が端点以外で交わるか"""
+    d1, d2 = _cross(q1, q2, p1), _cross(q1, q2, p2)
+    d3, d4 = _cross(p1, p2, q1), _cross(p1, p2, q2)
+    return ((d1 > 0) != (d2 > 0)) and ((d3 > 0) != (d4 > 0)) and d1 and d2 and d3 and d4
+
+
+def _bridge_holes(points, outer, holes):
+    """
+    穴を外周に橋渡しして1本の頂点列にする（earcut と同じく、x の大きい穴から
+    穴の最も右の頂点と、そこから見える最も近い外周の頂点を往復する辺でつなぐ）
+    points: 全頂点, outer / holes: points の番号の列
+    """
+    polygon = list(outer)
+    for hole in sorted(holes, key=lambda h: -max(points[i][0] for i in h)):
+        start = max(range(len(hole)), key=lambda k: points[hole[k]][0])
+        h = points[hole[start]]
+        edges = [(polygon[k], polygon[(k + 1) % len(polygon)]) for k in range(len(polygon))]
+        edges += [(ring[k], ring[(k + 1) % len(ring)]) for ring in holes for k in range(len(ring))]
+        best, best_distance = None, None
+        for k, i in enumerate(polygon):
+            p = points[i]
+            distance = (p[0] - h[0]) ** 2 + (p[1] - h[1]) ** 2
+            if best is not None and distance >= best_distance:
+                continue
+            if any(_segments_cross(h, p, points[a], points[b]) for a, b in edges):
+                continue
+            best, best_distance = k, distance
+        if best is None:
+            best = 0
+        rotated = hole[start:] + hole[:start]
+        polygon = polygon[:best + 1] + rotated + [rotated[0], polygon[best]] + polygon[best + 1:]
+    return polygon
+
+
+def triangulate(polygon):
+    """
+    多角形 [外周, 穴, ...]（外周は反時計回り）を耳刈り取り法で三角形に分割する
+    戻り値: (頂点の配列 (N, 2), 三角形の頂点番号のリスト [(a, b, c), ...]（反時計回り）)
+    """
+    points = [p for ring in polygon for p in ring]
+    offsets = np.cumsum([0] + [len(ring) for ring in polygon])
+    rings = [list(range(offsets[k], offsets[k + 1])) for k in range(len(polygon))]
+    remaining = _bridge_holes(points, rings[0], rings[1:]) if len(rings) > 1 else rings[0]
+
+    triangles = []
+    guard = 0
+    while len(remaining) > 3 and guard < 2 * len(remaining):
+        n = len(remaining)
+        for k in range(n):
+            i0, i1, i2 = remaining[k - 1], remaining[k], remaining[(k + 1) % n]
+            a, b, c = points[i0], points[i1], points[i2]
+            if _cross(a, b, c) <= 0:
+                continue  # 凹頂点（または一直線）
+            if any(_in_triangle(points[j], a, b, c) for j in remaining
+                   if j not in (i0, i1, i2) and points[j] not in (a, b, c)):
+                continue
+            triangles.append((i0, i1, i2))
+            del remaining[k]
+            guard = 0
+            break
+        else:
+            # 耳が見つからない（自己交差など）。一直線の頂点を落として続ける
+            guard += 1
+            k = min(range(n), key=lambda k: abs(_cross(points[remaining[k - 1]], points[remaining[k]],
+                                                       points[remaining[(k + 1) % n]])))
+            if _cross(points[remaining[k - 1]], points[remaining[k]], points[remaining[(k + 1) % n]]) > 0:
+                triangles.append((remaining[k - 1], remaining[k], remaining[(k + 1) % n]))
+            del remaining[k]
+    if len(remaining) == 3 and _cross(*(points[i] for i in remaining)) > 0:
+        triangles.append(tuple(remaining))
+    return np.asarray(points, dtype=np.float64).reshape(-1, 2), triangles
+
+
+class MeshBuilder:
+    """押し出した建物の頂点・法線・インデックスを1つのバッファにまとめる（Three.js の座標: x, 高さ, y）"""
+
+    def __init__(self):
+        self.positions = []
+        self.normals = []
+        self.indices = []
+        self.count = 0
+        self.buildings = 0
+
+    def _add_vertices(self, positions, normal):
+        self.positions.append(positions)
+        self.normals.append(np.broadcast_to(np.asarray(normal, dtype=np.float32), positions.shape))
+        base = self.count
+        self.count += len(positions)
+        return base
+
+    def add_building(self, rings, height, base=0.0):
+        """footprint のリングを height まで押し出して加える（屋根と壁。床は見えないので作らない）"""
+        added = False
+        for polygon in group_polygons(rings):
+            points, triangles = triangulate(polygon)
+            if not triangles:
+                continue
+            added = True
+            # 屋根: 平面の反時計回りは上(+y)から見ると時計回りなので向きを反転
+            roof = np.column_stack([points[:, 0], np.full(len(points), height), points[:, 1]])
+            start = self._add_vertices(roof, (0.0, 1.0, 0.0))
+            self.indices.append(np.asarray(triangles, dtype=np.int64)[:, [0, 2, 1]].ravel() + start)
+
+            # 壁: 辺ごとに4頂点（面ごとの法線のため頂点は共有しない）
+            for ring in polygon:
+                ring = np.asarray(ring, dtype=np.float64)
+                p, q = ring, np.roll(ring, -1, axis=0)
+                d = q - p
+                length = np.hypot(d[:, 0], d[:, 1])
+                keep = length > 0
+                p, q, d, length = p[keep], q[keep], d[keep], length[keep]
+                m = len(p)
+                if not m:
+                    continue
+                quad = np.empty((m, 4, 3))
+                quad[:, 0] = np.column_stack([p[:, 0], np.full(m, base), p[:, 1]])
+                quad[:, 1] = np.column_stack([q[:, 0], np.full(m, base), q[:, 1]])
+                quad[:, 2] = np.column_stack([q[:, 0], np.full(m, height), q[:, 1]])
+                quad[:, 3] = np.column_stack([p[:, 0], np.full(m, height), p[:, 1]])
+                # 外向きの法線（外周は反時計回り, 穴は時計回りなので右手側が外）
+                normal = np.column_stack([d[:, 1] / length, np.zeros(m), -d[:, 0] / length])
+                start = self.count
+                self.positions.append(quad.reshape(-1, 3))
+                self.normals.append(np.repeat(normal, 4, axis=0))
+                self.count += 4 * m
+                corners = start + 4 * np.arange(m)[:, None]
+                self.indices.append((corners + np.array([0, 2, 1, 0, 3, 2])).ravel())
+        if added:
+            self.buildings += 1
+        return added
+
+    def arrays(self):
+        """(positions float32 (N, 3), normals float32 (N, 3), indices uint32 (M,))"""
+        if not self.count:
+            return np.zeros((0, 3), np.float32), np.zeros((0, 3), np.float32), np.zeros(0, np.uint32)
+        return (np.concatenate(self.positions).astype(np.float32),
+                np.concatenate(self.normals).astype(np.float32),
+                np.concatenate(self.indices).astype(np.uint32))
+
+
+def encode_glb(positions, normals, indices, translation=(0.0, 0.0, 0.0), color=(0.82, 0.75, 0.69, 1.0), extras=None):
+    """1つのメッシュ（POSITION, NORMAL, インデックス）の GLB を作る。頂点は translation からの相対座標"""
+    blobs = [positions.astype('<f4').tobytes(), normals.astype('<f4').tobytes(), indices.astype('<u4').tobytes()]
+    views, offset = [], 0
+    for blob, target in zip(blobs, (ARRAY_BUFFER, ARRAY_BUFFER, ELEMENT_ARRAY_BUFFER)):
+        views.append({'buffer': 0, 'byteOffset': offset, 'byteLength': len(blob), 'target': target})
+        offset += len(blob)
+    binary = b''.join(blobs)
+    binary += b'\0' * (-len(binary) % 4)
+
+    lo = positions.min(axis=0).tolist() if len(positions) else [0.0] * 3
+    hi = positions.max(axis=0).tolist() if len(positions) else [0.0] * 3
+    gltf = {
+        'asset': {'version': '2.0', 'generator': 'multi_agent_simulation_viewer building_mesh'},
+        'scene': 0,
+        'scenes': [{'nodes': [0]}],
+        'nodes': [{'mesh': 0, 'translation': list(translation)}],
+        'meshes': [{'primitives': [{'attributes': {'POSITION': 0, 'NORMAL': 1}, 'indices': 2, 'material': 0}]}],
+        'materials': [{'pbrMetallicRoughness': {'baseColorFactor': list(color), 'metallicFactor': 0.0}}],
+        'buffers': [{'byteLength': len(binary)}],
+        'bufferViews': views,
+        'accessors': [
+            {'bufferView': 0, 'componentType': FLOAT, 'count': len(positions), 'type': 'VEC3', 'min': lo, 'max': hi},
+            {'bufferView': 1, 'componentType': FLOAT, 'count': len(normals), 'type': 'VEC3'},
+            {'bufferView': 2, 'componentType': UNSIGNED_INT, 'count': len(indices), 'type': 'SCALAR'},
+        ],
+        'extras': extras or {},
+    }
+    body = json.dumps(gltf, separators=(',', ':')).encode('utf-8')
+    body += b' ' * (-len(body) % 4)
+    length = 12 + 8 + len(body) + 8 + len(binary)
+    return b''.join([struct.pack('<III', GLB_MAGIC, 2, length),
+                     struct.pack('<II', len(body), CHUNK_JSON), body,
+                     struct.pack('<II', len(binary), CHUNK_BIN), binary])
+
+
+class BuildingMeshSet:
+    """
+    建物の footprint を三角形分割・押し出しし、タイルごとに1つの GLB（頂点・法線・インデックスのバッファ）にまとめる
+    建物は重心のあるタイル（ズーム zoom の格子）に入れる。タイルは初回に作って
+    cache_dir/<name>/<元ファイルと設定のsha1>/z/x/y.glb に保存する
+    source() は建物ごとに (リングのリスト, 高さの元の値) を返す。transform は座標をビューア座標にする関数（None ならそのまま）
+    高さ = 元の値 × height_scale（0 や欠損なら default_height）× vertical_scale（ビューア座標の1mの長さ）
+    """
+
+    def __init__(self, name, path, source, transform, cache_dir, zoom=2, height_scale=3.0,
+                 default_height=10.0, vertical_scale=1.0):
+        self.name = name
+        self.path = path
+        self.source = source
+        self.transform = transform
+        self.cache_dir = cache_dir
+        self.zoom = zoom
+        self.height_scale = height_scale
+        self.default_height = default_height
+        self.vertical_scale = vertical_scale
+        self._mtime = None
+        self._loaded = False
+
+    def _refresh(self):
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            mtime = None
+        if self._loaded and mtime == self._mtime:
+            return
+
+        digest = hashlib.sha1()
+        self.buildings = []   # (リング（ビューア座標）, 高さ)
+        if mtime is not None:
+            with open(self.path, 'rb') as f:
+                digest.update(f.read())
+            for rings, raw_height in self.source():
+                rings = [np.asarray(r, dtype=np.float64)[:, :2] for r in rings if len(r) >= 3]
+                if self.transform is not None:
+                    rings = [self.transform(r) for r in rings]
+                if rings:
+                    self.buildings.append((rings, self._height(raw_height)))
+        digest.update(repr((self.zoom, self.height_scale, self.default_height, self.vertical_scale)).encode())
+
+        if self.buildings:
+            boxes = np.array([(*np.concatenate(r).min(axis=0), *np.concatenate(r).max(axis=0))
+                              for r, _ in self.buildings])
+            lo, hi = boxes[:, :2].min(axis=0), boxes[:, 2:].max(axis=0)
+            centers = (boxes[:, :2] + boxes[:, 2:]) / 2
+        else:
+            lo, hi, centers = np.zeros(2), np.ones(2), np.zeros((0, 2))
+        self.origin = lo
+        self.size = float(max(hi - lo)) * 1.001 or 1.0
+        n = 2 ** self.zoom
+        cells = np.clip(((centers - lo) / (self.size / n)).astype(np.int64), 0, n - 1)
+        self.tile_of = cells[:, 0] * n + cells[:, 1]
+
+        self.source_hash = digest.hexdigest()
+        self._mtime = mtime
+        self._loaded = True
+
+    def _height(self, raw):
+        try:
+            value = float(raw)
+        except (TypeError, ValueError):
+            value = 0.0
+        height = value * self.height_scale if value > 0 else self.default_height
+        return height * self.vertical_scale
+
+    def meta(self):
+        """格子と建物のあるタイルの一覧（map3d.js はこれを見て全タイルを読む）"""
+        self._refresh()
+        n = 2 ** self.zoom
+        tiles = sorted({(int(t) // n, int(t) % n) for t in self.tile_of})
+        return {
+            'layer': self.name,
+            'origin': self.origin.tolist(),
+            'size': self.size,
+            'zoom': self.zoom,
+            'tiles': [list(t) for t in tiles],
+            'buildings': len(self.buildings),
+            'source': self.source_hash,
+        }
+
+    def tile_path(self, x, y):
+        self._refresh()
+        return os.path.join(self.cache_dir, self.name, self.source_hash, str(self.zoom), str(x), f'{y}.glb')
+
+    def get(self, x, y):
+        """タイルの GLB のファイルパスを返す（無ければ作って保存する）。範囲外ならNone"""
+        n = 2 ** self.zoom
+        if not (0 <= x < n and 0 <= y < n):
+            return None
+        path = self.tile_path(x, y)
+        if not os.path.exists(path):
+            body = self.build(x, y)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp = f'{path}.{os.getpid()}.tmp'
+            with open(tmp, 'wb') as f:
+                f.write(body)
+            os.replace(tmp, path)
+        return path
+
+    def build(self, x, y):
+        """タイル(x, y)に重心がある建物を1つのメッシュにまとめた GLB"""
+        self._refresh()
+        n = 2 ** self.zoom
+        step = self.size / n
+        # float32 の精度を保つため、頂点はタイルの中心からの相対座標にする
+        cx = self.origin[0] + (x + 0.5) * step
+        cy = self.origin[1] + (y + 0.5) * step
+        builder = MeshBuilder()
+        for k in np.nonzero(self.tile_of == x * n + y)[0].tolist():
+            rings, height = self.buildings[k]
+            builder.add_building([r - (cx, cy) for r in rings], height)
+        positions, normals, indices = builder.arrays()
+        return encode_glb(positions, normals, indices, translation=(cx, 0.0, cy),
+                          extras={'layer': self.name, 'x': x, 'y': y, 'buildings': builder.buildings})
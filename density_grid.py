@@ -0,0 +1,92 @@
+import time
+
+import numpy as np
+
+
+class DensityGrid:
+    """
+    ビューア座標（Three.js の x, z 平面）上のエージェント密度グリッド
+    フレームを受け取るたびに np.bincount で一括して加算する
+    half_life（秒）を指定すると古いフレームの寄与を指数的に減衰させる（未指定なら累積）
+    bounds (minx, miny, maxx, maxy) を省略すると最初のフレームの範囲から決める
+    """
+
+    def __init__(self, resolution=256, bounds=None, half_life=None):
+        self.resolution = int(resolution)
+        self.half_life = half_life
+        self.grid = np.zeros(self.resolution * self.resolution, dtype=np.float64)
+        self.bounds = None
+        self.frame = None
+        self.version = 0       # 加算のたびに増える（配信側の変更検知用）
+        self.outside = 0       # 範囲外で数えなかった点の数
+        self._updated_at = None
+        if bounds is not None:
+            self.set_bounds(bounds)
+
+    def set_bounds(self, bounds):
+        minx, miny, maxx, maxy = (float(v) for v in bounds)
+        # 正方形のセルにするため長い辺に合わせる
+        self.cell_size = max(maxx - minx, maxy - miny, 1e-9) / self.resolution
+        self.bounds = (minx, miny, minx + self.cell_size * self.resolution, miny + self.cell_size * self.resolution)
+        self.grid[:] = 0.0
+
+    def _fit(self, xs, ys):
+        minx, maxx = float(xs.min()), float(xs.max())
+        miny, maxy = float(ys.min()), float(ys.max())
+        pad = max(maxx - minx, maxy - miny, 1.0) * 0.25
+        self.set_bounds((minx - pad, miny - pad, maxx + pad, maxy + pad))
+
+    def decay(self, now=None):
+        """前回の更新からの経過時間ぶん減衰させる"""
+        now = time.monotonic() if now is None else now
+        if self.half_life and self._updated_at is not None:
+            self.grid *= 0.5 ** ((now - self._updated_at) / self.half_life)
+        self._updated_at = now
+
+    def add(self, frame, xs, ys, now=None):
+        """1フレーム分の位置を加算する"""
+        xs = np.asarray(xs, dtype=np.float64)
+        ys = np.asarray(ys, dtype=np.float64)
+        if self.bounds is None:
+            if len(xs) == 0:
+                return
+            self._fit(xs, ys)
+        self.decay(now)
+
+        cx = np.floor((xs - self.bounds[0]) / self.cell_size).astype(np.int64)
+        cy = np.floor((ys - self.bounds[1]) / self.cell_size).astype(np.int64)
+        inside = (cx >= 0) & (cx < self.resolution) & (cy >= 0) & (cy < self.resolution)
+        self.outside += int(len(xs) - np.count_nonzero(inside))
+        cells = cy[inside] * self.resolution + cx[inside]
+        self.grid += np.bincount(cells, minlength=len(self.grid))
+        self.frame = frame
+        self.version += 1
+
+    def raster(self):
+        """
+        uint8 に量子化したラスタ（行 = y, 列 = x, 行0 が miny 側）
+        値は max の何割かを 0..255 で表す。scale に max を入れて返す
+        """
+        peak = float(self.grid.max()) if len(self.grid) else 0.0
+        if peak > 0:
+            data = np.round(self.grid * (255.0 / peak)).astype(np.uint8)
+        else:
+            data = np.zeros(len(self.grid), dtype=np.uint8)
+        return {
+            'frame': self.frame,
+            'width': self.resolution,
+            'height': self.resolution,
+            'bounds': list(self.bounds) if self.bounds is not None else None,
+            'scale': peak,
+            'data': data.tobytes(),
+        }
+
+    def stats(self):
+        return {
+            'resolution': self.resolution,
+            'bounds': list(self.bounds) if self.bounds is not None else None,
+            'half_life': self.half_life,
+            'frame': self.frame,
+            'total': float(self.grid.sum()),
+            'outside': self.outside,
+        }
@@ -1,12 +1,58 @@
 from flask import Flask, jsonify, request
 import random
 
+from ingest_codec import IngestFormatError, columns_to_arrays, decode_msgpack, decode_soa, request_format
+from snapshot_cache import SnapshotCache
+
 app = Flask(__name__)
 
 # ---- グローバル変数（GAMAからのエージェント情報を格納）----
 agents = []           # [{ 'agent_reference': 'xxx' }, ... ]
 gama_references = {}  # { 'Intersection_model[0].Car[0]': {...}, ... }
 
+
+def build_response_data():
+    """/get_data が返す内容（GAMAからの受信ごとに一度だけ作ってシリアライズする）"""
+    return {
+        'status': 'success',
+        'data': {
+            'gama_contents': {
+                'agents': agents
+            },
+            'gama_references': gama_references
+        }
+    }
+
+
+def arrays_to_agents(ids, xs, ys):
+    """配列で受け取ったエージェントを /get_data の {'id','x','y'} のリストにする（受信ごとに一度）"""
+    return [{'id': i, 'x': x, 'y': y} for i, x, y in zip(ids.tolist(), xs.tolist(), ys.tolist())]
+
+
+def read_gama_data():
+    """
+    Content-Type に応じて本体を {'agents', 'gama_references'} にする（ingest_codec.py を参照）
+      JSON / MessagePack : {'agents': [...], 'gama_references': {...}}
+                           MessagePack では agents を列 {'id': bin, 'x': bin, 'y': bin} にもできる
+      生の配列           : ids int32, xs float64, ys float64 を並べたバイト列（gama_references は空）
+    """
+    fmt = request_format(request.mimetype)
+    if fmt == 'json':
+        return request.get_json()
+    body = request.get_data(cache=False)
+    if not body:
+        return None
+    if fmt == 'soa':
+        return {'agents': arrays_to_agents(*decode_soa(body)), 'gama_references': {}}
+    data = decode_msgpack(body)
+    if isinstance(data, dict) and isinstance(data.get('agents'), dict):
+        data['agents'] = arrays_to_agents(*columns_to_arrays(data['agents']))
+    return data
+
+
+# 最新の /get_data の応答（バージョン付き, シリアライズ済み）
+snapshot = SnapshotCache(build_response_data())
+
 # -------------------------------
 #  ① GAMAからデータを受け取るためのエンドポイント
 # -------------------------------
@@ -16,17 +62,21 @@ def data_from_gama():
     GAMAシミュレーション側がPOSTするエージェントの位置・状態情報を受け取る。
     受け取ったデータをグローバル変数に保存。
     """
-    data = request.get_json()  # 例: {'agents': [...], 'gama_references': {...}}
-    if not data:
+    try:
+        data = read_gama_data()  # 例: {'agents': [...], 'gama_references': {...}}
+    except IngestFormatError as e:
+        return jsonify({"status": "error", "message": str(e)}), e.status
+    if not data or not isinstance(data, dict):
         return jsonify({"status": "error", "message": "No data received"}), 400
 
     # data は { 'agents': [...], 'gama_references': {...} } の形式を想定
     global agents, gama_references
     agents = data.get('agents', [])
     gama_references = data.get('gama_references', {})
+    version = snapshot.publish(build_response_data())
 
-    print(f"Received from GAMA: {len(agents)} agents.")
-    return jsonify({"status": "success"}), 200
+    print(f"Received from GAMA: {len(agents)} agents (version {version}).")
+    return jsonify({"status": "success", "version": version}), 200
 
 
 # -------------------------------
@@ -36,21 +86,17 @@ def data_from_gama():
 def get_data():
     """
     Viewer (matplotlib等)がアクセスし、GAMAから受け取った最新のエージェント位置情報を返す。
+    受信時に作ったシリアライズ済みの応答を返すので、ポーリングするViewerが増えても作り直さない。
+      ?since=<token>    : それより新しいデータが届くまで待つ（ロングポーリング, 更新が無ければ 304）
+                          token は前回の X-Snapshot-Token（数値の version も可）。再起動前のものなら待たずに返す
+      If-None-Match     : 前回の ETag と同じなら 304
     """
-    response_data = {
-        'status': 'success',
-        'data': {
-            'gama_contents': {
-                'agents': agents
-            },
-            'gama_references': gama_references
-        }
-    }
-    return jsonify(response_data)
+    return snapshot.response()
 
 # -------------------------------
 #   メイン
 # -------------------------------
 if __name__ == '__main__':
     # Flaskを起動 (portやhostは環境に合わせて調整)
-    app.run(host='0.0.0.0', port=8000, debug=True)
\ No newline at end of file
+    # ロングポーリング中のリクエストがスレッドを占有するので threaded で動かす
+    app.run(host='0.0.0.0', port=8000, debug=True, threaded=True)
\ No newline at end of file
@@ -0,0 +1,377 @@
+import logging
+import os
+import queue
+import socket
+import struct
+import threading
+import time
+from collections import OrderedDict, deque
+
+import numpy as np
+from eventlet import tpool
+
+logger = logging.getLogger(__name__)
+
+# メッセージ: 長さ(uint32, 種類を含む) + 種類(uint8) + 本体
+PREFIX = struct.Struct('<IB')
+MSG_SUBSCRIBE = 1   # 本体なし。以降このコネクションにフレームを流す
+MSG_FRAME = 2       # FRAME_HEADER + 原点(float64×2) + ids(int32×n) + xy(float32×2n)
+MSG_GET = 3         # 本体: フレーム番号(int64)。MSG_FRAME か MSG_MISSING で答える
+MSG_MISSING = 4     # 本体: フレーム番号(int64), 総フレーム数(int64)
+FRAME_HEADER = struct.Struct('<qqI')  # frame, total_frames, n
+INT64 = struct.Struct('<q')
+MISSING = struct.Struct('<qq')
+
+
+def encode_frame(frame, total_frames, ids, xs, ys):
+    """FrameHistory の書き出しと同じ形（原点からの差分をfloat32）でフレームを詰める"""
+    ids = np.asarray(ids, dtype='<i4')
+    xs = np.asarray(xs, dtype=np.float64)
+    ys = np.asarray(ys, dtype=np.float64)
+    origin = np.array([np.round(xs.mean()) if len(xs) else 0.0,
+                       np.round(ys.mean()) if len(ys) else 0.0], dtype='<f8')
+    xy = np.empty((len(ids), 2), dtype='<f4')
+    xy[:, 0] = xs - origin[0]
+    xy[:, 1] = ys - origin[1]
+    body = b''.join((FRAME_HEADER.pack(frame, total_frames, len(ids)), origin.tobytes(), ids.tobytes(), xy.tobytes()))
+    return PREFIX.pack(len(body) + 1, MSG_FRAME) + body
+
+
+def decode_frame(body):
+    """encode_frame の本体を (frame, total_frames, ids, xs, ys) に戻す"""
+    frame, total_frames, n = FRAME_HEADER.unpack_from(body)
+    offset = FRAME_HEADER.size
+    origin = np.frombuffer(body, dtype='<f8', count=2, offset=offset)
+    ids = np.frombuffer(body, dtype='<i4', count=n, offset=offset + 16)
+    xy = np.frombuffer(body, dtype='<f4', count=2 * n, offset=offset + 16 + 4 * n).reshape(n, 2)
+    # float32 のままだと大きな座標で整数単位に丸まるので、float64 にしてから原点を足す
+    return frame, total_frames, ids, xy[:, 0].astype(np.float64) + origin[0], xy[:, 1].astype(np.float64) + origin[1]
+
+
+def send_message(sock, kind, body=b''):
+    sock.sendall(PREFIX.pack(len(body) + 1, kind) + body)
+
+
+def recv_exact(sock, size):
+    buf = bytearray(size)
+    view = memoryview(buf)
+    got = 0
+    while got < size:
+        n = sock.recv_into(view[got:])
+        if n == 0:
+            raise ConnectionError("frame bus connection closed")
+        got += n
+    return bytes(buf)
+
+
+def recv_message(sock):
+    length, kind = PREFIX.unpack(recv_exact(sock, PREFIX.size))
+    return kind, recv_exact(sock, length - 1) if length > 1 else b''
+
+
+class _Subscriber:
+    """購読中のコネクション1本分。送信はこのコネクション専用のスレッドが行う"""
+
+    def __init__(self, conn, queue_size):
+        self.conn = conn
+        self.lock = threading.Lock()      # 配信と履歴の応答が同じソケットに書くため
+        self.pending = deque(maxlen=queue_size)
+        self.ready = threading.Condition()
+        self.subscribed = False
+        self.dropped = 0
+        self.closed = False
+
+    def push(self, message):
+        with self.ready:
+            if len(self.pending) == self.pending.maxlen:
+                self.dropped += 1
+            self.pending.append(message)
+            self.ready.notify()
+
+    def send(self, data):
+        with self.lock:
+            self.conn.sendall(data)
+
+
+class FrameBusServer:
+    """
+    受信プロセス側の Unix ソケットの pub/sub
+    publish() は各フレームを一度だけエンコードし、購読中の全コネクションのキューに積む
+    （遅い購読者のキューは古いものから捨てる）。同じソケットで MSG_GET によるフレームの要求にも
+    history から答えるので、配信プロセスは履歴を持たずに request_frame などを処理できる
+    OS のスレッドで動くので、eventlet のイベントループは送信で止まらない
+    """
+
+    def __init__(self, path, history, queue_size=16):
+        self.path = path
+        self.history = history
+        self.queue_size = queue_size
+        self.subscribers = []
+        self._lock = threading.Lock()
+        self._sock = None
+        self.published = 0
+        self.requests = 0
+
+    def start(self):
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._sock.bind(self.path)
+        self._sock.listen(64)
+        threading.Thread(target=self._accept_loop, name='frame-bus-accept', daemon=True).start()
+        logger.info("Frame bus listening on %s", self.path)
+
+    def _accept_loop(self):
+        while True:
+            try:
+                conn, _ = self._sock.accept()
+            except OSError:
+                return
+            subscriber = _Subscriber(conn, self.queue_size)
+            with self._lock:
+                self.subscribers.append(subscriber)
+            threading.Thread(target=self._read_loop, args=(subscriber,), daemon=True).start()
+            threading.Thread(target=self._send_loop, args=(subscriber,), daemon=True).start()
+
+    def _read_loop(self, subscriber):
+        try:
+            while True:
+                kind, body = recv_message(subscriber.conn)
+                if kind == MSG_SUBSCRIBE:
+                    subscriber.subscribed = True
+                elif kind == MSG_GET:
+                    self.requests += 1
+                    subscriber.send(self._lookup(INT64.unpack(body)[0]))
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            self._drop(subscriber)
+
+    def _lookup(self, frame):
+        total = len(self.history)
+        try:
+            ids, xs, ys = self.history.get(frame)
+        except IndexError:
+            return PREFIX.pack(1 + MISSING.size, MSG_MISSING) + MISSING.pack(frame, total)
+        return encode_frame(frame, total, ids, xs, ys)
+
+    def _send_loop(self, subscriber):
+        try:
+            while not subscriber.closed:
+                with subscriber.ready:
+                    while not subscriber.pending and not subscriber.closed:
+                        subscriber.ready.wait(1.0)
+                    if subscriber.closed:
+                        return
+                    message = subscriber.pending.popleft()
+                subscriber.send(message)
+        except OSError:
+            self._drop(subscriber)
+
+    def _drop(self, subscriber):
+        with subscriber.ready:
+            subscriber.closed = True
+            subscriber.ready.notify()
+        with self._lock:
+            if subscriber in self.subscribers:
+                self.subscribers.remove(subscriber)
+        try:
+            subscriber.conn.close()
+        except OSError:
+            pass
+
+    def publish(self, frame, total_frames, ids, xs, ys):
+        """フレームを購読者全員のキューに積む（ブロックしない）"""
+        with self._lock:
+            targets = [s for s in self.subscribers if s.subscribed]
+        self.published += 1
+        if not targets:
+            return
+        message = encode_frame(frame, total_frames, ids, xs, ys)
+        for subscriber in targets:
+            subscriber.push(message)
+
+    def stats(self):
+        with self._lock:
+            subscribers = list(self.subscribers)
+        return {
+            'path': self.path,
+            'connections': len(subscribers),
+            'subscribers': sum(s.subscribed for s in subscribers),
+            'published': self.published,
+            'history_requests': self.requests,
+            'dropped': sum(s.dropped for s in subscribers),
+        }
+
+    def close(self):
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+        for subscriber in list(self.subscribers):
+            self._drop(subscriber)
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+
+class FrameBusClient:
+    """
+    配信プロセス側の購読者。受信は OS のスレッドで行い、イベントループからは poll() で取り出す
+    接続が切れたら retry 秒ごとに繋ぎ直す
+    """
+
+    def __init__(self, path, queue_size=16, retry=1.0):
+        self.path = path
+        self.retry = retry
+        self.frames = queue.Queue(maxsize=queue_size)
+        self.received = 0
+        self.dropped = 0
+        self.connected = False
+        self.last_frame = None     # 最後に受け取った (frame, total_frames)
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='frame-bus-client', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+                    sock.connect(self.path)
+                    send_message(sock, MSG_SUBSCRIBE)
+                    self.connected = True
+                    logger.info("Subscribed to frame bus %s", self.path)
+                    while True:
+                        kind, body = recv_message(sock)
+                        if kind == MSG_FRAME:
+                            self._put(decode_frame(body))
+            except (ConnectionError, OSError) as e:
+                if self.connected:
+                    logger.warning("Frame bus disconnected: %s", e)
+                self.connected = False
+                time.sleep(self.retry)
+
+    def _put(self, frame):
+        self.received += 1
+        self.last_frame = frame[:2]
+        while True:
+            try:
+                self.frames.put_nowait(frame)
+                return
+            except queue.Full:
+                # 取り出しが追いつかなければ古いものから捨てる
+                try:
+                    self.frames.get_nowait()
+                    self.dropped += 1
+                except queue.Empty:
+                    pass
+
+    def poll(self):
+        """受信済みのフレーム (frame, total_frames, ids, xs, ys) を古い順にすべて返す"""
+        frames = []
+        while True:
+            try:
+                frames.append(self.frames.get_nowait())
+            except queue.Empty:
+                return frames
+
+    def stats(self):
+        return {
+            'path': self.path,
+            'connected': self.connected,
+            'received': self.received,
+            'dropped': self.dropped,
+            'last_frame': self.last_frame[0] if self.last_frame else None,
+        }
+
+
+class RemoteHistory:
+    """
+    FrameBusServer に MSG_GET で問い合わせる FrameHistory 互換の読み出し専用の履歴
+    フレームは変わらないので LRU でキャッシュする。len() は購読で知った総フレーム数
+    問い合わせは eventlet の tpool（OS のスレッド）で行うので、受信プロセスが応答しなくてもイベントループは止まらない
+    """
+
+    def __init__(self, path, client=None, cache_size=256, timeout=2.0):
+        self.path = path
+        self.client = client
+        self.timeout = timeout
+        self._cache = OrderedDict()
+        self.cache_size = cache_size
+        self._sock = None
+        self._lock = threading.Lock()
+        self._total = 0
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        if self.client is not None and self.client.last_frame is not None:
+            self._total = max(self._total, self.client.last_frame[1])
+        return self._total
+
+    def append(self, ids, xs, ys):
+        raise RuntimeError("RemoteHistory is read-only; frames are ingested by the frame bus server")
+
+    def _request(self, frame):
+        with self._lock:
+            for attempt in range(2):
+                try:
+                    if self._sock is None:
+                        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                        self._sock.settimeout(self.timeout)
+                        self._sock.connect(self.path)
+                    send_message(self._sock, MSG_GET, INT64.pack(frame))
+                    return recv_message(self._sock)
+                except OSError:
+                    if self._sock is not None:
+                        self._sock.close()
+                        self._sock = None
+                    if attempt:
+                        raise
+
+    def get(self, frame):
+        frame = int(frame)
+        cached = self._cache.get(frame)
+        if cached is not None:
+            self._cache.move_to_end(frame)
+            self.hits += 1
+            return cached
+        self.misses += 1
+        try:
+            kind, body = tpool.execute(self._request, frame)
+        except OSError as e:
+            # 受信プロセスに繋がらない間は、そのフレームが無いものとして扱う
+            logger.warning("History request for frame %d failed: %s", frame, e)
+            raise IndexError(frame) from e
+        if kind == MSG_MISSING:
+            _, total = MISSING.unpack(body)
+            self._total = max(self._total, total)
+            raise IndexError(frame)
+        _, total, ids, xs, ys = decode_frame(body)
+        self._total = max(self._total, total)
+        self._cache[frame] = (ids, xs, ys)
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return ids, xs, ys
+
+    def last(self):
+        return self.get(len(self) - 1)
+
+    def refresh(self):
+        """サーバに総フレーム数を問い合わせる（存在しないフレーム -1 の応答で分かる）"""
+        try:
+            self.get(-1)
+        except IndexError:
+            pass
+        return self._total
+
+    def stats(self):
+        return {
+            'backend': 'remote',
+            'path': self.path,
+            'frames': len(self),
+            'cached_frames': len(self._cache),
+            'cache_hits': self.hits,
+            'cache_misses': self.misses,
+        }
@@ -0,0 +1,113 @@
+import struct
+
+import numpy as np
+
+# フレーム種別
+KEYFRAME = 0
+DELTA = 1
+VERSION = 1
+
+# ヘッダ（リトルエンディアン, 40バイト）:
+#   type u8, version u8, reserved u16, frame u32, total_frames u32, count u32,
+#   quantum f32, reserved u32, origin_x f64, origin_y f64
+# キーフレーム本体: ids int32[count], xy float32[count*2]（原点からの差分, x,y交互）
+# 差分フレーム本体: index uint32[count]（id昇順での位置）, dxy int16[count*2]（quantum単位）
+HEADER = struct.Struct('<BBHIIIfIdd')
+
+
+def encode_keyframe(frame, total_frames, ids, xs, ys, quantum=0.01):
+    """id昇順に並べたキーフレームのバイト列を作る"""
+    order = np.argsort(ids, kind='stable')
+    ids = np.asarray(ids)[order]
+    xs = np.asarray(xs, dtype=np.float64)[order]
+    ys = np.asarray(ys, dtype=np.float64)[order]
+    origin_x = float(np.round(xs.mean())) if len(xs) else 0.0
+    origin_y = float(np.round(ys.mean())) if len(ys) else 0.0
+
+    xy = np.empty((len(ids), 2), dtype='<f4')
+    xy[:, 0] = xs - origin_x
+    xy[:, 1] = ys - origin_y
+    header = HEADER.pack(KEYFRAME, VERSION, 0, frame, total_frames, len(ids),
+                         quantum, 0, origin_x, origin_y)
+    return header + ids.astype('<i4').tobytes() + xy.tobytes(), ids, xy, (origin_x, origin_y)
+
+
+class DeltaFrameEncoder:
+    """
+    new_data 用のバイナリフレームエンコーダ
+    キーフレームで id 順と位置を送り、以降は動いたエージェントだけを
+    quantum 単位に量子化した差分で送る
+    差分はデコーダ側と同じ復元値(recon)に対して取るので誤差は蓄積しない
+    """
+
+    def __init__(self, quantum=0.01, keyframe_interval=100):
+        self.quantum = float(np.float32(quantum))
+        self.keyframe_interval = keyframe_interval
+        self.ids = None
+        self.recon_x = None
+        self.recon_y = None
+        self._since_keyframe = 0
+
+    def force_keyframe(self):
+        """次のフレームをキーフレームにする（新しいクライアントの参加時など）"""
+        self.ids = None
+
+    def snapshot(self, frame, total_frames):
+        """
+        直前に encode した状態（復元値）のキーフレーム
+        差分を取りこぼしたクライアントを、エンコーダを巻き戻さずに追いつかせる
+        """
+        return encode_keyframe(frame, total_frames, self.ids, self.recon_x, self.recon_y, self.quantum)[0]
+
+    def encode(self, frame, total_frames, ids, xs, ys):
+        ids = np.asarray(ids)
+        order = np.argsort(ids, kind='stable')
+        sorted_ids = ids[order]
+
+        if (self.ids is None or self._since_keyframe >= self.keyframe_interval
+                or not np.array_equal(sorted_ids, self.ids)):
+            payload, self.ids, xy, origin = encode_keyframe(frame, total_frames, ids, xs, ys, self.quantum)
+            # デコーダと同じ計算で復元値を持つ
+            self.recon_x = origin[0] + xy[:, 0].astype(np.float64)
+            self.recon_y = origin[1] + xy[:, 1].astype(np.float64)
+            self._since_keyframe = 0
+            return payload
+
+        xs = np.asarray(xs, dtype=np.float64)[order]
+        ys = np.asarray(ys, dtype=np.float64)[order]
+        dx = np.clip(np.round((xs - self.recon_x) / self.quantum), -32767, 32767).astype('<i2')
+        dy = np.clip(np.round((ys - self.recon_y) / self.quantum), -32767, 32767).astype('<i2')
+        moved = np.nonzero((dx != 0) | (dy != 0))[0]
+
+        dxy = np.empty((len(moved), 2), dtype='<i2')
+        dxy[:, 0] = dx[moved]
+        dxy[:, 1] = dy[moved]
+        # 範囲外に丸めた分は次のフレームの差分で送られる
+        self.recon_x[moved] += dxy[:, 0] * self.quantum
+        self.recon_y[moved] += dxy[:, 1] * self.quantum
+        self._since_keyframe += 1
+
+        header = HEADER.pack(DELTA, VERSION, 0, frame, total_frames, len(moved),
+                             self.quantum, 0, 0.0, 0.0)
+        return header + moved.astype('<u4').tobytes() + dxy.tobytes()
+
+
+def decode(payload, state=None):
+    """
+    バイナリフレームを復号する（検証用。ブラウザ側は static/frame_codec.js）
+    state: 直前の (ids, xs, ys)。差分フレームの復号に必要
+    """
+    kind, _, _, frame, total_frames, count, quantum, _, origin_x, origin_y = HEADER.unpack_from(payload)
+    body = HEADER.size
+    if kind == KEYFRAME:
+        ids = np.frombuffer(payload, dtype='<i4', count=count, offset=body).astype(np.int64)
+        xy = np.frombuffer(payload, dtype='<f4', count=count * 2, offset=body + count * 4).reshape(count, 2)
+        xs = origin_x + xy[:, 0].astype(np.float64)
+        ys = origin_y + xy[:, 1].astype(np.float64)
+    else:
+        ids, xs, ys = state[0], state[1].copy(), state[2].copy()
+        index = np.frombuffer(payload, dtype='<u4', count=count, offset=body)
+        dxy = np.frombuffer(payload, dtype='<i2', count=count * 2, offset=body + count * 4).reshape(count, 2)
+        xs[index] += dxy[:, 0] * quantum
+        ys[index] += dxy[:, 1] * quantum
+    return frame, total_frames, (ids, xs, ys)
@@ -1,8 +1,17 @@
+import argparse
 import csv
 import random
 import math
 import os
 
+import numpy as np
+
+from recording import RecordingWriter, available_codecs
+
+# 記録ファイルの列（name は 'normalcar{car}' なので番号だけを持つ）
+RUN_COLUMNS = [('car', '<i4'), ('loc_x', '<f8'), ('loc_y', '<f8'), ('heading', '<f4'),
+               ('speed', '<f4'), ('drive_ov', '?')]
+
 def generate_car_path(car_id, start_x, start_y, num_cycles=1000, interval=5):
     """車両の経路データを生成する"""
     data = []
@@ -73,9 +82,180 @@ def save_car_data(car_id, data):
             ])
     print(f'Generated {filename}')
 
+# ---------- 一括生成（全車両をサイクルごとにNumPyで進める） ----------
+HEADINGS = np.array([0, 90, 180, 270], dtype=np.float64)
+GRID_X = np.arange(300, 3001, 100)   # 格子状の道路（generate_car_path と同じ範囲）
+GRID_Y = np.arange(200, 1601, 100)
+
+def load_road_index(path, to_viewer=False, envelope=None):
+    """shapefile の道路を SegmentIndex にする（既定はレイヤの座標のまま）"""
+    import shapefile
+    import transform
+    from road_index import SegmentIndex
+
+    coords, offsets = [], [0]
+    with shapefile.Reader(path) as reader:
+        for shape in reader.iterShapes():
+            points = np.asarray(shape.points, dtype=np.float64).reshape(-1, 2)
+            if to_viewer and len(points):
+                points = transform.layer_to_viewer(points, envelope)
+            bounds = list(shape.parts) + [len(points)]
+            for start, end in zip(bounds[:-1], bounds[1:]):
+                if end - start >= 2:
+                    coords.append(points[start:end])
+                    offsets.append(offsets[-1] + end - start)
+    coords = np.concatenate(coords) if coords else np.zeros((0, 2))
+    return SegmentIndex(coords, np.asarray(offsets, dtype=np.int64))
+
+def grid_cycles(first_car, num_cars, num_cycles, interval, seed):
+    """
+    generate_car_path と同じ規則で num_cars 台を一括して進める
+    yield: (サイクル, {列名: 配列})
+    """
+    rng = np.random.default_rng(seed)
+    cars = np.arange(first_car, first_car + num_cars, dtype=np.int32)
+    x = rng.choice(GRID_X, num_cars).astype(np.float64)
+    y = rng.choice(GRID_Y, num_cars).astype(np.float64)
+    heading = rng.choice(HEADINGS, num_cars)
+    yield 0, {'car': cars, 'loc_x': x.copy(), 'loc_y': y.copy(), 'heading': heading.copy(),
+              'speed': np.zeros(num_cars), 'drive_ov': np.zeros(num_cars, dtype=bool)}
+
+    for cycle in range(interval, num_cycles + 1, interval):
+        # 交差点での方向転換（20%の確率, 90度単位）
+        turn = rng.random(num_cars) < 0.2
+        heading[turn] = rng.choice(HEADINGS, int(turn.sum()))
+        speed = rng.uniform(8, 14, num_cars) if cycle < num_cycles * 0.9 else rng.uniform(0, 5, num_cars)
+        radians = np.radians(heading)
+        x = np.clip(x + speed * interval * np.cos(radians), 300, 3000)
+        y = np.clip(y + speed * interval * np.sin(radians), 200, 1600)
+        yield cycle, {'car': cars, 'loc_x': x, 'loc_y': y, 'heading': heading.copy(),
+                      'speed': speed, 'drive_ov': np.ones(num_cars, dtype=bool)}
+
+def road_cycles(first_car, num_cars, num_cycles, interval, seed, coords, offsets):
+    """
+    実際の道路網（coords, offsets の SegmentIndex）に沿って num_cars 台を一括して進める
+    速度の規則は grid_cycles と同じ。向きは今いるセグメントの方向
+    """
+    from road_engine import RoadFollowingEngine
+    from road_graph import RoadGraph
+    from road_index import SegmentIndex
+
+    index = SegmentIndex(coords, offsets)
+    engine = RoadFollowingEngine(index, seed=seed, graph=RoadGraph(index))
+    engine.spawn(num_cars)
+    rng = engine.rng
+    cars = np.arange(first_car, first_car + num_cars, dtype=np.int32)
+
+    def columns(speed, driving):
+        if engine.num_segments:
+            direction = engine.direction[engine.segment]
+            heading = np.degrees(np.arctan2(direction[:, 1], direction[:, 0])) % 360
+        else:
+            heading = np.zeros(num_cars)
+        return {'car': cars, 'loc_x': engine.x, 'loc_y': engine.y, 'heading': heading,
+                'speed': speed, 'drive_ov': np.full(num_cars, driving)}
+
+    yield 0, columns(np.zeros(num_cars), False)
+    for cycle in range(interval, num_cycles + 1, interval):
+        speed = rng.uniform(8, 14, num_cars) if cycle < num_cycles * 0.9 else rng.uniform(0, 5, num_cars)
+        engine.step(speed * interval)
+        yield cycle, columns(speed, True)
+
+def block_cycles(block):
+    """block: (first_car, num_cars, num_cycles, interval, seed, roads)。roads は (coords, offsets) か None"""
+    first_car, num_cars, num_cycles, interval, seed, roads = block
+    if roads is None:
+        return grid_cycles(first_car, num_cars, num_cycles, interval, seed)
+    return road_cycles(first_car, num_cars, num_cycles, interval, seed, *roads)
+
+def _block_worker(block, batch, out):
+    """ワーカープロセス: 担当の車両を batch サイクルずつまとめてキューに送る"""
+    pending = []
+    for item in block_cycles(block):
+        pending.append(item)
+        if len(pending) >= batch:
+            out.put(pending)
+            pending = []
+    out.put(pending)
+    out.put(None)
+
+def stream_cycles(num_cars, num_cycles, interval=5, seed=None, roads=None, workers=1, batch=None):
+    """
+    全車両の (サイクル, {列名: 配列}) をサイクル順に返す
+    workers > 1 なら車両をプロセスごとのブロックに分けて並列に生成し、サイクルごとに連結する
+    （キューは上限付きなので、書き出しが遅ければ生成も待つ）
+    """
+    seeds = np.random.SeedSequence(seed).spawn(max(workers, 1))
+    bounds = np.linspace(0, num_cars, max(workers, 1) + 1).astype(int)
+    blocks = [(int(lo), int(hi - lo), num_cycles, interval, seeds[k], roads)
+              for k, (lo, hi) in enumerate(zip(bounds[:-1], bounds[1:])) if hi > lo]
+    if len(blocks) <= 1:
+        yield from block_cycles(blocks[0])
+        return
+
+    import multiprocessing as mp
+    # 1バッチあたり合計およそ400万行に収める
+    batch = batch or max(1, 4_000_000 // max(num_cars, 1))
+    queues = [mp.Queue(maxsize=2) for _ in blocks]
+    processes = [mp.Process(target=_block_worker, args=(block, batch, q), daemon=True)
+                 for block, q in zip(blocks, queues)]
+    for process in processes:
+        process.start()
+    try:
+        while True:
+            parts = [q.get() for q in queues]
+            if parts[0] is None or not parts[0]:
+                break
+            for items in zip(*parts):
+                cycle = items[0][0]
+                yield cycle, {name: np.concatenate([columns[name] for _, columns in items])
+                              for name in items[0][1]}
+    finally:
+        for process in processes:
+            process.terminate()
+            process.join()
+
+def save_run(path, cycles, codec='none', chunk_cycles=64):
+    """
+    stream_cycles の出力を1つの記録ファイル（recording.py の形式）に書く。サイクルごとに全車両の行を持つ
+    書き出しはチャンク単位なので、メモリに載るのは chunk_cycles サイクル分だけ
+    """
+    meta = {'source': 'generate_car_data', 'name_format': 'normalcar{}',
+            'frame_columns': ['car', 'loc_x', 'loc_y']}
+    rows = 0
+    with RecordingWriter(path, RUN_COLUMNS, codec=codec, chunk_cycles=chunk_cycles, meta=meta) as writer:
+        for cycle, columns in cycles:
+            writer.append(cycle, columns)
+            rows += len(columns['car'])
+    print(f'Generated {path} ({len(writer)} cycles, {rows} rows)')
+
 def main():
-    """100台分の車両データを生成する"""
-    num_cars = 100
+    """車両データを生成する（既定は100台分のCSV）"""
+    parser = argparse.ArgumentParser(description='デモ用の車両データを生成する')
+    parser.add_argument('--cars', type=int, default=100)
+    parser.add_argument('--cycles', type=int, default=1000)
+    parser.add_argument('--interval', type=int, default=5)
+    parser.add_argument('--format', choices=['csv', 'run'], default='csv',
+                        help='csv: 車両ごとのCSV, run: 全車両を1つの記録ファイルに（一括生成）')
+    parser.add_argument('--output', default='static/demodata/cars.run', help='--format run の出力先')
+    parser.add_argument('--codec', choices=available_codecs(), default='none')
+    parser.add_argument('--roads', help='--format run で道路網に沿わせる shapefile（例: shapefile/complete_roads）')
+    parser.add_argument('--viewer', action='store_true', help='--roads の座標をビューア座標に変換する')
+    parser.add_argument('--envelope', help='--viewer で使うGAMAのワールド範囲 "minx,miny,maxx,maxy"')
+    parser.add_argument('--workers', type=int, default=1, help='--format run で生成に使うプロセス数')
+    parser.add_argument('--seed', type=int)
+    args = parser.parse_args()
+    num_cars = args.cars
+
+    if args.format == 'run':
+        roads = None
+        if args.roads:
+            index = load_road_index(args.roads, args.viewer, args.envelope)
+            roads = (np.asarray(index.coords), np.asarray(index.offsets))
+        cycles = stream_cycles(num_cars, args.cycles, args.interval, args.seed, roads, args.workers)
+        # 大規模なデータでもチャンクがおよそ400万行に収まるようにする
+        save_run(args.output, cycles, args.codec, chunk_cycles=max(1, min(64, 4_000_000 // max(num_cars, 1))))
+        return
     
     # 道路の定義
     road_spacing = 100  # 道路の間隔
@@ -96,11 +276,11 @@ def main():
         start_x, start_y = random.choice(road_positions)
         
         # 車両データを生成
-        car_data = generate_car_path(i, start_x, start_y)
+        car_data = generate_car_path(i, start_x, start_y, num_cycles=args.cycles, interval=args.interval)
         
         # CSVファイルに保存
         save_car_data(i + 1, car_data)
 
 if __name__ == '__main__':
     main()
-    print('All car data generated successfully!') 
\ No newline at end of file
+    print('All car data generated successfully!')
@@ -0,0 +1,136 @@
+import mmap
+import os
+import threading
+import time
+from array import array
+
+import numpy as np
+
+
+class FrameHistory:
+    """
+    フレーム履歴をコンパクトな型付き配列で保持するストア
+    直近 depth フレームはリングバッファ（int32のid, float32のx/y）に置き、
+    それより古いフレームは追記専用のファイルに書き出してメモリマップで読む
+    どのフレームもオフセット表から O(1) で取り出せる
+    追加と読み出しはロックで守るので、frame_bus.py の OS スレッドからも読める
+    """
+
+    def __init__(self, depth=512, spill_dir=None):
+        self.depth = int(depth)
+        self.spill_dir = spill_dir
+        self.spill_path = None
+
+        self._ring = [None] * self.depth
+        self._count = 0
+        # 書き出したフレーム k のファイル内オフセットとエージェント数
+        self._offsets = array('q')
+        self._lengths = array('q')
+        self._file = None
+        self._mmap = None
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self._count
+
+    def append(self, ids, xs, ys):
+        """フレームを追加してフレーム番号を返す"""
+        ids = np.asarray(ids, dtype=np.int32)
+        xs = np.asarray(xs, dtype=np.float64)
+        ys = np.asarray(ys, dtype=np.float64)
+        # x/y はフレームごとの原点からの差分をfloat32で持つ（大きな座標値でも精度を保つため）
+        origin = np.array([np.round(xs.mean()) if len(xs) else 0.0,
+                           np.round(ys.mean()) if len(ys) else 0.0])
+        xy = np.empty((len(ids), 2), dtype=np.float32)
+        xy[:, 0] = xs - origin[0]
+        xy[:, 1] = ys - origin[1]
+
+        with self._lock:
+            slot = self._count % self.depth
+            if self._count >= self.depth:
+                # リングから押し出されるフレームをディスクへ
+                self._spill(*self._ring[slot])
+            self._ring[slot] = (ids, xy, origin)
+            self._count += 1
+            return self._count - 1
+
+    def get(self, frame):
+        """フレーム番号から (ids, xs, ys) を返す"""
+        with self._lock:
+            if not 0 <= frame < self._count:
+                raise IndexError(frame)
+            if frame >= self._count - self.depth:
+                ids, xy, origin = self._ring[frame % self.depth]
+            else:
+                ids, xy, origin = self._read_spilled(frame)
+        # 配列は追加後に書き換えないので、float64 への変換はロックの外で行う
+        return ids, xy[:, 0].astype(np.float64) + origin[0], xy[:, 1].astype(np.float64) + origin[1]
+
+    def last(self):
+        with self._lock:
+            frame = self._count - 1
+        return self.get(frame)
+
+    def _spill(self, ids, xy, origin):
+        if self._file is None:
+            spill_dir = self.spill_dir or os.path.join(os.path.dirname(__file__), 'history')
+            os.makedirs(spill_dir, exist_ok=True)
+            self.spill_path = os.path.join(spill_dir, f"frames-{os.getpid()}-{int(time.time())}.bin")
+            self._file = open(self.spill_path, 'ab+')
+        self._offsets.append(self._file.tell())
+        self._lengths.append(len(ids))
+        # レコード: 原点(float64×2) + ids(int32×n) + xy(float32×2n)
+        self._file.write(origin.tobytes())
+        self._file.write(ids.tobytes())
+        self._file.write(xy.tobytes())
+
+    def _read_spilled(self, frame):
+        offset, n = self._offsets[frame], self._lengths[frame]
+        end = offset + 16 + n * 12
+        if self._mmap is None or len(self._mmap) < end:
+            # ファイルが伸びていればマップし直す（古いマップは参照が消えたら解放される）
+            self._file.flush()
+            self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        origin = np.frombuffer(self._mmap, dtype=np.float64, count=2, offset=offset)
+        ids = np.frombuffer(self._mmap, dtype=np.int32, count=n, offset=offset + 16)
+        xy = np.frombuffer(self._mmap, dtype=np.float32, count=n * 2, offset=offset + 16 + n * 4).reshape(n, 2)
+        return ids, xy, origin
+
+    def stats(self):
+        """メモリ使用量などの統計"""
+        with self._lock:
+            in_memory = [f for f in self._ring if f is not None]
+            spilled_frames = len(self._offsets)
+            spill_bytes = self._file.tell() if self._file else 0
+        memory_bytes = sum(ids.nbytes + xy.nbytes + origin.nbytes for ids, xy, origin in in_memory)
+        return {
+            'frames': self._count,
+            'depth': self.depth,
+            'in_memory_frames': len(in_memory),
+            'memory_bytes': memory_bytes,
+            'bytes_per_frame': memory_bytes / len(in_memory) if in_memory else 0,
+            'bytes_per_agent': 12,
+            'bytes_per_frame_overhead': 16,
+            'spilled_frames': spilled_frames,
+            'spill_bytes': spill_bytes,
+            'spill_path': self.spill_path,
+        }
+
+    def close(self):
+        """書き出しファイルのマップを外して閉じ、ファイルを消す（書き出した古いフレームは読めなくなる）"""
+        with self._lock:
+            if self._mmap is not None:
+                try:
+                    self._mmap.close()
+                except BufferError:
+                    pass  # 返した配列がまだマップを参照している。参照が消えたら解放される
+                self._mmap = None
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            if self.spill_path is not None:
+                try:
+                    os.unlink(self.spill_path)
+                except FileNotFoundError:
+                    pass
+                self.spill_path = None
@@ -0,0 +1,82 @@
+import numpy as np
+
+try:
+    import msgpack
+except ImportError:  # msgpack は任意（無ければ JSON と生の配列のみ）
+    msgpack = None
+
+# /data_from_gama の本体の形式（Content-Type で選ぶ。それ以外は従来どおり JSON とみなす）
+#   json    : [{"id", "x", "y"}, ...]
+#   msgpack : {"id": bin, "x": bin, "y": bin}（各列は soa と同じ型のリトルエンディアンのバイト列か数値の配列）
+#             または JSON と同じエージェントのリスト
+#   soa     : ids int32[n], xs float64[n], ys float64[n] をこの順に並べたバイト列
+MSGPACK_TYPES = ('application/msgpack', 'application/x-msgpack', 'application/vnd.msgpack')
+SOA_TYPES = ('application/x-agents-soa', 'application/octet-stream')
+SOA_ID = np.dtype('<i4')
+SOA_XY = np.dtype('<f8')
+SOA_ROW_SIZE = SOA_ID.itemsize + 2 * SOA_XY.itemsize
+
+
+class IngestFormatError(ValueError):
+    """本体を読めない（status は返すべき HTTP ステータス）"""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def request_format(mimetype):
+    """Content-Type から 'json' / 'msgpack' / 'soa' を選ぶ"""
+    if mimetype in MSGPACK_TYPES:
+        if msgpack is None:
+            raise IngestFormatError("MessagePack ingest needs the msgpack package", status=415)
+        return 'msgpack'
+    if mimetype in SOA_TYPES:
+        return 'soa'
+    return 'json'
+
+
+def available_formats():
+    return ['json', 'soa'] + (['msgpack'] if msgpack is not None else [])
+
+
+def decode_soa(body):
+    """生の配列の本体を (ids, xs, ys) にする（コピーせず body へのビュー）"""
+    n, rest = divmod(len(body), SOA_ROW_SIZE)
+    if rest:
+        raise IngestFormatError(f"body length {len(body)} is not a multiple of {SOA_ROW_SIZE} bytes")
+    ids = np.frombuffer(body, dtype=SOA_ID, count=n)
+    xs = np.frombuffer(body, dtype=SOA_XY, count=n, offset=n * SOA_ID.itemsize)
+    ys = np.frombuffer(body, dtype=SOA_XY, count=n, offset=n * (SOA_ID.itemsize + SOA_XY.itemsize))
+    return ids, xs, ys
+
+
+def _column(value, dtype, name):
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        if len(value) % dtype.itemsize:
+            raise IngestFormatError(f"column {name!r} is not a whole number of {dtype} values")
+        return np.frombuffer(value, dtype=dtype)
+    try:
+        return np.asarray(value, dtype=dtype)
+    except (TypeError, ValueError) as e:
+        raise IngestFormatError(f"column {name!r}: {e}") from e
+
+
+def columns_to_arrays(columns, keys=('id', 'x', 'y')):
+    """{'id': 列, 'x': 列, 'y': 列} を (ids, xs, ys) にする。列はバイト列か数値の配列"""
+    try:
+        ids, xs, ys = (columns[key] for key in keys)
+    except KeyError as e:
+        raise IngestFormatError(f"missing column {e.args[0]!r}") from e
+    ids, xs, ys = _column(ids, SOA_ID, keys[0]), _column(xs, SOA_XY, keys[1]), _column(ys, SOA_XY, keys[2])
+    if not len(ids) == len(xs) == len(ys):
+        raise IngestFormatError("columns must have the same length")
+    return ids, xs, ys
+
+
+def decode_msgpack(body):
+    """MessagePack の本体を Python のオブジェクトにする（bin はバイト列のまま）"""
+    try:
+        return msgpack.unpackb(body, raw=False)
+    except (ValueError, msgpack.ExtraData, msgpack.FormatError, msgpack.StackError) as e:
+        raise IngestFormatError(f"invalid MessagePack body: {e}") from e
@@ -0,0 +1,73 @@
+import gzip
+import hashlib
+import json
+import os
+
+from flask import Response, request
+
+try:
+    import brotli
+except ImportError:  # brotli は任意（無ければgzipのみ）
+    brotli = None
+
+
+class LayerCache:
+    """
+    地図レイヤ(JSON)を一度だけ読み込み、シリアライズ・圧縮済みのバイト列から返すキャッシュ
+    ファイルの更新時刻が変わったら作り直す。ETag / If-None-Match で 304 を返す
+    loader を渡すと path を読む代わりに loader() の戻り値をシリアライズする（path は更新検知のみ）
+    """
+
+    def __init__(self, path, loader=None, cache_control='public, no-cache'):
+        self.path = path
+        self.loader = loader
+        self.cache_control = cache_control
+        self._mtime = None
+        self._loaded = False
+        self._bodies = {}
+        self._etag = None
+
+    def _refresh(self):
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            mtime = None
+        if self._loaded and mtime == self._mtime:
+            return
+
+        if mtime is None:
+            body = b'[]'
+        elif self.loader is not None:
+            body = json.dumps(self.loader(), separators=(',', ':')).encode('utf-8')
+        else:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                body = json.dumps(json.load(f), separators=(',', ':')).encode('utf-8')
+
+        self._bodies = {'identity': body, 'gzip': gzip.compress(body, compresslevel=6)}
+        if brotli is not None:
+            self._bodies['br'] = brotli.compress(body)
+        self._etag = hashlib.sha1(body).hexdigest()
+        self._mtime = mtime
+        self._loaded = True
+
+    def _choose_encoding(self):
+        accept = request.accept_encodings
+        for encoding in ('br', 'gzip'):
+            if encoding in self._bodies and accept[encoding]:
+                return encoding
+        return 'identity'
+
+    def response(self):
+        self._refresh()
+        if request.if_none_match.contains_weak(self._etag):
+            resp = Response(status=304)
+        else:
+            encoding = self._choose_encoding()
+            resp = Response(self._bodies[encoding], mimetype='application/json')
+            if encoding != 'identity':
+                resp.headers['Content-Encoding'] = encoding
+        # 同じ内容なら圧縮方式が違っても同じ弱いETag
+        resp.set_etag(self._etag, weak=True)
+        resp.headers['Cache-Control'] = self.cache_control
+        resp.vary.add('Accept-Encoding')
+        return resp
@@ -0,0 +1,92 @@
+import json
+import os
+
+import numpy as np
+
+# preprocess_layers.py が書き出す成果物の形式
+#   <root>/manifest.json          レイヤ名 → 成果物ディレクトリ（ソースのsha1）
+#   <root>/<sha1>/meta.json       種別・件数などのメタデータ
+#   <root>/<sha1>/coords.f64      頂点座標 float64 (M, 2)
+#   <root>/<sha1>/parts.i64       パートkの頂点範囲 coords[parts[k]:parts[k+1]]  int64 (P+1,)
+#   <root>/<sha1>/features.i64    フィーチャkのパート範囲 parts[features[k]:features[k+1]]  int64 (F+1,)
+#   <root>/<sha1>/attributes.npy  属性テーブル（構造化配列）
+FORMAT_VERSION = 1
+DEFAULT_ROOT = os.path.join(os.path.dirname(__file__), 'cache', 'layers')
+
+
+def _map_array(path, dtype, shape):
+    if int(np.prod(shape)) == 0:
+        return np.zeros(shape, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode='r', shape=shape)
+
+
+class MappedLayer:
+    """前処理済みレイヤをメモリマップで開く"""
+
+    def __init__(self, directory):
+        self.directory = directory
+        with open(os.path.join(directory, 'meta.json'), 'r', encoding='utf-8') as f:
+            self.meta = json.load(f)
+        self.name = self.meta['name']
+        self.kind = self.meta['kind']  # 'LineString' | 'Polygon' | 'Point'
+        self.source_hash = self.meta['source_hash']
+
+        self.coords = _map_array(os.path.join(directory, 'coords.f64'), '<f8', (self.meta['num_vertices'], 2))
+        self.parts = _map_array(os.path.join(directory, 'parts.i64'), '<i8', (self.meta['num_parts'] + 1,))
+        self.features = _map_array(os.path.join(directory, 'features.i64'), '<i8', (self.meta['num_features'] + 1,))
+        self.attributes = np.load(os.path.join(directory, 'attributes.npy'), mmap_mode='r')
+
+    def __len__(self):
+        return self.meta['num_features']
+
+    @property
+    def meta_path(self):
+        return os.path.join(self.directory, 'meta.json')
+
+    def feature_parts(self, k):
+        """フィーチャkのパート（座標配列）のリスト"""
+        p0, p1 = self.features[k], self.features[k + 1]
+        return [self.coords[self.parts[p]:self.parts[p + 1]] for p in range(p0, p1)]
+
+    def iter_parts(self):
+        """(種別, パートのリスト) をフィーチャ順に返す"""
+        for k in range(len(self)):
+            yield self.kind, self.feature_parts(k)
+
+    def properties(self, k):
+        row = self.attributes[k]
+        return {name: row[name].item() for name in self.attributes.dtype.names}
+
+    def to_features(self):
+        """/roads, /buildings 用のGeoJSON風フィーチャのリスト"""
+        features = []
+        for k in range(len(self)):
+            parts = [part.tolist() for part in self.feature_parts(k)]
+            if self.kind == 'LineString':
+                geometry = {'type': 'LineString', 'coordinates': parts[0]} if len(parts) == 1 \
+                    else {'type': 'MultiLineString', 'coordinates': parts}
+            elif self.kind == 'Polygon':
+                geometry = {'type': 'Polygon', 'coordinates': parts}
+            else:
+                geometry = {'type': 'Point', 'coordinates': parts[0][0] if parts and parts[0] else []}
+            features.append({'geometry': geometry, 'properties': self.properties(k)})
+        return features
+
+
+def read_manifest(root=DEFAULT_ROOT):
+    path = os.path.join(root, 'manifest.json')
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def open_layer(name, root=DEFAULT_ROOT):
+    """manifest から前処理済みレイヤを開く。無ければNone"""
+    entry = read_manifest(root).get(name)
+    if not entry:
+        return None
+    directory = os.path.join(root, entry['source_hash'])
+    if not os.path.exists(os.path.join(directory, 'meta.json')):
+        return None
+    return MappedLayer(directory)
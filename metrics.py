@@ -0,0 +1,175 @@
+import bisect
+import collections
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+# 処理時間（秒）のヒストグラムの区切り
+SECONDS_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# バイト数のヒストグラムの区切り
+BYTES_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216)
+
+
+class Histogram:
+    """ラベル1つごとに累積バケット・合計・件数を持つヒストグラム（Prometheus の histogram）"""
+
+    def __init__(self, name, help, label, buckets):
+        self.name = name
+        self.help = help
+        self.label = label
+        self.buckets = tuple(buckets)
+        self._series = {}   # ラベルの値 → [バケットごとの件数..., +Inf], 合計
+        self._lock = threading.Lock()
+
+    def observe(self, value, label_value=''):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_value)
+            if series is None:
+                series = self._series[label_value] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            series = {key: (list(counts), total) for key, (counts, total) in self._series.items()}
+        for label_value, (counts, total) in sorted(series.items()):
+            label = f'{self.label}="{label_value}",' if self.label else ''
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append(f'{self.name}_bucket{{{label}le="{le}"}} {cumulative}')
+            label = f'{{{label[:-1]}}}' if label else ''
+            lines.append(f'{self.name}_sum{label} {total!r}')
+            lines.append(f'{self.name}_count{label} {cumulative}')
+        return lines
+
+
+class MetricsRegistry:
+    """
+    /metrics で返す値の登録先
+    ヒストグラムは observe() で記録し、ゲージとカウンタは取得用の関数を登録して出力時に呼ぶ
+    （既存の stats() をそのまま使えるように）
+    """
+
+    def __init__(self):
+        self._histograms = []
+        self._callbacks = []   # (name, help, type, label, func)。func は数値か {ラベルの値: 数値} を返す
+        self.stage_seconds = self.histogram('mas_stage_seconds', 'Time spent in each hot-path stage', 'stage')
+
+    def histogram(self, name, help, label=None, buckets=SECONDS_BUCKETS):
+        histogram = Histogram(name, help, label, buckets)
+        self._histograms.append(histogram)
+        return histogram
+
+    def gauge(self, name, help, func, label=None):
+        self._callbacks.append((name, help, 'gauge', label, func))
+
+    def counter(self, name, help, func, label=None):
+        self._callbacks.append((name, help, 'counter', label, func))
+
+    @contextmanager
+    def stage(self, name, trace=None):
+        """with の中の時間を mas_stage_seconds{stage=name} に記録する。trace（dict）にも足し込む"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            self.stage_seconds.observe(elapsed, name)
+            if trace is not None:
+                trace[name] = trace.get(name, 0.0) + elapsed
+
+    def render(self):
+        """Prometheus のテキスト形式 (0.0.4)"""
+        lines = []
+        for histogram in self._histograms:
+            lines.extend(histogram.render())
+        for name, help, kind, label, func in self._callbacks:
+            try:
+                value = func()
+            except Exception as e:  # 1つの値の失敗で全体を落とさない
+                lines.append(f'# {name} unavailable: {e}')
+                continue
+            if value is None:
+                continue
+            lines.append(f'# HELP {name} {help}')
+            lines.append(f'# TYPE {name} {kind}')
+            if isinstance(value, dict):
+                for key, v in sorted(value.items()):
+                    lines.append(f'{name}{{{label}="{key}"}} {float(v)!r}')
+            else:
+                lines.append(f'{name} {float(value)!r}')
+        return '\n'.join(lines) + '\n'
+
+
+class SamplingProfiler:
+    """
+    指定したスレッドのスタックを interval 秒ごとに別の OS スレッドから覗き、関数の呼び出し列ごとに数える
+    eventlet のグリーンスレッドはメインスレッド上で動くので、その時点で動いている処理のスタックが見える
+    結果は flamegraph.pl などで読める "a;b;c 件数" の形式
+    """
+
+    def __init__(self, thread_id=None, interval=0.005, max_depth=64):
+        self.thread_id = thread_id if thread_id is not None else threading.main_thread().ident
+        self.interval = interval
+        self.max_depth = max_depth
+        self.samples = collections.Counter()
+        self.total = 0
+        self._lock = threading.Lock()   # samples はサンプリングのスレッドが書き、リクエストのスレッドが読む
+        self.started_at = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        if self.running:
+            return
+        self._stop.clear()
+        self.started_at = time.time()
+        self._thread = threading.Thread(target=self._run, name='sampling-profiler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None and len(stack) < self.max_depth:
+                code = frame.f_code
+                stack.append(f'{code.co_name} ({code.co_filename.rsplit("/", 1)[-1]})')
+                frame = frame.f_back
+            key = ';'.join(reversed(stack))
+            with self._lock:
+                self.samples[key] += 1
+                self.total += 1
+
+    def collapsed(self, limit=None):
+        """回数の多い順の "呼び出し列 件数" の行"""
+        with self._lock:
+            samples = collections.Counter(self.samples)
+        return '\n'.join(f'{stack} {count}' for stack, count in samples.most_common(limit)) + '\n'
+
+    def stats(self):
+        with self._lock:
+            total, stacks = self.total, len(self.samples)
+        return {
+            'running': self.running,
+            'interval': self.interval,
+            'samples': total,
+            'stacks': stacks,
+            'started_at': self.started_at,
+        }
@@ -3,11 +3,44 @@ from mesa.time import RandomActivation
 from mesa.space import ContinuousSpace
 import numpy as np
 
+
 class CarAgent(Agent):
-    def __init__(self, unique_id, model, x, y):
+    """
+    1台の車。座標は model.positions の index 行にあり、x, y, pos はその行を読み書きする薄いラッパー
+    """
+
+    def __init__(self, unique_id, model, index):
+        self.index = index
+        self.placed = False
         super().__init__(unique_id, model)
-        self.x = x
-        self.y = y
+
+    @property
+    def x(self):
+        return float(self.model.positions[self.index, 0])
+
+    @x.setter
+    def x(self, value):
+        self.model.positions[self.index, 0] = value
+
+    @property
+    def y(self):
+        return float(self.model.positions[self.index, 1])
+
+    @y.setter
+    def y(self, value):
+        self.model.positions[self.index, 1] = value
+
+    @property
+    def pos(self):
+        # 空間に置かれていない間は Mesa の約束どおり None
+        return (self.x, self.y) if self.placed else None
+
+    @pos.setter
+    def pos(self, value):
+        # Agent.__init__ と remove_agent は None を入れるが、配列の行はそのまま残す
+        self.placed = value is not None
+        if self.placed:
+            self.model.positions[self.index] = value
 
     def step(self):
         # エージェントの移動ロジックをここに実装
@@ -15,43 +48,111 @@ class CarAgent(Agent):
         self.x += np.random.uniform(-5, 5)
         self.y += np.random.uniform(-5, 5)
 
+
+class SharedContinuousSpace(ContinuousSpace):
+    """
+    近傍探索用の座標キャッシュとして model.positions をそのまま使う ContinuousSpace
+    配列を書き換えればコピーや move_agent なしで空間にも反映される
+    """
+
+    def __init__(self, positions, x_max, y_max, torus, x_min=0, y_min=0):
+        super().__init__(x_max, y_max, torus, x_min=x_min, y_min=y_min)
+        self.positions = positions
+
+    def _build_agent_cache(self):
+        if len(self._agent_to_index) != len(self.positions):
+            # 一部だけ置かれている（取り除かれた）ときは通常どおりコピーを作る
+            super()._build_agent_cache()
+            return
+        self._index_to_agent = {}
+        for agent in self._agent_to_index:
+            self._agent_to_index[agent] = agent.index
+            self._index_to_agent[agent.index] = agent
+        self._agent_points = self.positions
+
+    def positions_changed(self):
+        """配列を一括で書き換えた後に呼ぶ（共有していないキャッシュだけ捨てる）"""
+        if self._agent_points is not self.positions:
+            self._invalidate_agent_cache()
+
+
 class MinakusaModel(Model):
-    def __init__(self, num_agents=100):
+    """
+    engine='scalar': エージェントごとに RandomActivation で歩進する参照実装
+    engine='vector': 全台の座標を NumPy で一括して動かす（CarAgent は座標配列を見るだけ）
+    """
+
+    def __init__(self, num_agents=100, engine='scalar', seed=None):
+        # seed は Model.__new__ が self.random の初期化に使う
         super().__init__()
-        
-        # 南草津駅周辺の座標範囲
+        self.engine = engine
+        self.rng = np.random.default_rng(self.random.getrandbits(64))
+
+        # 南草津駅周辺の座標範囲（中心から ±space_size/2）
         self.center_x = 13550000
         self.center_y = 3480000
         self.space_size = 1000
 
-        # 連続空間を作成
-        self.space = ContinuousSpace(
-            x_max=self.space_size,
-            y_max=self.space_size,
+        # 全エージェントの座標 (num_agents, 2)。CarAgent と空間はこの配列を共有する
+        self.ids = np.arange(num_agents, dtype=np.int64)
+        self.positions = np.empty((num_agents, 2), dtype=np.float64)
+        self.positions[:, 0] = self.center_x + self.rng.uniform(-100, 100, num_agents)
+        self.positions[:, 1] = self.center_y + self.rng.uniform(-100, 100, num_agents)
+
+        # 連続空間を作成（座標はレイヤと同じなので範囲も中心の周りに取る）
+        half = self.space_size / 2
+        self.space = SharedContinuousSpace(
+            self.positions,
+            x_min=self.center_x - half,
+            x_max=self.center_x + half,
+            y_min=self.center_y - half,
+            y_max=self.center_y + half,
             torus=False  # エージェントが画面端でワープしないように
         )
-        
+        # ContinuousSpace は max 側を範囲外とみなすので、その直前までに収める
+        self.lower = np.array([self.space.x_min, self.space.y_min])
+        self.upper = np.nextafter(np.array([self.space.x_max, self.space.y_max]), -np.inf)
+
         self.schedule = RandomActivation(self)
-        
+
         # エージェントを生成
         for i in range(num_agents):
-            # 初期位置をランダムに設定
-            x = self.center_x + np.random.uniform(-100, 100)
-            y = self.center_y + np.random.uniform(-100, 100)
-            agent = CarAgent(i, self, x, y)
+            agent = CarAgent(i, self, i)
             self.schedule.add(agent)
-            self.space.place_agent(agent, (x, y))
+            self.space.place_agent(agent, tuple(self.positions[i]))
 
     def step(self):
+        if self.engine == 'vector':
+            self.positions += self.rng.uniform(-5, 5, self.positions.shape)
+            np.clip(self.positions, self.lower, self.upper, out=self.positions)
+            self.space.positions_changed()
+            self.schedule.steps += 1
+            self.schedule.time += 1
+            return
+
         self.schedule.step()
-        
+
         # エージェントの位置情報を更新
         for agent in self.schedule.agents:
-            self.space.move_agent(agent, (agent.x, agent.y))
-
-    def get_agent_positions(self):
-        return [{
-            'id': agent.unique_id,
-            'x': agent.x,
-            'y': agent.y
-        } for agent in self.schedule.agents] 
\ No newline at end of file
+            self.space.move_agent(agent, tuple(np.clip(agent.pos, self.lower, self.upper)))
+
+    def get_agent_positions(self, packed=False):
+        """
+        (ids, xs, ys) の読み取り専用ビュー（コピーしない）
+        packed=True なら ids(int64), xs, ys(float64) をこの順に続けたリトルエンディアンのバイト列
+        """
+        xs = self.positions[:, 0]
+        ys = self.positions[:, 1]
+        if packed:
+            return self.ids.astype('<i8').tobytes() + xs.astype('<f8').tobytes() + ys.astype('<f8').tobytes()
+        views = []
+        for array in (self.ids, xs, ys):
+            view = array.view()
+            view.flags.writeable = False
+            views.append(view)
+        return tuple(views)
+
+    def get_agent_dicts(self):
+        """以前の get_agent_positions と同じ {'id','x','y'} のリスト"""
+        ids, xs, ys = self.get_agent_positions()
+        return [{'id': i, 'x': x, 'y': y} for i, x, y in zip(ids.tolist(), xs.tolist(), ys.tolist())]
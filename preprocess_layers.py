@@ -0,0 +1,206 @@
+# preprocess_layers.py
+# shapefile/ のレイヤをビューア座標に変換し（GAMAのワールド範囲 --envelope が必要）、サーバがメモリマップで読める
+# バイナリ成果物（layer_store.py の形式）に書き出す
+#
+#   export GAMA_ENVELOPE=minx,miny,maxx,maxy
+#   python preprocess_layers.py                       # shapefile/*.shp を全て処理
+#   python preprocess_layers.py complete_roads water  # 指定レイヤのみ
+#   python preprocess_layers.py --no-transform        # 座標を変換せずに書き出す（範囲が無いとき）
+#
+# ソース(.shp/.shx/.dbf)と変換パラメータのsha1が変わらなければ再生成しない
+import argparse
+import glob
+import hashlib
+import json
+import os
+import sys
+from array import array
+
+import numpy as np
+import shapefile
+
+import transform
+from layer_store import DEFAULT_ROOT, FORMAT_VERSION, read_manifest
+
+SHAPEFILE_DIR = os.path.join(os.path.dirname(__file__), 'shapefile')
+
+KINDS = {
+    shapefile.POINT: 'Point', shapefile.POINTZ: 'Point', shapefile.POINTM: 'Point',
+    shapefile.MULTIPOINT: 'Point', shapefile.MULTIPOINTZ: 'Point', shapefile.MULTIPOINTM: 'Point',
+    shapefile.POLYLINE: 'LineString', shapefile.POLYLINEZ: 'LineString', shapefile.POLYLINEM: 'LineString',
+    shapefile.POLYGON: 'Polygon', shapefile.POLYGONZ: 'Polygon', shapefile.POLYGONM: 'Polygon',
+}
+
+
+def source_hash(shp_path, params):
+    """ソースファイル群と変換パラメータのsha1"""
+    digest = hashlib.sha1()
+    base = os.path.splitext(shp_path)[0]
+    for ext in ('.shp', '.shx', '.dbf'):
+        path = base + ext
+        if not os.path.exists(path):
+            continue
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                digest.update(chunk)
+    digest.update(json.dumps(params, sort_keys=True).encode('utf-8'))
+    digest.update(str(FORMAT_VERSION).encode('utf-8'))
+    return digest.hexdigest()
+
+
+def attribute_dtype(fields):
+    """dbfのフィールド定義から構造化配列のdtypeを作る"""
+    dtype = []
+    for name, kind, size, decimal in fields:
+        if kind == 'N' and decimal == 0:
+            dtype.append((name, '<i8'))
+        elif kind in ('N', 'F'):
+            dtype.append((name, '<f8'))
+        elif kind == 'L':
+            dtype.append((name, '?'))
+        elif kind == 'D':
+            dtype.append((name, 'U10'))
+        else:
+            dtype.append((name, f'U{max(size, 1)}'))
+    return np.dtype(dtype)
+
+
+def attribute_value(value, field_dtype):
+    """欠損値を型ごとの既定値に置き換える"""
+    if value is None or value == '':
+        if field_dtype.kind == 'i':
+            return np.iinfo(np.int64).min
+        if field_dtype.kind == 'f':
+            return np.nan
+        if field_dtype.kind == 'b':
+            return False
+        return ''
+    if field_dtype.kind == 'U' and not isinstance(value, str):
+        return str(value)
+    return value
+
+
+def build_layer(shp_path, root=DEFAULT_ROOT, envelope=None, to_viewer=True, force=False):
+    """
+    1つのレイヤを前処理する
+    to_viewer ならビューア座標に変換する。H はGAMA座標に掛けるものなので、レイヤ座標の範囲 envelope が必要
+    戻り値: (レイヤ名, sha1, 再生成したかどうか)
+    """
+    if to_viewer and not envelope:
+        raise ValueError("converting to viewer coordinates needs the GAMA envelope (minx,miny,maxx,maxy)")
+    name = os.path.splitext(os.path.basename(shp_path))[0]
+    params = {'to_viewer': to_viewer, 'envelope': envelope,
+              'H': transform.H.tolist() if to_viewer else None}
+    digest = source_hash(shp_path, params)
+    directory = os.path.join(root, digest)
+    if not force and os.path.exists(os.path.join(directory, 'meta.json')):
+        return name, digest, False
+
+    tmp_dir = f'{directory}.{os.getpid()}.tmp'
+    os.makedirs(tmp_dir, exist_ok=True)
+
+    with shapefile.Reader(shp_path) as reader:
+        kind = KINDS.get(reader.shapeType)
+        if kind is None:
+            raise ValueError(f"{shp_path}: unsupported shape type {reader.shapeTypeName}")
+        fields = reader.fields[1:]  # 先頭は削除フラグ
+        dtype = attribute_dtype(fields)
+        attributes = np.zeros(len(reader), dtype=dtype)
+
+        parts = array('q', [0])
+        features = array('q', [0])
+        num_vertices = 0
+        # レコードを1件ずつ読み、座標はそのままファイルへ追記する
+        with open(os.path.join(tmp_dir, 'coords.f64'), 'wb') as coords_file:
+            for k, record in enumerate(reader.iterShapeRecords()):
+                shape = record.shape
+                points = np.asarray(shape.points, dtype=np.float64).reshape(-1, 2)
+                if to_viewer and len(points):
+                    points = transform.layer_to_viewer(points, envelope)
+                coords_file.write(points.astype('<f8').tobytes())
+
+                starts = list(shape.parts) if kind != 'Point' else [0]
+                bounds = starts[1:] + [len(points)]
+                for start, end in zip(starts, bounds):
+                    if end > start:
+                        parts.append(num_vertices + end)
+                num_vertices += len(points)
+                features.append(len(parts) - 1)
+
+                row = attributes[k]
+                for (field, *_), value in zip(fields, record.record):
+                    row[field] = attribute_value(value, dtype.fields[field][0])
+
+    np.asarray(parts, dtype='<i8').tofile(os.path.join(tmp_dir, 'parts.i64'))
+    np.asarray(features, dtype='<i8').tofile(os.path.join(tmp_dir, 'features.i64'))
+    np.save(os.path.join(tmp_dir, 'attributes.npy'), attributes)
+
+    meta = {
+        'format_version': FORMAT_VERSION,
+        'name': name,
+        'kind': kind,
+        'source': os.path.relpath(shp_path, os.path.dirname(__file__)),
+        'source_hash': digest,
+        'params': params,
+        'num_features': len(features) - 1,
+        'num_parts': len(parts) - 1,
+        'num_vertices': num_vertices,
+    }
+    with open(os.path.join(tmp_dir, 'meta.json'), 'w', encoding='utf-8') as f:
+        json.dump(meta, f, ensure_ascii=False, indent=2)
+
+    if os.path.exists(directory):
+        # --force で作り直した場合
+        for entry in os.listdir(directory):
+            os.remove(os.path.join(directory, entry))
+        os.rmdir(directory)
+    os.replace(tmp_dir, directory)
+    return name, digest, True
+
+
+def write_manifest(root, entries):
+    manifest = read_manifest(root)
+    manifest.update(entries)
+    path = os.path.join(root, 'manifest.json')
+    with open(f'{path}.tmp', 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(f'{path}.tmp', path)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='shapefileレイヤをバイナリ成果物に前処理する')
+    parser.add_argument('layers', nargs='*', help='レイヤ名（省略時は shapefile/*.shp 全て）')
+    parser.add_argument('--source-dir', default=SHAPEFILE_DIR)
+    parser.add_argument('--out', default=DEFAULT_ROOT)
+    parser.add_argument('--envelope', default=os.environ.get('GAMA_ENVELOPE'),
+                        help='レイヤ座標系でのGAMAのワールド範囲 "minx,miny,maxx,maxy"')
+    parser.add_argument('--no-transform', action='store_true',
+                        help='座標をビューア座標に変換しない（--envelope を指定しないときは必須）')
+    parser.add_argument('--force', action='store_true', help='変更が無くても作り直す')
+    args = parser.parse_args(argv)
+    if not args.no_transform and not args.envelope:
+        # H はGAMA座標に掛けるもので、レイヤ座標にそのまま掛けるとビューアの範囲から大きく外れる
+        parser.error("--envelope (or GAMA_ENVELOPE) is required to convert to viewer coordinates; "
+                     "pass --no-transform to keep the layer coordinates")
+
+    if args.layers:
+        paths = [os.path.join(args.source_dir, f'{name}.shp') for name in args.layers]
+    else:
+        paths = sorted(glob.glob(os.path.join(args.source_dir, '*.shp')))
+
+    os.makedirs(args.out, exist_ok=True)
+    entries = {}
+    for path in paths:
+        if not os.path.exists(path):
+            print(f"Not found: {path}", file=sys.stderr)
+            return 1
+        name, digest, built = build_layer(path, args.out, args.envelope,
+                                          to_viewer=not args.no_transform, force=args.force)
+        entries[name] = {'source_hash': digest}
+        print(f"{'Built' if built else 'Up to date'}: {name} ({digest[:12]})")
+    write_manifest(args.out, entries)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,253 @@
+import json
+import mmap
+import os
+import struct
+import zlib
+from collections import OrderedDict
+
+import numpy as np
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import lz4.frame as lz4_frame
+except ImportError:
+    lz4_frame = None
+
+# ファイル構成:
+#   MAGIC, ヘッダ長(uint32), ヘッダ(JSON: 列の名前と型, 圧縮方式, meta)
+#   チャンク（連続する最大 chunk_cycles サイクル分。中は列ごとに全行を並べたもの。圧縮は任意）
+#   サイクル索引 CYCLE_DTYPE × サイクル数, チャンク表 CHUNK_DTYPE × チャンク数
+#   FOOTER: 索引の位置, サイクル数, チャンク数, MAGIC
+MAGIC = b'MASRUN1\0'
+HEADER_LENGTH = struct.Struct('<I')
+FOOTER = struct.Struct('<qqq8s')
+CYCLE_DTYPE = np.dtype([('cycle', '<i8'), ('chunk', '<i4'), ('row', '<i4'), ('count', '<i4')])
+CHUNK_DTYPE = np.dtype([('offset', '<i8'), ('size', '<i8'), ('raw_size', '<i8'), ('rows', '<i8')])
+
+
+def available_codecs():
+    """使える圧縮方式（zstd と lz4 は対応するパッケージがあるときだけ）"""
+    codecs = ['none', 'zlib']
+    if zstandard is not None:
+        codecs.append('zstd')
+    if lz4_frame is not None:
+        codecs.append('lz4')
+    return codecs
+
+
+def _compress(codec, data):
+    if codec == 'none':
+        return data
+    if codec == 'zlib':
+        return zlib.compress(data, 1)
+    if codec == 'zstd':
+        return zstandard.ZstdCompressor(level=3).compress(data)
+    if codec == 'lz4':
+        return lz4_frame.compress(data)
+    raise ValueError(f"unknown codec: {codec}")
+
+
+def _decompress(codec, data, raw_size):
+    if codec == 'zlib':
+        return zlib.decompress(data)
+    if codec == 'zstd':
+        return zstandard.ZstdDecompressor().decompress(data, max_output_size=raw_size)
+    if codec == 'lz4':
+        return lz4_frame.decompress(data)
+    raise ValueError(f"unknown codec: {codec}")
+
+
+class RecordingWriter:
+    """
+    シミュレーションの記録を列指向・チャンク分割のバイナリファイルに書く
+    columns: [(列名, dtype)]。append() にはサイクルごとに同じ長さの列を渡す
+    """
+
+    def __init__(self, path, columns, codec='none', chunk_cycles=64, meta=None):
+        if codec not in available_codecs():
+            raise ValueError(f"codec {codec!r} is not available (available: {available_codecs()})")
+        self.path = path
+        self.columns = [(name, np.dtype(dtype).newbyteorder('<')) for name, dtype in columns]
+        self.codec = codec
+        self.chunk_cycles = int(chunk_cycles)
+        self.meta = meta or {}
+        self._cycles = []   # CYCLE_DTYPE のタプル
+        self._chunks = []   # CHUNK_DTYPE のタプル
+        self._pending = []  # 書き出し前のサイクル: [(cycle, [列の配列])]
+        self._last_cycle = None
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._file = open(path, 'wb')
+        header = json.dumps({
+            'columns': [[name, dtype.str] for name, dtype in self.columns],
+            'codec': codec,
+            'chunk_cycles': self.chunk_cycles,
+            'meta': self.meta,
+        }).encode('utf-8')
+        self._file.write(MAGIC + HEADER_LENGTH.pack(len(header)) + header)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return len(self._cycles) + len(self._pending)
+
+    def append(self, cycle, columns):
+        """1サイクル分を追加する。columns は {列名: 配列} で全列が同じ長さ"""
+        cycle = int(cycle)
+        if self._last_cycle is not None and cycle <= self._last_cycle:
+            raise ValueError(f"cycles must increase ({cycle} after {self._last_cycle})")
+        arrays = [np.ascontiguousarray(columns[name], dtype=dtype) for name, dtype in self.columns]
+        if any(len(a) != len(arrays[0]) for a in arrays):
+            raise ValueError("all columns must have the same length")
+        self._pending.append((cycle, arrays))
+        self._last_cycle = cycle
+        if len(self._pending) >= self.chunk_cycles:
+            self.flush()
+
+    def flush(self):
+        """溜まったサイクルを1チャンクとして書き出す"""
+        if not self._pending:
+            return
+        chunk = len(self._chunks)
+        row = 0
+        for cycle, arrays in self._pending:
+            count = len(arrays[0])
+            self._cycles.append((cycle, chunk, row, count))
+            row += count
+        raw = b''.join(np.concatenate([arrays[k] for _, arrays in self._pending]).tobytes()
+                       for k in range(len(self.columns)))
+        data = _compress(self.codec, raw)
+        self._chunks.append((self._file.tell(), len(data), len(raw), row))
+        self._file.write(data)
+        self._pending = []
+
+    def close(self):
+        if self._file is None:
+            return
+        self.flush()
+        index_offset = self._file.tell()
+        self._file.write(np.array(self._cycles, dtype=CYCLE_DTYPE).tobytes())
+        self._file.write(np.array(self._chunks, dtype=CHUNK_DTYPE).tobytes())
+        self._file.write(FOOTER.pack(index_offset, len(self._cycles), len(self._chunks), MAGIC))
+        self._file.close()
+        self._file = None
+
+
+class Recording:
+    """
+    RecordingWriter のファイルをメモリマップで読む
+    非圧縮の列はマップへのビュー（コピーしない）、圧縮チャンクは展開して LRU で保持する
+    get/last/len は FrameHistory と同じ形で、meta['frame_columns']（id, x, y の列名）を使う
+    """
+
+    def __init__(self, path, cache_chunks=8):
+        self.path = path
+        self._file = open(path, 'rb')
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mmap[:len(MAGIC)] != MAGIC:
+            raise ValueError(f"{path} is not a recording")
+        (header_length,) = HEADER_LENGTH.unpack_from(self._mmap, len(MAGIC))
+        start = len(MAGIC) + HEADER_LENGTH.size
+        header = json.loads(self._mmap[start:start + header_length].decode('utf-8'))
+        self.columns = [(name, np.dtype(dtype)) for name, dtype in header['columns']]
+        self.codec = header['codec']
+        self.meta = header['meta']
+
+        index_offset, num_cycles, num_chunks, magic = FOOTER.unpack_from(self._mmap, len(self._mmap) - FOOTER.size)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is incomplete (no index)")
+        self.index = np.frombuffer(self._mmap, dtype=CYCLE_DTYPE, count=num_cycles, offset=index_offset)
+        self.chunks = np.frombuffer(self._mmap, dtype=CHUNK_DTYPE, count=num_chunks,
+                                    offset=index_offset + CYCLE_DTYPE.itemsize * num_cycles)
+        self.cycles = self.index['cycle']
+        self.frame_columns = self.meta.get('frame_columns', ['id', 'x', 'y'])
+        self._cache = OrderedDict()
+        self.cache_chunks = cache_chunks
+
+    def __len__(self):
+        return len(self.index)
+
+    def _chunk_columns(self, chunk):
+        """チャンクの列ごとの配列（非圧縮ならマップへのビュー）"""
+        cached = self._cache.get(chunk)
+        if cached is not None:
+            self._cache.move_to_end(chunk)
+            return cached
+        offset, size, raw_size, rows = (int(v) for v in self.chunks[chunk])
+        if self.codec == 'none':
+            buffer, base = self._mmap, offset
+        else:
+            buffer, base = _decompress(self.codec, self._mmap[offset:offset + size], raw_size), 0
+        columns = {}
+        for name, dtype in self.columns:
+            columns[name] = np.frombuffer(buffer, dtype=dtype, count=rows, offset=base)
+            base += dtype.itemsize * rows
+        self._cache[chunk] = columns
+        if len(self._cache) > self.cache_chunks:
+            self._cache.popitem(last=False)
+        return columns
+
+    def read(self, position):
+        """索引の position 番目のサイクルの {列名: 配列}"""
+        _, chunk, row, count = self.index[position]
+        columns = self._chunk_columns(int(chunk))
+        return {name: array[row:row + count] for name, array in columns.items()}
+
+    def positions(self, start_cycle=None, stop_cycle=None):
+        """サイクル番号が [start_cycle, stop_cycle) の索引の範囲"""
+        lo = 0 if start_cycle is None else int(np.searchsorted(self.cycles, start_cycle, side='left'))
+        hi = len(self) if stop_cycle is None else int(np.searchsorted(self.cycles, stop_cycle, side='left'))
+        return range(lo, hi)
+
+    def read_cycle(self, cycle):
+        position = int(np.searchsorted(self.cycles, cycle))
+        if position >= len(self) or self.cycles[position] != cycle:
+            raise KeyError(cycle)
+        return self.read(position)
+
+    def iter_range(self, start_cycle=None, stop_cycle=None):
+        """yield: (サイクル番号, {列名: 配列})"""
+        for position in self.positions(start_cycle, stop_cycle):
+            yield int(self.cycles[position]), self.read(position)
+
+    def get(self, frame):
+        """FrameHistory 互換: frame 番目のサイクルの (ids, xs, ys)"""
+        if not 0 <= frame < len(self):
+            raise IndexError(frame)
+        columns = self.read(frame)
+        ids, xs, ys = (columns[name] for name in self.frame_columns)
+        return ids, xs.astype(np.float64, copy=False), ys.astype(np.float64, copy=False)
+
+    def last(self):
+        return self.get(len(self) - 1)
+
+    def stats(self):
+        return {
+            'backend': 'recording',
+            'path': self.path,
+            'frames': len(self),
+            'codec': self.codec,
+            'chunks': len(self.chunks),
+            'file_bytes': len(self._mmap),
+            'raw_bytes': int(self.chunks['raw_size'].sum()) if len(self.chunks) else 0,
+            'first_cycle': int(self.cycles[0]) if len(self) else None,
+            'last_cycle': int(self.cycles[-1]) if len(self) else None,
+        }
+
+    def close(self):
+        self._cache.clear()
+        self.index = self.chunks = self.cycles = None
+        try:
+            self._mmap.close()
+        except BufferError:
+            # 呼び出し側がまだビューを持っている
+            pass
+        self._file.close()
@@ -0,0 +1,65 @@
+import numpy as np
+
+from frame_codec import DeltaFrameEncoder
+
+
+def match_ids(ids_a, ids_b):
+    """
+    2つのフレームで同じ id のエージェントの添字を返す
+    戻り値: (a の添字, b の添字)
+    """
+    order_b = np.argsort(ids_b, kind='stable')
+    sorted_b = ids_b[order_b]
+    pos = np.searchsorted(sorted_b, ids_a)
+    pos = np.minimum(pos, max(len(sorted_b) - 1, 0))
+    found = np.nonzero(sorted_b[pos] == ids_a)[0] if len(sorted_b) else np.zeros(0, dtype=np.int64)
+    return found, order_b[pos[found]]
+
+
+def replay_samples(history, start, stop, substeps=1):
+    """
+    履歴のフレーム start..stop-1 を順に返す
+    substeps > 1 なら各フレームと次のフレームの間を線形補間した中間フレームも返す
+    （次のフレームに居ないエージェントは補間せずその位置のまま）
+    yield: (時刻, ids, xs, ys)。時刻は フレーム番号 + 補間の割合
+    """
+    current = history.get(start)
+    for frame in range(start, stop):
+        ids, xs, ys = current
+        yield float(frame), ids, xs, ys
+        if frame + 1 >= len(history):
+            break
+        following = history.get(frame + 1)
+        if substeps > 1:
+            a, b = match_ids(ids, following[0])
+            dx = following[1][b] - xs[a]
+            dy = following[2][b] - ys[a]
+            for step in range(1, substeps):
+                alpha = step / substeps
+                ix = xs.copy()
+                iy = ys.copy()
+                ix[a] += dx * alpha
+                iy[a] += dy * alpha
+                yield frame + alpha, ids, ix, iy
+        current = following
+
+
+def replay_chunks(history, start, stop, substeps=1, chunk_size=32, quantum=0.01):
+    """
+    replay_samples をチャンクにまとめて frame_codec 形式にエンコードする
+    各チャンクの先頭はキーフレーム、残りは差分（クライアントはチャンクごとにデコーダを作り直す）
+    yield: {'times': [...], 'data': [bytes, ...]}
+    """
+    times, payloads = [], []
+    encoder = DeltaFrameEncoder(quantum, keyframe_interval=chunk_size)
+    total = len(history)
+    for time, ids, xs, ys in replay_samples(history, start, stop, substeps):
+        if not payloads:
+            encoder.force_keyframe()
+        times.append(time)
+        payloads.append(encoder.encode(int(time), total, ids, xs, ys))
+        if len(payloads) >= chunk_size:
+            yield {'times': times, 'data': payloads}
+            times, payloads = [], []
+    if payloads:
+        yield {'times': times, 'data': payloads}
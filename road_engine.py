@@ -0,0 +1,167 @@
+import numpy as np
+
+
+class RoadFollowingEngine:
+    """
+    全エージェントをNumPy配列で保持し、道路に沿って一括で進めるデモ用ステッパー
+    状態は (現在の有向セグメント, セグメント始点からの距離) で、
+    セグメントの乗り換えは後続セグメント配列の添字計算だけで行う
+    graph (RoadGraph) を渡すと交差点で接続している道路へ乗り換え、
+    set_routes で割り当てた経路があればその順にたどる
+    """
+
+    def __init__(self, index, speed=10.0, seed=None, graph=None):
+        self.index = index
+        self.graph = graph
+        self.speed = float(speed)
+        self.rng = np.random.default_rng(seed)
+
+        # 有向セグメント: 0..n-1 が順方向, n..2n-1 が逆方向
+        n = len(index)
+        self.num_segments = n
+        self.start = np.concatenate([index.p1, index.p2])
+        self.direction = np.concatenate([index.direction, -index.direction])
+        self.length = np.concatenate([index.length, index.length])
+        self.successor = self._build_successors()
+
+        self.ids = np.zeros(0, dtype=np.int64)
+        self.segment = np.zeros(0, dtype=np.int64)
+        self.offset = np.zeros(0, dtype=np.float64)
+        self.x = np.zeros(0, dtype=np.float64)
+        self.y = np.zeros(0, dtype=np.float64)
+        self._reset_routes(0)
+
+    def _reset_routes(self, num_agents):
+        # 経路: 全エージェントの有向セグメント列を1本の配列に並べ、
+        # エージェントごとに残りの範囲 route_flat[route_pos:route_end] を持つ
+        self.route_flat = np.zeros(0, dtype=np.int64)
+        self.route_pos = np.zeros(num_agents, dtype=np.int64)
+        self.route_end = np.zeros(num_agents, dtype=np.int64)
+
+    def _build_successors(self):
+        """同じ道路の次のセグメントへ、道路の端ではUターンする後続配列"""
+        n = self.num_segments
+        k = np.arange(n)
+        part = self.index.part
+        same_next = np.zeros(n, dtype=bool)
+        same_next[:-1] = part[1:] == part[:-1]
+        same_prev = np.zeros(n, dtype=bool)
+        same_prev[1:] = part[1:] == part[:-1]
+        forward = np.where(same_next, k + 1, k + n)
+        backward = np.where(same_prev, k - 1 + n, k)
+        return np.concatenate([forward, backward])
+
+    def __len__(self):
+        return len(self.ids)
+
+    def spawn(self, num_agents):
+        """道路上のランダムな位置にエージェントを配置"""
+        self.ids = np.arange(num_agents, dtype=np.int64)
+        self._reset_routes(num_agents)
+        if self.num_segments == 0:
+            self.segment = np.zeros(num_agents, dtype=np.int64)
+            self.offset = np.zeros(num_agents)
+            self.x = np.full(num_agents, 13550000.0)  # デフォルト位置
+            self.y = np.full(num_agents, 3480000.0)
+            return
+        self.segment = self.rng.integers(0, 2 * self.num_segments, num_agents)
+        self.offset = self.rng.random(num_agents) * self.length[self.segment]
+        self._update_positions()
+
+    def place(self, ids, xs, ys):
+        """既存のエージェント位置を最寄りの道路セグメントに載せる（一度だけの探索）"""
+        self.ids = np.asarray(ids, dtype=np.int64)
+        self._reset_routes(len(self.ids))
+        xs = np.asarray(xs, dtype=np.float64)
+        ys = np.asarray(ys, dtype=np.float64)
+        if self.num_segments == 0:
+            self.x, self.y = xs.copy(), ys.copy()
+            self.segment = np.zeros(len(xs), dtype=np.int64)
+            self.offset = np.zeros(len(xs))
+            return
+        # 周囲のセルで見つかる点は一括で、遠い点だけ1点ずつ探す
+        self.segment, _ = self.index.nearest_many(xs, ys)
+        for i in np.nonzero(self.segment < 0)[0].tolist():
+            self.segment[i] = self.index.nearest(xs[i], ys[i])[0]
+        p1 = self.index.p1[self.segment]
+        d = self.index.d[self.segment]
+        length = self.index.length[self.segment]
+        t = ((xs - p1[:, 0]) * d[:, 0] + (ys - p1[:, 1]) * d[:, 1]) / (length ** 2)
+        self.offset = np.clip(t, 0.0, 1.0) * length
+        self._update_positions()
+
+    def step(self, speed=None):
+        """全エージェントを speed だけ道路に沿って進める"""
+        speed = self.speed if speed is None else speed
+        if self.num_segments == 0:
+            # 道路が無い場合はランダムに移動
+            self.x += self.rng.uniform(-speed, speed, len(self.x))
+            self.y += self.rng.uniform(-speed, speed, len(self.y))
+            return
+
+        self.offset += speed
+        # セグメント長を超えた分だけ後続セグメントへ乗り換える
+        over = np.nonzero(self.offset >= self.length[self.segment])[0]
+        while len(over):
+            seg = self.segment[over]
+            self.offset[over] -= self.length[seg]
+            self.segment[over] = self._next_segments(over, seg)
+            over = over[self.offset[over] >= self.length[self.segment[over]]]
+        self._update_positions()
+
+    def _next_segments(self, agents, segments):
+        """agents（エージェントの添字）が segments の終点に着いたときの次の有向セグメント"""
+        if self.graph is None:
+            following = self.successor[segments]
+        else:
+            following = self.graph.next_segments(segments, self.rng)
+        routed = self.route_pos[agents] < self.route_end[agents]
+        if routed.any():
+            a = agents[routed]
+            following[routed] = self.route_flat[self.route_pos[a]]
+            self.route_pos[a] += 1
+        return following
+
+    def set_routes(self, destinations, agents=None):
+        """
+        エージェントに目的地ノードまでの最短経路を割り当てる（graph が必要）
+        経路は今いるセグメントの終点から始まる。到達できないエージェントは経路なし
+        戻り値: 経路を割り当てたエージェント数
+        """
+        if self.graph is None:
+            raise ValueError("set_routes requires a road graph")
+        agents = np.arange(len(self.ids)) if agents is None else np.asarray(agents, dtype=np.int64)
+        if len(agents) == 0:
+            return 0
+        destinations = np.broadcast_to(np.asarray(destinations, dtype=np.int64), agents.shape)
+        origins = self.graph.segment_end[self.segment[agents]]
+        routes = self.graph.route_many(origins, destinations)
+
+        lengths = np.array([0 if route is None else len(route) for route in routes], dtype=np.int64)
+        start = len(self.route_flat)
+        pieces = [self.route_flat] + [route for route in routes if route is not None]
+        self.route_flat = np.concatenate(pieces).astype(np.int64, copy=False)
+        self.route_pos[agents] = start + np.concatenate([[0], np.cumsum(lengths)[:-1]]).astype(np.int64)
+        self.route_end[agents] = self.route_pos[agents] + lengths
+        self._compact_routes()
+        return int(np.count_nonzero(lengths))
+
+    def _compact_routes(self):
+        """使い終わった経路の分を詰める"""
+        remaining = np.maximum(self.route_end - self.route_pos, 0)
+        if remaining.sum() * 2 >= len(self.route_flat):
+            return
+        take = np.repeat(self.route_pos - np.concatenate([[0], np.cumsum(remaining)[:-1]]), remaining)
+        take += np.arange(remaining.sum())
+        self.route_flat = self.route_flat[take]
+        self.route_pos = np.concatenate([[0], np.cumsum(remaining)[:-1]]).astype(np.int64)
+        self.route_end = self.route_pos + remaining
+
+    def _update_positions(self):
+        seg = self.segment
+        self.x = self.start[seg, 0] + self.direction[seg, 0] * self.offset
+        self.y = self.start[seg, 1] + self.direction[seg, 1] * self.offset
+
+    def positions(self):
+        """(ids, x, y) の配列を返す"""
+        return self.ids, self.x, self.y
@@ -0,0 +1,183 @@
+import heapq
+from collections import OrderedDict
+
+import numpy as np
+
+
+class RoadGraph:
+    """
+    道路ネットワークのグラフ
+    セグメントの端点を座標でスナップしてノードにし、セグメントを両方向の辺にする
+    隣接はCSR配列（indptr, edge_dst, edge_segment, edge_length）で持つ
+    辺の番号付け（有向セグメント）は RoadFollowingEngine と同じ
+    （0..n-1 が順方向, n..2n-1 が逆方向）
+    """
+
+    def __init__(self, index, snap=0.5, cache_size=4096):
+        n = len(index)
+        self.num_segments = n
+
+        # 端点を snap 単位の格子に丸めて同じ位置の端点を1つのノードにまとめる
+        points = np.concatenate([index.p1, index.p2])
+        keys = np.round(points / snap).astype(np.int64)
+        if len(keys):
+            unique, inverse = np.unique(keys, axis=0, return_inverse=True)
+            inverse = inverse.reshape(-1)
+        else:
+            unique, inverse = np.zeros((0, 2), dtype=np.int64), np.zeros(0, dtype=np.int64)
+        self.num_nodes = len(unique)
+        self.node_xy = np.zeros((self.num_nodes, 2))
+        np.add.at(self.node_xy, inverse, points)
+        self.node_xy /= np.maximum(np.bincount(inverse, minlength=self.num_nodes), 1)[:, None]
+
+        a, b = inverse[:n], inverse[n:]
+        # 有向セグメントごとの始点・終点ノード
+        self.segment_start = np.concatenate([a, b])
+        self.segment_end = np.concatenate([b, a])
+        self.segment_length = np.concatenate([index.length, index.length])
+
+        order = np.argsort(self.segment_start, kind='stable')
+        self.edge_segment = order
+        self.edge_dst = self.segment_end[order]
+        self.edge_length = self.segment_length[order]
+        self.indptr = np.zeros(self.num_nodes + 1, dtype=np.int64)
+        np.cumsum(np.bincount(self.segment_start, minlength=self.num_nodes), out=self.indptr[1:])
+        self.degree = np.diff(self.indptr)
+
+        self.cache_size = cache_size
+        self._paths = OrderedDict()   # (src, dst) → 有向セグメント列
+        self._trees = OrderedDict()   # src → 最短路木の直前の辺
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    def reverse(self, segments):
+        """有向セグメントの逆向き"""
+        n = self.num_segments
+        return np.where(segments < n, segments + n, segments - n)
+
+    def next_segments(self, segments, rng):
+        """
+        セグメントの終点ノードから出る辺をランダムに選ぶ（行き止まり以外はUターンしない）
+        """
+        end = self.segment_end[segments]
+        deg = self.degree[end]
+        # Uターン以外の deg-1 本から選び、Uターンを引いたら最後の辺と入れ替える
+        r = (rng.random(len(segments)) * np.maximum(deg - 1, 1)).astype(np.int64)
+        edge = self.indptr[end] + r
+        uturn = (self.edge_segment[edge] == self.reverse(segments)) & (deg > 1)
+        edge[uturn] = self.indptr[end[uturn]] + deg[uturn] - 1
+        return self.edge_segment[edge]
+
+    def nearest_node(self, x, y):
+        return int(np.argmin(np.hypot(self.node_xy[:, 0] - x, self.node_xy[:, 1] - y)))
+
+    def _remember(self, cache, key, value):
+        cache[key] = value
+        if len(cache) > self.cache_size:
+            cache.popitem(last=False)
+
+    def shortest_path(self, src, dst):
+        """
+        ノード src から dst への最短経路を有向セグメントの配列で返す（A*, 結果はキャッシュ）
+        到達できなければNone
+        """
+        key = (int(src), int(dst))
+        if key in self._paths:
+            self._paths.move_to_end(key)
+            self.cache_hits += 1
+            return self._paths[key]
+        self.cache_misses += 1
+
+        # ヒューリスティック（目的地までの直線距離）は全ノード分を一度に計算しておく
+        h = np.hypot(self.node_xy[:, 0] - self.node_xy[dst, 0], self.node_xy[:, 1] - self.node_xy[dst, 1]).tolist()
+        indptr, edge_dst, edge_length = self.indptr, self.edge_dst.tolist(), self.edge_length.tolist()
+        g = {src: 0.0}
+        prev_edge = {}
+        heap = [(h[src], src)]
+        closed = set()
+        while heap:
+            _, node = heapq.heappop(heap)
+            if node == dst:
+                break
+            if node in closed:
+                continue
+            closed.add(node)
+            for e in range(indptr[node], indptr[node + 1]):
+                nxt = edge_dst[e]
+                cost = g[node] + edge_length[e]
+                if cost < g.get(nxt, float('inf')):
+                    g[nxt] = cost
+                    prev_edge[nxt] = e
+                    heapq.heappush(heap, (cost + h[nxt], nxt))
+
+        path = self._walk_back(prev_edge.get, src, dst) if dst in g else None
+        self._remember(self._paths, key, path)
+        return path
+
+    def _shortest_tree(self, src):
+        """src からの最短路木（各ノードへの直前の辺, -1 は未到達）。Dijkstra, 結果はキャッシュ"""
+        if src in self._trees:
+            self._trees.move_to_end(src)
+            return self._trees[src]
+        indptr, edge_dst, edge_length = self.indptr, self.edge_dst.tolist(), self.edge_length.tolist()
+        dist = [float('inf')] * self.num_nodes
+        prev_edge = [-1] * self.num_nodes
+        dist[src] = 0.0
+        heap = [(0.0, src)]
+        while heap:
+            d, node = heapq.heappop(heap)
+            if d > dist[node]:
+                continue
+            for e in range(indptr[node], indptr[node + 1]):
+                nxt = edge_dst[e]
+                cost = d + edge_length[e]
+                if cost < dist[nxt]:
+                    dist[nxt] = cost
+                    prev_edge[nxt] = e
+                    heapq.heappush(heap, (cost, nxt))
+        self._remember(self._trees, src, prev_edge)
+        return prev_edge
+
+    def _walk_back(self, prev_edge, src, dst):
+        edges = []
+        node = dst
+        while node != src:
+            e = prev_edge(node)
+            if e is None or e < 0:
+                return None
+            edges.append(e)
+            node = int(self.segment_start[self.edge_segment[e]])
+        return self.edge_segment[np.array(edges[::-1], dtype=np.int64)]
+
+    def route_many(self, origins, destinations):
+        """
+        多数のOD組の経路をまとめて求める
+        出発地ごとに最短路木を1回だけ作り（キャッシュ）、各目的地へは木をたどるだけ
+        戻り値: 有向セグメント配列（到達不能はNone）のリスト
+        """
+        origins = np.asarray(origins, dtype=np.int64)
+        destinations = np.asarray(destinations, dtype=np.int64)
+        routes = [None] * len(origins)
+        for src in np.unique(origins).tolist():
+            tree = self._shortest_tree(src)
+            for i in np.nonzero(origins == src)[0].tolist():
+                key = (src, int(destinations[i]))
+                if key in self._paths:
+                    self.cache_hits += 1
+                    routes[i] = self._paths[key]
+                    continue
+                self.cache_misses += 1
+                route = self._walk_back(tree.__getitem__, src, key[1])
+                self._remember(self._paths, key, route)
+                routes[i] = route
+        return routes
+
+    def stats(self):
+        return {
+            'nodes': self.num_nodes,
+            'edges': len(self.edge_segment),
+            'cached_paths': len(self._paths),
+            'cached_trees': len(self._trees),
+            'cache_hits': self.cache_hits,
+            'cache_misses': self.cache_misses,
+        }
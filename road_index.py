@@ -0,0 +1,408 @@
+import math
+import numpy as np
+
+
+def polylines_from_features(features):
+    """
+    GeoJSON風のフィーチャ列をフラットな座標配列に変換
+    features: [{'geometry': {'type': 'LineString', 'coordinates': [...]}}, ...]
+    戻り値: (coords (M,2) float64, offsets (P+1,) int64)
+        パートkの頂点は coords[offsets[k]:offsets[k+1]]
+    """
+    parts = []
+    for feature in features or []:
+        geometry = feature.get('geometry') if feature else None
+        if not geometry or not geometry.get('coordinates'):
+            continue
+        if geometry.get('type') == 'MultiLineString':
+            parts.extend(geometry['coordinates'])
+        else:
+            parts.append(geometry['coordinates'])
+
+    offsets = np.zeros(len(parts) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(p) for p in parts])
+    coords = np.empty((int(offsets[-1]), 2), dtype=np.float64)
+    for k, part in enumerate(parts):
+        if len(part) > 0:
+            coords[offsets[k]:offsets[k + 1]] = np.asarray(part, dtype=np.float64)[:, :2]
+    return coords, offsets
+
+
+def part_features(features):
+    """polylines_from_features と同じ順のパートごとに、元のフィーチャ番号を返す"""
+    owners = []
+    for k, feature in enumerate(features or []):
+        geometry = feature.get('geometry') if feature else None
+        if not geometry or not geometry.get('coordinates'):
+            continue
+        if geometry.get('type') == 'MultiLineString':
+            owners.extend([k] * len(geometry['coordinates']))
+        else:
+            owners.append(k)
+    return np.asarray(owners, dtype=np.int64)
+
+
+class SegmentIndex:
+    """
+    道路セグメントの一様グリッド索引
+    各セグメントのバウンディングボックスが重なるセルに登録し、
+    最近傍セグメントの探索を周辺セルだけで済ませる
+    """
+
+    def __init__(self, coords, offsets, cell_size=None):
+        coords = np.asarray(coords, dtype=np.float64).reshape(-1, 2)
+        offsets = np.asarray(offsets, dtype=np.int64)
+        self.coords = coords
+        self.offsets = offsets
+
+        # パートをまたぐ頂点ペアを除いたセグメント（始点の頂点番号）
+        valid = np.ones(max(len(coords) - 1, 0), dtype=bool)
+        boundaries = offsets[1:-1] - 1
+        valid[boundaries[(boundaries >= 0) & (boundaries < len(valid))]] = False
+        starts = np.nonzero(valid)[0]
+
+        d = coords[starts + 1] - coords[starts]
+        length = np.hypot(d[:, 0], d[:, 1])
+        keep = length > 0  # 長さ0のセグメントは従来通り無視
+        starts, d, length = starts[keep], d[keep], length[keep]
+
+        self.vertex = starts
+        self.part = np.searchsorted(offsets, starts, side='right') - 1
+        self.p1 = coords[starts]
+        self.p2 = coords[starts + 1]
+        self.d = d
+        self.length = length
+        self.direction = d / length[:, None] if len(length) else d
+
+        # 終点付近で使う「同じパートの次のセグメント」の方向
+        self.next_direction = self.direction.copy()
+        has_next = starts + 2 < offsets[self.part + 1]
+        nxt = starts[has_next]
+        nd = coords[nxt + 2] - coords[nxt + 1]
+        nl = np.hypot(nd[:, 0], nd[:, 1])
+        ok = nl > 0
+        rows = np.nonzero(has_next)[0][ok]
+        self.next_direction[rows] = nd[ok] / nl[ok, None]
+
+        self._neighbours = None  # nearest_many 用の候補表（初回に作る）
+        self._build_grid(cell_size)
+
+    @classmethod
+    def from_features(cls, features, cell_size=None):
+        coords, offsets = polylines_from_features(features)
+        return cls(coords, offsets, cell_size=cell_size)
+
+    def __len__(self):
+        return len(self.length)
+
+    def _build_grid(self, cell_size):
+        n = len(self.length)
+        if n == 0:
+            self.origin = np.zeros(2)
+            self.cell_size = 1.0
+            self.nx = self.ny = 1
+            self.cell_ptr = np.zeros(2, dtype=np.int64)
+            self.cell_items = np.zeros(0, dtype=np.int64)
+            return
+
+        lo = np.minimum(self.p1, self.p2)
+        hi = np.maximum(self.p1, self.p2)
+        self.origin = lo.min(axis=0)
+        extent = hi.max(axis=0) - self.origin
+        if cell_size is None:
+            # 平均セグメント長を基準に、セル数がセグメント数の数倍に収まるようにする
+            area = max(extent[0], 1.0) * max(extent[1], 1.0)
+            cell_size = max(float(self.length.mean()), math.sqrt(area / (4 * n)))
+        self.cell_size = float(cell_size)
+        self.nx = int(extent[0] // self.cell_size) + 1
+        self.ny = int(extent[1] // self.cell_size) + 1
+
+        c0 = ((lo - self.origin) // self.cell_size).astype(np.int64)
+        c1 = ((hi - self.origin) // self.cell_size).astype(np.int64)
+        wx = c1[:, 0] - c0[:, 0] + 1
+        wy = c1[:, 1] - c0[:, 1] + 1
+        counts = wx * wy
+
+        # セグメントごとに覆うセルを展開
+        seg = np.repeat(np.arange(n), counts)
+        local = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        cx = c0[seg, 0] + local % wx[seg]
+        cy = c0[seg, 1] + local // wx[seg]
+        cell = cy * self.nx + cx
+
+        order = np.argsort(cell, kind='stable')
+        self.cell_items = seg[order]
+        self.cell_ptr = np.zeros(self.nx * self.ny + 1, dtype=np.int64)
+        np.cumsum(np.bincount(cell, minlength=self.nx * self.ny), out=self.cell_ptr[1:])
+
+    def _ring_candidates(self, cx, cy, r):
+        """セル(cx, cy)からチェビシェフ距離rのリング上にあるセグメント"""
+        x0, x1 = max(cx - r, 0), min(cx + r, self.nx - 1)
+        y0, y1 = max(cy - r, 0), min(cy + r, self.ny - 1)
+        chunks = []
+        for gy in range(y0, y1 + 1):
+            if gy == cy - r or gy == cy + r:
+                xs = range(x0, x1 + 1)
+            else:
+                xs = [gx for gx in (cx - r, cx + r) if x0 <= gx <= x1]
+            for gx in xs:
+                cell = gy * self.nx + gx
+                a, b = self.cell_ptr[cell], self.cell_ptr[cell + 1]
+                if b > a:
+                    chunks.append(self.cell_items[a:b])
+        if not chunks:
+            return None
+        return np.unique(np.concatenate(chunks))
+
+    def nearest(self, x, y):
+        """
+        (x, y)に最も近いセグメントを探す
+        戻り値: (segment, t, proj_x, proj_y, dist) 。セグメントが無ければNone
+        距離が同じ場合は全走査と同じく先に現れるセグメントを優先する
+        """
+        if len(self) == 0:
+            return None
+        cx = int((x - self.origin[0]) // self.cell_size)
+        cy = int((y - self.origin[1]) // self.cell_size)
+        # グリッド外の点はグリッドまでのセル距離から探索を始める
+        r = max(0 - cx, cx - (self.nx - 1), 0 - cy, cy - (self.ny - 1), 0)
+
+        best = None
+        while True:
+            cand = self._ring_candidates(cx, cy, r)
+            if cand is not None:
+                p1 = self.p1[cand]
+                d = self.d[cand]
+                t = ((x - p1[:, 0]) * d[:, 0] + (y - p1[:, 1]) * d[:, 1]) / (self.length[cand] ** 2)
+                t = np.clip(t, 0, 1)
+                px = p1[:, 0] + t * d[:, 0]
+                py = p1[:, 1] + t * d[:, 1]
+                dist = np.hypot(x - px, y - py)
+                k = int(np.argmin(dist))  # candは昇順なので同距離なら若い番号
+                if best is None or (dist[k], cand[k]) < (best[4], best[0]):
+                    best = (int(cand[k]), float(t[k]), float(px[k]), float(py[k]), float(dist[k]))
+
+            covers_all = cx - r <= 0 and cy - r <= 0 and cx + r >= self.nx - 1 and cy + r >= self.ny - 1
+            # リングrの外側のセグメントは少なくとも r*cell_size 離れている
+            if covers_all or (best is not None and best[4] < r * self.cell_size):
+                return best
+            r += 1
+
+    def _neighbour_table(self):
+        """各セルの周囲3x3セルに登録されたセグメントの表（昇順, -1で詰める）。初回に一度だけ作る"""
+        if self._neighbours is not None:
+            return self._neighbours
+        rows = []
+        for cy in range(self.ny):
+            for cx in range(self.nx):
+                chunks = []
+                for gy in range(max(cy - 1, 0), min(cy + 1, self.ny - 1) + 1):
+                    a = self.cell_ptr[gy * self.nx + max(cx - 1, 0)]
+                    b = self.cell_ptr[gy * self.nx + min(cx + 1, self.nx - 1) + 1]
+                    chunks.append(self.cell_items[a:b])
+                rows.append(np.unique(np.concatenate(chunks)))
+        width = max((len(row) for row in rows), default=0)
+        table = np.full((len(rows), max(width, 1)), -1, dtype=np.int64)
+        for k, row in enumerate(rows):
+            table[k, :len(row)] = row
+        self._neighbours = table
+        return table
+
+    def _candidate_distances(self, x, y):
+        """
+        点ごとに周囲3x3セルの候補セグメントとの距離の2乗を求める
+        戻り値: (rows, cand, d2)。rows はグリッドの外側1セル以内にある点の添字、cand は -1 詰めの候補
+        """
+        cx = np.floor((x - self.origin[0]) / self.cell_size).astype(np.int64)
+        cy = np.floor((y - self.origin[1]) / self.cell_size).astype(np.int64)
+        # グリッドの外側1セルまではグリッドの端のセルの候補で足りる
+        rows = np.nonzero((cx >= -1) & (cx <= self.nx) & (cy >= -1) & (cy <= self.ny))[0]
+        cell = np.clip(cy[rows], 0, self.ny - 1) * self.nx + np.clip(cx[rows], 0, self.nx - 1)
+        cand = self._neighbour_table()[cell]
+        valid = cand >= 0
+        c = np.where(valid, cand, 0)
+
+        px = x[rows, None]
+        py = y[rows, None]
+        p1 = self.p1[c]
+        d = self.d[c]
+        t = np.clip(((px - p1[..., 0]) * d[..., 0] + (py - p1[..., 1]) * d[..., 1]) / self.length[c] ** 2, 0, 1)
+        d2 = (px - p1[..., 0] - t * d[..., 0]) ** 2 + (py - p1[..., 1] - t * d[..., 1]) ** 2
+        d2[~valid] = np.inf
+        return rows, cand, d2
+
+    def nearest_many(self, xs, ys, max_dist=None, chunk=4096):
+        """
+        多数の点の最近傍セグメントを一括で求める
+        周囲3x3セルの候補だけを見るので、max_dist（既定・上限は cell_size）以内なら nearest と同じ結果
+        戻り値: (segment, dist) の配列。max_dist 以内に道路が無い点は segment = -1
+        """
+        xs = np.asarray(xs, dtype=np.float64)
+        ys = np.asarray(ys, dtype=np.float64)
+        segment = np.full(len(xs), -1, dtype=np.int64)
+        dist = np.full(len(xs), np.inf)
+        if len(self) == 0 or len(xs) == 0:
+            return segment, dist
+        max_dist = self.cell_size if max_dist is None else min(max_dist, self.cell_size)
+
+        for start in range(0, len(xs), chunk):
+            rows, cand, d2 = self._candidate_distances(xs[start:start + chunk], ys[start:start + chunk])
+            k = np.argmin(d2, axis=1)  # 候補は昇順なので同距離なら若い番号
+            r = np.arange(len(rows))
+            best = np.sqrt(d2[r, k])
+            near = best <= max_dist
+            segment[start + rows[near]] = cand[r, k][near]
+            dist[start + rows[near]] = best[near]
+        return segment, dist
+
+    def heading(self, segment, t):
+        """従来と同じ規則で進行方向を返す（終点付近では次のセグメントの方向）"""
+        if t < 0.95:
+            return tuple(self.direction[segment])
+        return tuple(self.next_direction[segment])
+
+
+class SegmentLookup:
+    """
+    最寄りセグメントを画素ごとに前計算したラスタ
+    毎フレーム大量の点を道路に割り当てるとき、1点あたり配列参照だけで済ませる
+    labels（セグメント → 道路番号など）の境目にある画素には、画素内のどこかで最寄りに
+    なりうるセグメント（数本）を持っておき、その中から正確に選ぶ
+    ラベル単位の割り当ては max_dist（既定 cell_size/2）以内で nearest と一致する
+    """
+
+    def __init__(self, index, pixel=None, max_dist=None, labels=None, max_pixels=4_000_000, chunk=4096):
+        self.index = index
+        self.max_dist = index.cell_size / 2 if max_dist is None else float(max_dist)
+        self.origin = index.origin - self.max_dist
+        extent = np.array([index.nx, index.ny]) * index.cell_size + 2 * self.max_dist
+        if not pixel:
+            # 境目の画素に入る点が少なくなる程度に細かく、ただし画素数は max_pixels まで
+            pixel = max(index.cell_size / 16, math.sqrt(extent[0] * extent[1] / max_pixels))
+        self.pixel = float(pixel)
+        self.width, self.height = (np.ceil(extent / self.pixel).astype(np.int64) + 1).tolist()
+
+        cx = self.origin[0] + (np.arange(self.width) + 0.5) * self.pixel
+        cy = self.origin[1] + (np.arange(self.height) + 0.5) * self.pixel
+        gx, gy = (g.ravel() for g in np.meshgrid(cx, cy))
+        segment, _ = index.nearest_many(gx, gy, max_dist=self.max_dist)
+        self.table = segment.astype(np.int32)
+
+        # 隣の画素とラベルが違う画素は画素内でも割り当てが変わりうる
+        label = segment if labels is None else np.where(segment >= 0, np.asarray(labels)[segment], -1)
+        label = label.reshape(self.height, self.width)
+        border = np.zeros(label.shape, dtype=bool)
+        border[1:] |= label[1:] != label[:-1]
+        border[:-1] |= label[1:] != label[:-1]
+        border[:, 1:] |= label[:, 1:] != label[:, :-1]
+        border[:, :-1] |= label[:, 1:] != label[:, :-1]
+        border = np.nonzero(border.ravel())[0]
+
+        # 境目の画素: 中心から最寄りまでの距離 + 画素の対角線 以内のセグメントが候補
+        self.slot = np.full(len(self.table), -1, dtype=np.int32)
+        self.slot[border] = np.arange(len(border))
+        reach = self.pixel * np.sqrt(2)
+        kept = []
+        for start in range(0, len(border), chunk):
+            pix = border[start:start + chunk]
+            cand = np.full((len(pix), index._neighbour_table().shape[1]), -1, dtype=np.int64)
+            rows, c, d2 = index._candidate_distances(gx[pix], gy[pix])
+            d = np.sqrt(d2)
+            limit = np.minimum(d.min(axis=1), self.max_dist) + reach
+            c = np.where(d <= limit[:, None], c, -1)
+            cand[rows] = c
+            kept.append(cand)
+        cand = np.concatenate(kept) if kept else np.full((0, 1), -1, dtype=np.int64)
+        # -1 を後ろに寄せて幅を詰める
+        cand = np.sort(np.where(cand >= 0, cand, np.iinfo(np.int64).max), axis=1)
+        width = max(int((cand < np.iinfo(np.int64).max).sum(axis=1).max(initial=0)), 1)
+        cand = cand[:, :width]
+        self.candidates = np.where(cand == np.iinfo(np.int64).max, -1, cand)
+        self.num_candidates = (self.candidates >= 0).sum(axis=1)
+
+    def lookup(self, xs, ys):
+        """各点の最寄りセグメント（範囲外・道路から max_dist より遠い点は -1）"""
+        xs = np.asarray(xs, dtype=np.float64)
+        ys = np.asarray(ys, dtype=np.float64)
+        px = np.floor((xs - self.origin[0]) / self.pixel).astype(np.int64)
+        py = np.floor((ys - self.origin[1]) / self.pixel).astype(np.int64)
+        inside = np.nonzero((px >= 0) & (px < self.width) & (py >= 0) & (py < self.height))[0]
+        pixel = py[inside] * self.width + px[inside]
+        segment = np.full(len(xs), -1, dtype=np.int64)
+        segment[inside] = self.table[pixel]
+
+        slot = self.slot[pixel]
+        exact = slot >= 0
+        if not np.any(exact):
+            return segment
+        rows = inside[exact]
+        slot = slot[exact]
+        # 候補数の近い点ごとにまとめ、必要な列だけで距離を計算する
+        count = self.num_candidates[slot]
+        for lo, hi in ((0, 2), (2, 4), (4, 8), (8, self.candidates.shape[1])):
+            group = np.nonzero((count > lo) & (count <= hi))[0]
+            if len(group):
+                segment[rows[group]] = self._nearest_candidate(xs[rows[group]], ys[rows[group]],
+                                                               self.candidates[slot[group], :hi])
+        return segment
+
+    def _nearest_candidate(self, xs, ys, cand):
+        index = self.index
+        valid = cand >= 0
+        c = np.where(valid, cand, 0)
+        x = xs[:, None]
+        y = ys[:, None]
+        p1 = index.p1[c]
+        d = index.d[c]
+        t = np.clip(((x - p1[..., 0]) * d[..., 0] + (y - p1[..., 1]) * d[..., 1]) / index.length[c] ** 2, 0, 1)
+        d2 = (x - p1[..., 0] - t * d[..., 0]) ** 2 + (y - p1[..., 1] - t * d[..., 1]) ** 2
+        d2[~valid] = np.inf
+        k = np.argmin(d2, axis=1)  # 候補は昇順なので同距離なら若い番号
+        r = np.arange(len(cand))
+        return np.where(d2[r, k] <= self.max_dist ** 2, cand[r, k], -1)
+
+
+def scan_nearest_segment(features, x, y):
+    """
+    全セグメントを走査する従来の最近傍探索（検証・ベンチマーク用の参照実装）
+    戻り値: (proj_x, proj_y, dist, direction) 。道路が無ければNone
+    """
+    min_dist = float('inf')
+    result = None
+
+    for road in features:
+        if not road.get('geometry') or not road['geometry'].get('coordinates'):
+            continue
+
+        coords = road['geometry']['coordinates']
+        for i in range(len(coords) - 1):
+            p1 = coords[i]
+            p2 = coords[i + 1]
+
+            dx = p2[0] - p1[0]
+            dy = p2[1] - p1[1]
+            segment_length = math.sqrt(dx * dx + dy * dy)
+
+            if segment_length == 0:
+                continue
+
+            t = ((x - p1[0]) * dx + (y - p1[1]) * dy) / (segment_length * segment_length)
+            t = max(0, min(1, t))
+
+            proj_x = p1[0] + t * dx
+            proj_y = p1[1] + t * dy
+
+            dist = math.sqrt((x - proj_x)**2 + (y - proj_y)**2)
+
+            if dist < min_dist:
+                min_dist = dist
+                direction = (dx / segment_length, dy / segment_length)
+                if t >= 0.95 and i < len(coords) - 2:
+                    next_dx = coords[i+2][0] - p2[0]
+                    next_dy = coords[i+2][1] - p2[1]
+                    next_length = math.sqrt(next_dx * next_dx + next_dy * next_dy)
+                    if next_length > 0:
+                        direction = (next_dx / next_length, next_dy / next_length)
+                result = (proj_x, proj_y, dist, direction)
+
+    return result
@@ -0,0 +1,249 @@
+import logging
+import multiprocessing as mp
+import threading
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# 共有メモリ先頭のヘッダ（int64）
+SEQ = 0        # 公開済みのフレーム数（最新フレームは スロット SEQ % 2）
+CONSUMED = 1   # 読み出し側が使い終えた最後の SEQ
+CAPACITY = 2
+COUNT = 3      # エージェント数
+HEADER_FIELDS = 8
+
+
+class SharedFrameBuffer:
+    """
+    multiprocessing.shared_memory 上のフレームのダブルバッファ
+    ヘッダの後にスロット0, 1 を置き、各スロットは ids(int64), xs, ys(float64) をそれぞれ capacity 個持つ
+    ワーカーはフレーム SEQ+1 をスロット (SEQ+1) % 2 に書いてから SEQ を進める
+    同じスロットを使う SEQ-1 を読み出し側が release するまで、ワーカーは書き始めない
+    """
+
+    def __init__(self, capacity=None, name=None):
+        if name is None:
+            size = 8 * HEADER_FIELDS + 2 * 3 * 8 * capacity
+            self.shm = shared_memory.SharedMemory(create=True, size=size)
+            self.owner = True
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+            self.owner = False
+        self.header = np.ndarray(HEADER_FIELDS, dtype=np.int64, buffer=self.shm.buf)
+        if self.owner:
+            self.header[:] = 0
+            self.header[CAPACITY] = capacity
+        capacity = int(self.header[CAPACITY])
+        self.capacity = capacity
+        self.slots = []
+        offset = 8 * HEADER_FIELDS
+        for _ in range(2):
+            ids = np.ndarray(capacity, dtype=np.int64, buffer=self.shm.buf, offset=offset)
+            xs = np.ndarray(capacity, dtype=np.float64, buffer=self.shm.buf, offset=offset + 8 * capacity)
+            ys = np.ndarray(capacity, dtype=np.float64, buffer=self.shm.buf, offset=offset + 16 * capacity)
+            self.slots.append((ids, xs, ys))
+            offset += 24 * capacity
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    @property
+    def seq(self):
+        return int(self.header[SEQ])
+
+    def latest(self, after=0):
+        """
+        SEQ が after より新しければ (seq, ids, xs, ys) を返す（配列は共有メモリのビューでコピーしない）
+        ビューは release(seq) するまで有効
+        """
+        seq = int(self.header[SEQ])
+        if seq <= after:
+            return None
+        count = int(self.header[COUNT])
+        ids, xs, ys = self.slots[seq % 2]
+        return seq, ids[:count], xs[:count], ys[:count]
+
+    def release(self, seq):
+        self.header[CONSUMED] = max(int(self.header[CONSUMED]), seq)
+
+    def writable(self, seq):
+        """フレーム seq を書き込めるか（同じスロットの seq-2 が使い終わっているか）"""
+        return int(self.header[CONSUMED]) >= seq - 2
+
+    def close(self):
+        self.header = None
+        self.slots = []
+        try:
+            self.shm.close()
+        except BufferError:
+            # 呼び出し側がまだビューを持っている。マップはプロセス終了時に解放される
+            logger.debug("Shared frame buffer %s still has views", self.shm.name)
+        if self.owner:
+            self.shm.unlink()
+
+
+def partition_by_region(xs, num_workers):
+    """x 座標の分位点で領域を分け、各ワーカーが担当する添字の配列を返す"""
+    order = np.argsort(xs, kind='stable')
+    return np.array_split(order, num_workers)
+
+
+def make_simulation(spec):
+    """ワーカー内でシミュレーションを作る。step() と positions() -> (ids, xs, ys) を持つもの"""
+    if spec['kind'] == 'road':
+        from road_engine import RoadFollowingEngine
+        from road_graph import RoadGraph
+        from road_index import SegmentIndex
+
+        index = SegmentIndex(spec['coords'], spec['offsets'])
+        engine = RoadFollowingEngine(index, speed=spec.get('speed', 10.0), seed=spec.get('seed'),
+                                     graph=RoadGraph(index))
+        engine.place(spec['ids'], spec['xs'], spec['ys'])
+        return engine
+    if spec['kind'] == 'model':
+        from model import MinakusaModel
+
+        model = MinakusaModel(len(spec['ids']), engine='vector', seed=spec.get('seed'))
+        model.ids[:] = spec['ids']
+        model.positions[:, 0] = spec['xs']
+        model.positions[:, 1] = spec['ys']
+        return _ModelAdapter(model)
+    raise ValueError(f"unknown simulation kind: {spec['kind']}")
+
+
+class _ModelAdapter:
+    def __init__(self, model):
+        self.model = model
+
+    def step(self):
+        self.model.step()
+
+    def positions(self):
+        return self.model.get_agent_positions()
+
+
+def worker_main(buffer_name, spec, k, lo, hi, barrier, stop, interval, step_ms):
+    """
+    ワーカープロセスの本体
+    担当範囲 [lo, hi) の行だけを書き、全ワーカーが書き終えたら番号0のワーカーが SEQ を進める
+    step_ms[k] に直近のステップ時間を書く
+    """
+    buffer = SharedFrameBuffer(name=buffer_name)
+    try:
+        sim = make_simulation(spec)
+        leader = k == 0
+        # 他のワーカーが落ちたときに待ち続けないようにする
+        timeout = max(30.0, interval * 10)
+        while not stop.is_set():
+            started = time.perf_counter()
+            sim.step()
+            ids, xs, ys = sim.positions()
+            step_ms[k] = (time.perf_counter() - started) * 1000
+
+            seq = buffer.seq + 1
+            # 読み出し側が同じスロットを使い終わるまで待つ（遅い読み出し側に合わせてシミュレーションも止まる）
+            while not buffer.writable(seq) and not stop.is_set():
+                time.sleep(0.001)
+            slot_ids, slot_xs, slot_ys = buffer.slots[seq % 2]
+            slot_ids[lo:hi] = ids
+            slot_xs[lo:hi] = xs
+            slot_ys[lo:hi] = ys
+
+            barrier.wait(timeout)
+            if leader:
+                buffer.header[SEQ] = seq
+            # 全員が新しい SEQ を見てから次のステップに進む
+            barrier.wait(timeout)
+
+            remaining = interval - (time.perf_counter() - started)
+            if remaining > 0:
+                stop.wait(remaining)
+    except threading.BrokenBarrierError:
+        pass
+    finally:
+        barrier.abort()
+        buffer.close()
+
+
+class SimulationWorkers:
+    """
+    シミュレーションを領域ごとに分けた複数のワーカープロセスで進め、
+    SharedFrameBuffer に書かれたフレームを Web プロセスから読む
+    spec: {'kind': 'road', 'coords', 'offsets', ...} または {'kind': 'model'}（make_simulation を参照）
+    """
+
+    def __init__(self, spec, ids, xs, ys, num_workers=2, interval=0.1):
+        self.spec = spec
+        self.num_workers = max(1, min(int(num_workers), len(ids) or 1))
+        self.interval = interval
+        ids = np.asarray(ids, dtype=np.int64)
+        xs = np.asarray(xs, dtype=np.float64)
+        ys = np.asarray(ys, dtype=np.float64)
+        self.parts = partition_by_region(xs, self.num_workers)
+        self.buffer = SharedFrameBuffer(max(len(ids), 1))
+        self.buffer.header[COUNT] = len(ids)
+
+        # eventlet の Web プロセスを fork しないように spawn で起動する
+        ctx = mp.get_context('spawn')
+        self.stop_event = ctx.Event()
+        self.barrier = ctx.Barrier(self.num_workers)
+        self.step_ms = ctx.Array('d', self.num_workers, lock=False)
+        self.processes = []
+        lo = 0
+        for k, part in enumerate(self.parts):
+            hi = lo + len(part)
+            worker_spec = dict(spec, ids=ids[part], xs=xs[part], ys=ys[part],
+                               seed=None if spec.get('seed') is None else spec['seed'] + k)
+            process = ctx.Process(target=worker_main, name=f'sim-worker-{k}', daemon=True,
+                                  args=(self.buffer.name, worker_spec, k, lo, hi, self.barrier,
+                                        self.stop_event, interval, self.step_ms))
+            self.processes.append(process)
+            lo = hi
+        self.read_seq = 0
+        self.started_at = None
+
+    def start(self):
+        for process in self.processes:
+            process.start()
+        self.started_at = time.monotonic()
+        logger.info("Started %d simulation workers (%d agents)", len(self.processes), int(self.buffer.header[COUNT]))
+
+    def poll(self):
+        """新しいフレームがあれば (seq, ids, xs, ys) のビューを返す。使い終えたら release(seq) を呼ぶ"""
+        latest = self.buffer.latest(self.read_seq)
+        if latest is not None:
+            self.read_seq = latest[0]
+        return latest
+
+    def release(self, seq):
+        self.buffer.release(seq)
+
+    def alive(self):
+        return all(process.is_alive() for process in self.processes)
+
+    def stop(self, timeout=2.0):
+        self.stop_event.set()
+        self.barrier.abort()
+        for process in self.processes:
+            process.join(timeout)
+            if process.is_alive():
+                process.terminate()
+        self.buffer.close()
+        logger.info("Stopped simulation workers")
+
+    def stats(self):
+        header = self.buffer.header
+        return {
+            'workers': len(self.processes),
+            'alive': sum(process.is_alive() for process in self.processes),
+            'agents': int(header[COUNT]),
+            'partition_sizes': [len(part) for part in self.parts],
+            'published': int(header[SEQ]),
+            'consumed': int(header[CONSUMED]),
+            'step_ms': list(self.step_ms),
+            'interval': self.interval,
+        }
@@ -0,0 +1,99 @@
+import gzip
+import json
+import os
+import threading
+
+from flask import Response, request
+
+
+class SnapshotCache:
+    """
+    GAMA から受け取った最新の状態を、バージョンごとに一度だけシリアライズして返すキャッシュ
+    publish() でバージョンを進めて JSON を作る（gzip は最初に求められたときに一度だけ作る）
+    response() は ETag / If-None-Match で 304 を返し、?since=<version> なら
+    それより新しいバージョンが出るまで最大 timeout 秒待つ（ロングポーリング）
+    since は ETag と同じ "<boot>-<version>"（X-Snapshot-Token）か数値のバージョン。再起動でバージョンは
+    0 に戻るので、別のプロセスの since や現在より新しい since には待たずに現在の内容を返す
+    """
+
+    def __init__(self, payload, max_wait=30.0, compress_min_size=1024):
+        self.max_wait = max_wait
+        self.compress_min_size = compress_min_size
+        # 再起動後に古い ETag と一致しないようにプロセスごとの接頭辞を付ける
+        self._boot = os.urandom(4).hex()
+        self._cond = threading.Condition()
+        self.version = -1
+        self.serializations = 0
+        self.publish(payload)
+
+    @property
+    def etag(self):
+        return f'{self._boot}-{self.version}'
+
+    def publish(self, payload):
+        """payload（dict）を新しいバージョンとしてシリアライズし、待っているリクエストを起こす"""
+        with self._cond:
+            version = self.version + 1
+            body = json.dumps(dict(payload, version=version), separators=(',', ':')).encode('utf-8')
+            self.serializations += 1
+            self.version = version
+            self._bodies = {'identity': body}
+            self._cond.notify_all()
+            return version
+
+    def wait(self, since, timeout):
+        """バージョンが since より新しくなるまで最大 timeout 秒待ち、その時点のバージョンを返す"""
+        with self._cond:
+            self._cond.wait_for(lambda: self.version > since, timeout)
+            return self.version
+
+    def _body(self, encoding):
+        with self._cond:
+            bodies, etag = self._bodies, self.etag
+            if encoding == 'gzip' and 'gzip' not in bodies:
+                bodies['gzip'] = gzip.compress(bodies['identity'], compresslevel=6)
+            return bodies[encoding], etag
+
+    def _since(self):
+        """?since= のバージョン。無いか、再起動前のもの（待つと古い内容のままになる）ならNone"""
+        raw = request.args.get('since', '')
+        try:
+            since = int(raw)
+        except ValueError:
+            boot, _, version = raw.rpartition('-')
+            if boot != self._boot or not version.isdigit():
+                return None
+            since = int(version)
+        return since if since <= self.version else None
+
+    def response(self):
+        since = self._since()
+        if since is not None:
+            timeout = min(request.args.get('timeout', self.max_wait, type=float), self.max_wait)
+            if self.wait(since, timeout) <= since:
+                # 待っている間に更新が無かった
+                return self._not_modified()
+        if request.if_none_match.contains_weak(self.etag):
+            return self._not_modified()
+
+        encoding = 'identity'
+        if request.accept_encodings['gzip'] and len(self._bodies['identity']) >= self.compress_min_size:
+            encoding = 'gzip'
+        body, etag = self._body(encoding)
+        resp = Response(body, mimetype='application/json')
+        if encoding != 'identity':
+            resp.headers['Content-Encoding'] = encoding
+        resp.set_etag(etag, weak=True)
+        resp.headers['Cache-Control'] = 'no-cache'
+        resp.headers['X-Snapshot-Version'] = etag.rsplit('-', 1)[1]
+        resp.headers['X-Snapshot-Token'] = etag
+        resp.vary.add('Accept-Encoding')
+        return resp
+
+    def _not_modified(self):
+        resp = Response(status=304)
+        resp.set_etag(self.etag, weak=True)
+        resp.headers['Cache-Control'] = 'no-cache'
+        resp.headers['X-Snapshot-Version'] = str(self.version)
+        resp.headers['X-Snapshot-Token'] = self.etag
+        return resp
@@ -0,0 +1,68 @@
+// static/frame_codec.js
+// new_data_bin（キーフレーム + 差分）のデコーダ。形式は frame_codec.py を参照
+
+"use strict";
+
+const FRAME_HEADER_SIZE = 40;
+const FRAME_KEYFRAME = 0;
+const FRAME_DELTA = 1;
+
+class FrameDecoder {
+    constructor() {
+        this.ids = null;   // Int32Array（id昇順）
+        this.x = null;     // Float64Array
+        this.y = null;     // Float64Array
+    }
+
+    /**
+     * バイナリフレームを復号して { frame, total_frames, ids, x, y } を返す
+     * キーフレームを受け取る前の差分フレームは null を返す
+     */
+    decode(buffer) {
+        const view = new DataView(buffer);
+        const type = view.getUint8(0);
+        const frame = view.getUint32(4, true);
+        const totalFrames = view.getUint32(8, true);
+        const count = view.getUint32(12, true);
+        const quantum = view.getFloat32(16, true);
+
+        if (type === FRAME_KEYFRAME) {
+            const originX = view.getFloat64(24, true);
+            const originY = view.getFloat64(32, true);
+            this.ids = new Int32Array(buffer.slice(FRAME_HEADER_SIZE, FRAME_HEADER_SIZE + count * 4));
+            const xy = new Float32Array(buffer, FRAME_HEADER_SIZE + count * 4, count * 2);
+            this.x = new Float64Array(count);
+            this.y = new Float64Array(count);
+            for (let i = 0; i < count; i++) {
+                this.x[i] = originX + xy[2 * i];
+                this.y[i] = originY + xy[2 * i + 1];
+            }
+        } else if (type === FRAME_DELTA) {
+            if (this.ids === null) return null;
+            const index = new Uint32Array(buffer, FRAME_HEADER_SIZE, count);
+            const dxy = new Int16Array(buffer, FRAME_HEADER_SIZE + count * 4, count * 2);
+            for (let i = 0; i < count; i++) {
+                const j = index[i];
+                this.x[j] += dxy[2 * i] * quantum;
+                this.y[j] += dxy[2 * i + 1] * quantum;
+            }
+        } else {
+            console.warn("[frame_codec.js] Unknown frame type:", type);
+            return null;
+        }
+
+        return { frame: frame, total_frames: totalFrames, ids: this.ids, x: this.x, y: this.y };
+    }
+}
+
+// JSON の agents 配列を同じ列形式に変換
+function columnsFromAgents(agents) {
+    const n = agents.length;
+    const columns = { ids: new Int32Array(n), x: new Float64Array(n), y: new Float64Array(n) };
+    for (let i = 0; i < n; i++) {
+        columns.ids[i] = agents[i].id;
+        columns.x[i] = parseFloat(agents[i].x);
+        columns.y[i] = parseFloat(agents[i].y);
+    }
+    return columns;
+}
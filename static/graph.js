@@ -1,6 +1,10 @@
-// Socket.IOの初期化
-var socket = io();
+// Socket.IOの初期化（エージェントのフレームは受け取らない）
+var socket = io({ query: { format: 'none' } });
 var data = [];
+var graphWindow = 600;  // 保持する変化点の数（/get_graph_data の window）
+// plot1 を /get_graph_data で作り終えるまでに届いた差分（作り終えたら順に足す）
+var plot1Ready = false;
+var pendingDeltas = [];
 
 // グラフを初期化
 Plotly.newPlot('plot', data);
@@ -21,6 +25,16 @@ var layout = {
 // サーバーからデータを受信して更新
 
 socket.on('update_plot', function(msg) {
+    // 差分: {frame, counts} を plot1 の各線の末尾に追加する
+    if (!msg.lines) {
+        if (!plot1Ready) {
+            pendingDeltas.push(msg);
+            if (pendingDeltas.length > graphWindow) pendingDeltas.shift();
+            return;
+        }
+        extendPlot1(msg);
+        return;
+    }
     // 各線を更新
     var graph_data = {};
     data = [];
@@ -47,24 +61,36 @@ socket.on('update_plot', function(msg) {
     Plotly.react('plot', data, layout);
 });
 
+function extendPlot1(msg) {
+    var indices = msg.counts.map((_, index) => index);
+    Plotly.extendTraces('plot1', {
+        x: msg.counts.map(() => [msg.frame]),
+        y: msg.counts.map(count => [count])
+    }, indices, graphWindow);
+}
+
 //sasaki
 function fetchDataAndUpdateGraph() {
+    plot1Ready = false;
     fetch('/get_graph_data')
         .then(response => response.json())
         .then(data => {
             console.log(data);
             var x_data = data.x_data;
+            graphWindow = data.window || graphWindow;
             //app.pyでy1とy2をに方向を定義している
             var y_1_name = data.y1
             var y_2_name = data.y2
             document.getElementById('graph-name').innerText=data.graph_name;
 
             //app.pyでy_data1とy_data2をデータのキーとして定義している
+            // 台数は変化したフレームだけ届くので階段状に描く
             var trace1 = data.y_data1.map(dataset => ({
                 x: x_data,
                 y: dataset.y,
                 mode: 'lines',
                 type: 'scatter',
+                line: { shape: 'hv' },
                 name: dataset.name
             }));
 
@@ -98,7 +124,13 @@ function fetchDataAndUpdateGraph() {
                 yaxis: {title: 'car_num'}
             };
 
-            Plotly.react('plot1', trace1, layout1);
+            // 作り終えてから、待たせていた差分のうち取得した全体より新しいものを足す
+            var lastFrame = x_data.length ? x_data[x_data.length - 1] : -Infinity;
+            Plotly.react('plot1', trace1, layout1).then(() => {
+                pendingDeltas.filter(msg => msg.frame > lastFrame).forEach(extendPlot1);
+                pendingDeltas = [];
+                plot1Ready = true;
+            });
             //Plotly.react('plot2', trace2, layout2);
             if (trace2.length > 0) {
                 Plotly.react('plot2', trace2, layout2);
@@ -106,13 +138,16 @@ function fetchDataAndUpdateGraph() {
                 document.getElementById('plot2').innerHTML = '';
             }
         })
+        .catch(err => console.error('Error fetching graph data:', err));
 }
 
 
 
-fetchDataAndUpdateGraph();
-// 0.5秒ごとにデータを取得してグラフを更新
-setInterval(fetchDataAndUpdateGraph, 500);
+// 接続（再接続）のたびに全体を取り直し、以降は update_plot の差分で更新
+socket.on('connect', function() {
+    socket.emit('subscribe_traffic');
+    fetchDataAndUpdateGraph();
+});
 
 //改良前のコード
 // function fetchDataAndUpdateGraph() {
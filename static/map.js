@@ -1,4 +1,5 @@
 // static/map.js
+// frame_codec.js（FrameDecoder, columnsFromAgents）を先に読み込むこと
 
 console.log("[map.js] start loading...");
 
@@ -95,11 +96,15 @@ function drawGeometry(geometry, context) {
 
 console.log("[map.js] Loading complete.");
 
+// バイナリ形式（キーフレーム + 差分）で受信する
+const frameDecoder = new FrameDecoder();
+
 // Socket.IO接続のエラーハンドリングを強化
 const socket = io({
     transports: ['websocket'],
     reconnection: true,
-    reconnectionAttempts: 5
+    reconnectionAttempts: 5,
+    query: { format: 'binary' }
 });
 
 // デモモード用の変数
@@ -142,6 +147,20 @@ socket.on('connect', () => {
     }
 });
 
+// キャンバスに映る範囲（マップ座標）をサーバに登録し、範囲内のエージェントだけを受け取る
+// （描画の変換 px = (x + offsetX) * scale - xmove の逆変換。余白はサーバ側で足す）
+socket.on('connect', () => {
+    socket.emit('set_viewport', {
+        bounds: [
+            xmove / scale - offsetX,
+            ymove / scale - offsetY,
+            (canvasWidth + xmove) / scale - offsetX,
+            (canvasHeight + ymove) / scale - offsetY
+        ],
+        zoom: scale
+    });
+});
+
 socket.on('connect_error', (error) => {
     console.error('Socket.IO connection error:', error);
 });
@@ -151,34 +170,121 @@ let isPlaying = false;
 let totalFrames = 100;
 let availableFrames = 0;
 
+// ---------- 再生（サーバから範囲をまとめて先読み） ----------
+// request_frames で [start, end) を要求すると、このクライアントにだけ frame_chunk が届く
+// サーバは GAMA のサイクル間を REPLAY_SUBSTEPS 分割で補間して返す
+const REPLAY_FPS = 30;             // 再生のフレームレート
+const REPLAY_CYCLE_SECONDS = 0.5;  // GAMAの1サイクルを何秒で再生するか
+const REPLAY_SUBSTEPS = Math.max(1, Math.round(REPLAY_FPS * REPLAY_CYCLE_SECONDS));
+const REPLAY_PREFETCH = 40;        // 再生位置より先に読んでおくサイクル数
+const REPLAY_CACHE_LIMIT = 4000;   // 保持する補間フレーム数の上限
+
+const replayCache = new Map();     // 補間フレーム番号（サイクル * SUBSTEPS + i）→ columns
+let replayRequestId = 0;
+let replayRequestedFrom = 0;       // 要求済みの範囲 [from, until)（サイクル）
+let replayRequestedUntil = 0;
+let replayPending = false;         // 要求した範囲をまだ受信中
+let replayPosition = 0;            // 再生位置（補間フレーム番号）
+let replayTimer = null;
+
+function replayKey(time) {
+    return Math.round(time * REPLAY_SUBSTEPS);
+}
+
+// start から先読み分を要求する（新しい要求はサーバ側で古い要求を打ち切る）
+function requestReplayRange(start) {
+    const end = Math.min(start + REPLAY_PREFETCH, availableFrames);
+    if (end <= start) return;
+    replayRequestId++;
+    replayRequestedFrom = start;
+    replayRequestedUntil = end;
+    replayPending = true;
+    socket.emit('request_frames', {
+        request_id: replayRequestId,
+        start: start,
+        end: end,
+        substeps: REPLAY_SUBSTEPS
+    });
+}
+
+socket.on('frame_chunk', (chunk) => {
+    if (chunk.request_id !== replayRequestId || !chunk.data) return;
+    // チャンクごとに先頭がキーフレーム
+    const decoder = new FrameDecoder();
+    chunk.data.forEach((payload, i) => {
+        const decoded = decoder.decode(payload);
+        if (!decoded) return;
+        replayCache.set(replayKey(chunk.times[i]), {
+            ids: decoded.ids, x: decoded.x.slice(), y: decoded.y.slice()
+        });
+    });
+    // 古いものから捨てる
+    while (replayCache.size > REPLAY_CACHE_LIMIT) {
+        replayCache.delete(replayCache.keys().next().value);
+    }
+    if (chunk.done) {
+        replayPending = false;
+    }
+});
+
+// 再生位置のフレームを描画する。無ければ先読みを要求して false
+function showReplayFrame(position) {
+    const columns = replayCache.get(position);
+    const cycle = Math.floor(position / REPLAY_SUBSTEPS);
+    const requested = cycle >= replayRequestedFrom && cycle < replayRequestedUntil;
+    if (!columns && !requested) {
+        // 要求していない位置（スライダーで飛んだ先など）
+        requestReplayRange(cycle);
+    } else if (!replayPending && cycle + REPLAY_PREFETCH / 2 >= replayRequestedUntil) {
+        // 受信し終えたら続きを先読みする
+        requestReplayRange(replayRequestedUntil);
+    }
+    if (!columns) return false;
+    currentFrame = cycle;
+    frameSlider.value = currentFrame;
+    updateAgents(columns);
+    updateProgressBar();
+    return true;
+}
+
+function stopReplay() {
+    isPlaying = false;
+    if (replayTimer) {
+        clearInterval(replayTimer);
+        replayTimer = null;
+    }
+    if (playPauseIcon) {
+        playPauseIcon.textContent = '▶';
+    }
+}
+
 // 再生/一時停止ボタンのイベントリスナー（null チェックを追加）
 if (playPauseBtn) {
     playPauseBtn.addEventListener('click', () => {
-        isPlaying = !isPlaying;
-        if (playPauseIcon) {
-            playPauseIcon.textContent = isPlaying ? '⏸' : '▶';
-        }
-
         if (isPlaying) {
-            playNextFrame();
+            stopReplay();
+            return;
         }
+        isPlaying = true;
+        if (playPauseIcon) {
+            playPauseIcon.textContent = '⏸';
+        }
+        replayPosition = currentFrame * REPLAY_SUBSTEPS;
+        requestReplayRange(currentFrame);
+        replayTimer = setInterval(playNextFrame, 1000 / REPLAY_FPS);
     });
 }
 
-// フレームの再生
+// フレームの再生（先読みが間に合っていなければその位置で待つ）
 function playNextFrame() {
     if (!isPlaying) return;
-
-    const nextFrame = currentFrame + 1;
-    if (nextFrame < availableFrames) {
-        socket.emit('request_frame', nextFrame);
-        setTimeout(playNextFrame, 500); // 0.5秒間隔で再生
-    } else {
+    if ((replayPosition + 1) / REPLAY_SUBSTEPS >= availableFrames - 1) {
         // 最後まで再生したら停止
-        isPlaying = false;
-        if (playPauseIcon) {
-            playPauseIcon.textContent = '▶';
-        }
+        stopReplay();
+        return;
+    }
+    if (showReplayFrame(replayPosition + 1)) {
+        replayPosition++;
     }
 }
 
@@ -186,20 +292,19 @@ function playNextFrame() {
 if (frameSlider) {
     frameSlider.addEventListener('input', (e) => {
         const requestedFrame = parseInt(e.target.value);
-        if (requestedFrame <= availableFrames) {
-            isPlaying = false;
-            if (playPauseIcon) {
-                playPauseIcon.textContent = '▶';
-            }
-            socket.emit('request_frame', requestedFrame);
+        if (requestedFrame < availableFrames) {
+            stopReplay();
+            replayPosition = requestedFrame * REPLAY_SUBSTEPS;
+            showReplayFrame(replayPosition);
         }
     });
 }
 
-// エージェントを描画する関数
-function updateAgents(agents) {
+// エージェントを描画する関数（columns: { ids, x, y } の列形式）
+function updateAgents(columns) {
+    const count = columns.ids.length;
     console.log('=== エージェント更新開始 ===');
-    console.log(`エージェント数: ${agents.length}`);
+    console.log(`エージェント数: ${count}`);
 
     // キャンバスをクリア
     highlightCtx.clearRect(0, 0, highlightCanvas.width, highlightCanvas.height);
@@ -208,16 +313,17 @@ function updateAgents(agents) {
     let visibleCount = 0;
     let invisibleCount = 0;
 
-    agents.forEach((agent, index) => {
+    for (let index = 0; index < count; index++) {
+        const id = columns.ids[index];
         // 座標変換（マップと同じスケーリングを使用）
-        const rawX = parseFloat(agent.x);
-        const rawY = parseFloat(agent.y);
+        const rawX = columns.x[index];
+        const rawY = columns.y[index];
         const px = ((rawX + offsetX) * scale - xmove);
         const py = canvasHeight - ((rawY + offsetY) * scale - ymove);
 
         // 最初の3エージェントの座標をログ
         if (index < 3) {
-            console.log(`エージェント ${agent.id}:`, {
+            console.log(`エージェント ${id}:`, {
                 raw: { x: rawX, y: rawY },
                 transformed: { x: px, y: py },
                 canvas: { width: canvasWidth, height: canvasHeight }
@@ -245,17 +351,17 @@ function updateAgents(agents) {
             highlightCtx.strokeStyle = 'black';
             highlightCtx.lineWidth = 2;
             highlightCtx.textAlign = 'center';
-            highlightCtx.strokeText(`${agent.id}`, px, py - 8);
-            highlightCtx.fillText(`${agent.id}`, px, py - 8);
+            highlightCtx.strokeText(`${id}`, px, py - 8);
+            highlightCtx.fillText(`${id}`, px, py - 8);
         } else {
             invisibleCount++;
         }
-    });
+    }
 
     console.log('描画結果:', {
         visible: visibleCount,
         invisible: invisibleCount,
-        total: agents.length,
+        total: count,
         scale: scale,
         offset: { x: offsetX, y: offsetY },
         move: { x: xmove, y: ymove }
@@ -265,8 +371,29 @@ function updateAgents(agents) {
     updateFrameDisplay();
 }
 
-// Socket.IOイベントハンドラを更新
-socket.on('new_data', (data) => {
+// 受信したフレームを反映（再生中は最新フレームの数だけ更新して描画しない）
+function handleFrame(frame, columns, total) {
+    // 初めてデータを受信したらUIを有効化
+    if (availableFrames === 0) {
+        frameSlider.disabled = false;
+        playPauseBtn.disabled = false;
+    }
+
+    availableFrames = total || availableFrames + 1;
+    if (isPlaying) {
+        updateProgressBar();
+        return;
+    }
+    currentFrame = frame || currentFrame;
+    frameSlider.value = currentFrame;
+
+    updateAgents(columns);
+    updateProgressBar();
+}
+
+// Socket.IOイベントハンドラを更新（JSON形式: フレーム要求の応答など）
+// ack: 描画し終えたことをサーバに返す（返すまで次のフレームは送られない）
+socket.on('new_data', (data, ack) => {
     console.log('=== 新しいデータを受信 ===');
     console.log('データ構造:', {
         hasData: !!data,
@@ -275,26 +402,50 @@ socket.on('new_data', (data) => {
     });
 
     if (data && data.agents && Array.isArray(data.agents)) {
-        // 初めてデータを受信したらUIを有効化
-        if (availableFrames === 0) {
-            frameSlider.disabled = false;
-            playPauseBtn.disabled = false;
-        }
-
-        availableFrames++;
-        currentFrame = data.frame || currentFrame;
-        frameSlider.value = currentFrame;
-
         // 最初の3エージェントのデータをログ
         if (data.agents.length > 0) {
             console.log('サンプルエージェント:', data.agents.slice(0, 3));
         }
 
-        updateAgents(data.agents);
-        updateProgressBar();
+        handleFrame(data.frame, columnsFromAgents(data.agents), data.total_frames);
     } else {
         console.error('無効なデータ形式:', data);
     }
+    if (ack) ack();
+});
+
+// バイナリ形式のフレーム
+socket.on('new_data_bin', (buffer, ack) => {
+    const decoded = frameDecoder.decode(buffer);
+    if (decoded) {
+        handleFrame(decoded.frame, decoded, decoded.total_frames);
+    }
+    if (ack) ack();
+});
+
+// 範囲内のエージェントが多すぎるときはセルごとの台数が届く
+socket.on('clusters', (data, ack) => {
+    if (!isPlaying) {
+        highlightCtx.clearRect(0, 0, highlightCanvas.width, highlightCanvas.height);
+        highlightCtx.textAlign = 'center';
+        highlightCtx.font = 'bold 12px Arial';
+        for (let i = 0; i < data.count.length; i++) {
+            const px = (data.x[i] + offsetX) * scale - xmove;
+            const py = canvasHeight - ((data.y[i] + offsetY) * scale - ymove);
+            const radius = 6 + 3 * Math.log2(data.count[i]);
+            highlightCtx.beginPath();
+            highlightCtx.arc(px, py, radius, 0, 2 * Math.PI);
+            highlightCtx.fillStyle = 'rgba(255, 0, 0, 0.6)';
+            highlightCtx.fill();
+            highlightCtx.fillStyle = 'white';
+            highlightCtx.fillText(`${data.count[i]}`, px, py + 4);
+        }
+        currentFrame = data.frame || currentFrame;
+        updateFrameDisplay();
+    }
+    availableFrames = data.total_frames || availableFrames;
+    updateProgressBar();
+    if (ack) ack();
 });
 
 // プログレスバーの更新
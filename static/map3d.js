@@ -60,6 +60,11 @@ function initScene() {
     controls.enableDamping = true;
     controls.dampingFactor = 0.05;
 
+    // 表示範囲のタイルを読み込む
+    initTiles();
+    // 押し出した建物（サーバで三角形分割・結合済みのGLB）を読み込む
+    initBuildingMeshes();
+
     // 地図を読み込む範囲
     boundary = {
         e: 135.5694,
@@ -223,6 +228,165 @@ function createGeoObject(project, overpassData) {
     return root;
 }
 
+// ========== サーバのタイル（/tiles）から表示範囲の道路・建物を読み込む ==========
+const TILE_LAYER_COLORS = { roads: 0x666666, buildings: 0xa08070 };
+const tileLayers = {};   // layer → { meta, tiles: Map("z/x/y" → Object3D | null) }
+let tileRoot;
+let tileUpdateTimer = null;
+
+function initTiles() {
+    tileRoot = new THREE.Group();
+    scene.add(tileRoot);
+    Object.keys(TILE_LAYER_COLORS).forEach(layer => {
+        fetch(`/tiles/${layer}/meta`)
+            .then(response => response.json())
+            .then(meta => {
+                tileLayers[layer] = { meta: meta, tiles: new Map() };
+                updateVisibleTiles();
+            })
+            .catch(err => console.error(`[map3d.js] Error loading ${layer} tile meta:`, err));
+    });
+    // カメラ操作のたびではなく、少し間を置いてまとめて更新
+    controls.addEventListener('change', () => {
+        if (tileUpdateTimer) return;
+        tileUpdateTimer = setTimeout(() => {
+            tileUpdateTimer = null;
+            updateVisibleTiles();
+        }, 200);
+    });
+}
+
+// 注視点を中心に、カメラ距離と画角から地面(y=0)上の見えている範囲を近似
+function visibleExtent() {
+    const target = controls.target;
+    const distance = camera.position.distanceTo(target);
+    const halfHeight = distance * Math.tan(THREE.MathUtils.degToRad(camera.fov / 2));
+    const half = Math.max(halfHeight, halfHeight * camera.aspect) * 1.5;
+    return { minX: target.x - half, maxX: target.x + half, minY: target.z - half, maxY: target.z + half, size: 2 * half };
+}
+
+function updateVisibleTiles() {
+    const extent = visibleExtent();
+    Object.entries(tileLayers).forEach(([layer, state]) => {
+        const meta = state.meta;
+        // 表示範囲が2〜4タイル程度に収まるズームを選ぶ
+        const z = Math.max(0, Math.min(meta.max_zoom, Math.floor(Math.log2(meta.size / extent.size)) + 1));
+        const n = 2 ** z;
+        const step = meta.size / n;
+        const x0 = Math.max(0, Math.floor((extent.minX - meta.origin[0]) / step));
+        const x1 = Math.min(n - 1, Math.floor((extent.maxX - meta.origin[0]) / step));
+        const y0 = Math.max(0, Math.floor((extent.minY - meta.origin[1]) / step));
+        const y1 = Math.min(n - 1, Math.floor((extent.maxY - meta.origin[1]) / step));
+
+        const wanted = new Set();
+        for (let x = x0; x <= x1; x++) {
+            for (let y = y0; y <= y1; y++) {
+                const key = `${z}/${x}/${y}`;
+                wanted.add(key);
+                if (!state.tiles.has(key)) loadTile(layer, state, key);
+            }
+        }
+
+        // 範囲外になったタイルを外す
+        state.tiles.forEach((object, key) => {
+            if (wanted.has(key)) return;
+            if (object) {
+                tileRoot.remove(object);
+                object.geometry.dispose();
+                object.material.dispose();
+            }
+            state.tiles.delete(key);
+        });
+    });
+}
+
+function loadTile(layer, state, key) {
+    state.tiles.set(key, null);  // 読み込み中
+    fetch(`/tiles/${layer}/${key}`)
+        .then(response => response.json())
+        .then(tile => {
+            // 読み込み中に範囲外になっていれば捨てる
+            if (!state.tiles.has(key)) return;
+            const vertices = [];
+            // ポリゴンはタイルの clip 範囲で切られているので、その境界上の切り口の辺は描かない
+            const [cx0, cy0, cx1, cy1] = tile.clip || tile.bbox;
+            const eps = 0.01;  // 座標は小数2桁に丸めてある
+            const onClipEdge = (a, b) =>
+                (Math.abs(a[0] - cx0) < eps && Math.abs(b[0] - cx0) < eps) ||
+                (Math.abs(a[0] - cx1) < eps && Math.abs(b[0] - cx1) < eps) ||
+                (Math.abs(a[1] - cy0) < eps && Math.abs(b[1] - cy0) < eps) ||
+                (Math.abs(a[1] - cy1) < eps && Math.abs(b[1] - cy1) < eps);
+            tile.features.forEach(feature => {
+                feature.parts.forEach(part => {
+                    for (let i = 0; i < part.length - 1; i++) {
+                        if (feature.type === 'Polygon' && onClipEdge(part[i], part[i + 1])) continue;
+                        vertices.push(part[i][0], 0.1, part[i][1], part[i + 1][0], 0.1, part[i + 1][1]);
+                    }
+                });
+            });
+            const geometry = new THREE.BufferGeometry();
+            geometry.setAttribute('position', new THREE.Float32BufferAttribute(vertices, 3));
+            const lines = new THREE.LineSegments(geometry, new THREE.LineBasicMaterial({ color: TILE_LAYER_COLORS[layer] }));
+            tileRoot.add(lines);
+            state.tiles.set(key, lines);
+        })
+        .catch(err => {
+            state.tiles.delete(key);
+            console.error(`[map3d.js] Error loading tile ${layer}/${key}:`, err);
+        });
+}
+
+// ========== 建物の立体（/buildings3d）==========
+// サーバでタイルごとに1つのメッシュにまとめた GLB を読み、タイルごとに1回バッファを転送する
+const GLB_MAGIC = 0x46546C67;
+const GLB_CHUNK_JSON = 0x4E4F534A;
+const BUILDING_MESH_COLOR = 0xd0c0b0;
+let buildingRoot;
+
+function initBuildingMeshes() {
+    buildingRoot = new THREE.Group();
+    scene.add(buildingRoot);
+    const material = new THREE.MeshLambertMaterial({ color: BUILDING_MESH_COLOR });
+    fetch('/buildings3d/meta')
+        .then(response => response.json())
+        .then(meta => Promise.all(meta.tiles.map(([x, y]) =>
+            fetch(`/buildings3d/${x}/${y}.glb`)
+                .then(response => response.arrayBuffer())
+                .then(buffer => {
+                    const mesh = parseGLB(buffer, material);
+                    if (mesh) buildingRoot.add(mesh);
+                })
+        )))
+        .catch(err => console.error('[map3d.js] Error loading building meshes:', err));
+}
+
+// building_mesh.py が書く GLB（メッシュ1つ: POSITION, NORMAL, uint32 のインデックス）を Mesh にする
+function parseGLB(buffer, material) {
+    const header = new DataView(buffer, 0, 20);
+    if (header.getUint32(0, true) !== GLB_MAGIC || header.getUint32(16, true) !== GLB_CHUNK_JSON) {
+        throw new Error('not a glTF binary');
+    }
+    const jsonLength = header.getUint32(12, true);
+    const gltf = JSON.parse(new TextDecoder().decode(new Uint8Array(buffer, 20, jsonLength)));
+    const binOffset = 20 + jsonLength + 8;
+    const accessorArray = (index, ArrayType, width) => {
+        const accessor = gltf.accessors[index];
+        const view = gltf.bufferViews[accessor.bufferView];
+        return new ArrayType(buffer, binOffset + (view.byteOffset || 0), accessor.count * width);
+    };
+    const primitive = gltf.meshes[0].primitives[0];
+    if (gltf.accessors[primitive.indices].count === 0) return null;
+
+    const geometry = new THREE.BufferGeometry();
+    geometry.setAttribute('position', new THREE.BufferAttribute(accessorArray(primitive.attributes.POSITION, Float32Array, 3), 3));
+    geometry.setAttribute('normal', new THREE.BufferAttribute(accessorArray(primitive.attributes.NORMAL, Float32Array, 3), 3));
+    geometry.setIndex(new THREE.BufferAttribute(accessorArray(primitive.indices, Uint32Array, 1), 1));
+    const mesh = new THREE.Mesh(geometry, material);
+    const translation = gltf.nodes[0].translation || [0, 0, 0];
+    mesh.position.set(translation[0], translation[1], translation[2]);
+    return mesh;
+}
+
 // ========== エージェント関連 ==========
 
 /**
@@ -273,8 +437,9 @@ function createCarModel(color = 0x2266cc) {
     return carGroup;
 }
 
-function updateAgentsFromGAMA(data) {
-    console.log("[map3d.js] Updating agents from external data:", data);
+// columns: { ids, x, y } の列形式（frame_codec.js を参照）
+function updateAgentsFromGAMA(columns) {
+    console.log("[map3d.js] Updating agents from external data:", columns.ids.length);
 
     // 初回の場合、100体のエージェントを作成
     if (agents.length === 0) {
@@ -292,14 +457,14 @@ function updateAgentsFromGAMA(data) {
     }
 
     // データを100個に制限
-    const limitedData = data.slice(0, 1000);
-    if (limitedData.length < 1000) {
-        console.warn(`[map3d.js] Received only ${limitedData.length} data points, some agents will not be updated`);
+    const count = Math.min(columns.ids.length, 1000);
+    if (count < 1000) {
+        console.warn(`[map3d.js] Received only ${count} data points, some agents will not be updated`);
     }
 
 
-    limitedData.forEach((agentInfo, index) => {
-        if (index >= agents.length) return;
+    for (let index = 0; index < count; index++) {
+        if (index >= agents.length) break;
 
         const agent = agents[index];
         const scale = 90; // スケーリング係数
@@ -309,18 +474,24 @@ function updateAgentsFromGAMA(data) {
         // 位置を更新
 
         agent.position.set(
-            agentInfo.x,
+            columns.x[index],
             0,
-            agentInfo.y
+            columns.y[index]
         );
         // 情報を更新
         agent.userData = {
-            id: agentInfo.id,
-            speed: agentInfo.speed
+            id: columns.ids[index],
+            speed: agent.userData.speed
         };
-    });
+    }
+
+    // 表示範囲で絞り込まれたフレームでは台数が変わるので、使わなかった車は隠す
+    for (let index = 0; index < agents.length; index++) {
+        agents[index].visible = index < count;
+    }
+    setClustersVisible(false);
 
-    console.log(`[map3d.js] Updated ${limitedData.length} agents with received data`);
+    console.log(`[map3d.js] Updated ${count} agents with received data`);
 }
 
 
@@ -433,7 +604,9 @@ initScene();
 animate();
 
 // ========== Socket.IO で外部データを受け取り、updateAgentsFromGAMA()を呼ぶ ==========
-const socket = io(); // 同じサーバで提供している場合
+// 接続時にバイナリ形式（キーフレーム + 差分）を選ぶ
+const frameDecoder = new FrameDecoder();
+const socket = io({ query: { format: 'binary' } }); // 同じサーバで提供している場合
 
 socket.on('connect', () => {
     console.log("[map3d.js] Socket.IO connected");
@@ -442,12 +615,152 @@ socket.on('disconnect', () => {
     console.log("[map3d.js] Socket.IO disconnected");
 });
 
-socket.on('new_data', (data) => {
+// ack: 描画し終えたことをサーバに返す（返すまで次のフレームは送られない）
+socket.on('new_data', (data, ack) => {
     console.log("[map3d.js] Received new_data:", data);
     if (data && Array.isArray(data.agents)) {
         // 新しいエージェント情報を反映
-        updateAgentsFromGAMA(data.agents);
+        updateAgentsFromGAMA(columnsFromAgents(data.agents));
     } else {
         console.warn("[map3d.js] Invalid data format received:", data);
     }
+    if (ack) ack();
 });
+
+socket.on('new_data_bin', (buffer, ack) => {
+    const decoded = frameDecoder.decode(buffer);
+    if (decoded) {
+        updateAgentsFromGAMA(decoded);
+    }
+    if (ack) ack();
+});
+
+// ========== 表示範囲の登録とクラスタ表示 ==========
+// カメラが動いたら見えている範囲をサーバに送り、範囲内のエージェントだけを受け取る
+// 引いて見ているときはサーバがセルごとの台数（clusters）にまとめて送ってくる
+let viewportTimer = null;
+const clusterMeshes = [];
+const clusterGeometry = new THREE.CylinderGeometry(1, 1, 1, 16);
+const clusterMaterial = new THREE.MeshLambertMaterial({ color: 0xff6633, transparent: true, opacity: 0.8 });
+
+function sendViewport() {
+    const extent = visibleExtent();
+    socket.emit('set_viewport', {
+        bounds: [extent.minX, extent.minY, extent.maxX, extent.maxY],
+        zoom: renderer.domElement.clientWidth / extent.size
+    });
+}
+
+controls.addEventListener('change', () => {
+    if (viewportTimer) return;
+    viewportTimer = setTimeout(() => {
+        viewportTimer = null;
+        sendViewport();
+    }, 200);
+});
+socket.on('connect', sendViewport);
+
+function setClustersVisible(visible) {
+    clusterMeshes.forEach(mesh => { mesh.visible = false; });
+    if (!visible) return;
+    agents.forEach(agent => { agent.visible = false; });
+}
+
+function updateClusters(data) {
+    setClustersVisible(true);
+    const radius = data.cell_size * 0.4;
+    for (let i = 0; i < data.count.length; i++) {
+        if (i >= clusterMeshes.length) {
+            const mesh = new THREE.Mesh(clusterGeometry, clusterMaterial);
+            scene.add(mesh);
+            clusterMeshes.push(mesh);
+        }
+        const mesh = clusterMeshes[i];
+        // 台数は高さ（対数）で表す
+        const height = radius * 0.5 * (1 + Math.log2(data.count[i]));
+        mesh.scale.set(radius, height, radius);
+        mesh.position.set(data.x[i], height / 2, data.y[i]);
+        mesh.visible = true;
+    }
+}
+
+socket.on('clusters', (data, ack) => {
+    updateClusters(data);
+    if (ack) ack();
+});
+
+// ========== ヒートマップ（サーバで集計した密度ラスタ） ==========
+// 'h' キー、または URL に ?heatmap=1 で表示を切り替える
+let heatmapMesh = null;
+let heatmapEnabled = false;
+
+// 0..255 の密度 → RGBA（透明 → 赤 → 黄）
+const HEATMAP_LUT = new Uint8Array(256 * 4);
+for (let v = 0; v < 256; v++) {
+    const t = v / 255;
+    HEATMAP_LUT[v * 4] = 255;
+    HEATMAP_LUT[v * 4 + 1] = Math.round(255 * Math.max(0, t * 2 - 1));
+    HEATMAP_LUT[v * 4 + 2] = 0;
+    HEATMAP_LUT[v * 4 + 3] = v === 0 ? 0 : Math.round(60 + 160 * t);
+}
+
+function updateHeatmap(raster) {
+    if (!heatmapEnabled || !raster || !raster.bounds) return;
+    const { width, height, bounds } = raster;
+    const values = new Uint8Array(raster.data);
+
+    if (!heatmapMesh || heatmapMesh.userData.width !== width || heatmapMesh.userData.height !== height) {
+        if (heatmapMesh) {
+            scene.remove(heatmapMesh);
+            heatmapMesh.material.map.dispose();
+            heatmapMesh.material.dispose();
+            heatmapMesh.geometry.dispose();
+        }
+        const texture = new THREE.DataTexture(new Uint8Array(width * height * 4), width, height, THREE.RGBAFormat);
+        texture.magFilter = THREE.NearestFilter;
+        const material = new THREE.MeshBasicMaterial({
+            map: texture, transparent: true, depthWrite: false, side: THREE.DoubleSide
+        });
+        heatmapMesh = new THREE.Mesh(new THREE.PlaneGeometry(1, 1), material);
+        // +90度回転でテクスチャの行0（miny側）が z の小さい側に来る
+        heatmapMesh.rotation.x = Math.PI / 2;
+        heatmapMesh.userData = { width: width, height: height };
+        scene.add(heatmapMesh);
+    }
+    const w = bounds[2] - bounds[0];
+    const h = bounds[3] - bounds[1];
+    heatmapMesh.scale.set(w, h, 1);
+    heatmapMesh.position.set(bounds[0] + w / 2, 0.05, bounds[1] + h / 2);
+
+    const texture = heatmapMesh.material.map;
+    const rgba = texture.image.data;
+    for (let i = 0; i < values.length; i++) {
+        const v = values[i] * 4;
+        const o = i * 4;
+        rgba[o] = HEATMAP_LUT[v];
+        rgba[o + 1] = HEATMAP_LUT[v + 1];
+        rgba[o + 2] = HEATMAP_LUT[v + 2];
+        rgba[o + 3] = HEATMAP_LUT[v + 3];
+    }
+    texture.needsUpdate = true;
+}
+
+function setHeatmapEnabled(enabled) {
+    heatmapEnabled = enabled;
+    socket.emit(enabled ? 'subscribe_heatmap' : 'unsubscribe_heatmap');
+    if (heatmapMesh) heatmapMesh.visible = enabled;
+}
+
+socket.on('heatmap', updateHeatmap);
+// 再接続時は購読し直す
+socket.on('connect', () => {
+    if (heatmapEnabled) socket.emit('subscribe_heatmap');
+});
+window.addEventListener('keydown', (event) => {
+    if (event.key === 'h' && event.target === document.body) {
+        setHeatmapEnabled(!heatmapEnabled);
+    }
+});
+if (new URLSearchParams(window.location.search).get('heatmap') === '1') {
+    heatmapEnabled = true;
+}
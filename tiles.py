@@ -0,0 +1,271 @@
+import hashlib
+import json
+import os
+
+import numpy as np
+
+
+def simplify(points, tolerance):
+    """Douglas–Peucker 法で折れ線を簡略化する（端点は必ず残す）"""
+    n = len(points)
+    if n < 3 or tolerance <= 0:
+        return points
+    keep = np.zeros(n, dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, n - 1)]
+    while stack:
+        a, b = stack.pop()
+        if b <= a + 1:
+            continue
+        seg = points[b] - points[a]
+        rel = points[a + 1:b] - points[a]
+        length = np.hypot(seg[0], seg[1])
+        if length == 0:
+            dist = np.hypot(rel[:, 0], rel[:, 1])
+        else:
+            dist = np.abs(seg[0] * rel[:, 1] - seg[1] * rel[:, 0]) / length
+        i = int(np.argmax(dist))
+        if dist[i] > tolerance:
+            k = a + 1 + i
+            keep[k] = True
+            stack.append((a, k))
+            stack.append((k, b))
+    return points[keep]
+
+
+def clip_line(points, bbox):
+    """折れ線を矩形 bbox=(minx, miny, maxx, maxy) で切り、内側の部分の折れ線のリストを返す（Liang–Barsky 法）"""
+    minx, miny, maxx, maxy = bbox
+    lo, hi = points.min(axis=0), points.max(axis=0)
+    if lo[0] >= minx and lo[1] >= miny and hi[0] <= maxx and hi[1] <= maxy:
+        return [points]
+    if hi[0] < minx or hi[1] < miny or lo[0] > maxx or lo[1] > maxy:
+        return []
+    pieces = []
+    current = []
+    for (x0, y0), (x1, y1) in zip(points[:-1].tolist(), points[1:].tolist()):
+        dx, dy = x1 - x0, y1 - y0
+        t0, t1 = 0.0, 1.0
+        for p, q in ((-dx, x0 - minx), (dx, maxx - x0), (-dy, y0 - miny), (dy, maxy - y0)):
+            if p == 0:
+                if q < 0:
+                    t0, t1 = 1.0, 0.0
+                    break
+                continue
+            t = q / p
+            if p < 0:
+                t0 = max(t0, t)
+            else:
+                t1 = min(t1, t)
+        if t0 > t1:
+            # この線分は外側
+            if len(current) >= 2:
+                pieces.append(current)
+            current = []
+            continue
+        start = (x0 + t0 * dx, y0 + t0 * dy)
+        end = (x0 + t1 * dx, y0 + t1 * dy)
+        if not current or t0 > 0:
+            if len(current) >= 2:
+                pieces.append(current)
+            current = [start]
+        current.append(end)
+        if t1 < 1:
+            pieces.append(current)
+            current = []
+    if len(current) >= 2:
+        pieces.append(current)
+    return [np.array(piece) for piece in pieces]
+
+
+def clip_ring(points, bbox):
+    """閉じたリングを矩形 bbox で切る（Sutherland–Hodgman 法）。閉じたリングか、外側ならNone"""
+    minx, miny, maxx, maxy = bbox
+    lo, hi = points.min(axis=0), points.max(axis=0)
+    if lo[0] >= minx and lo[1] >= miny and hi[0] <= maxx and hi[1] <= maxy:
+        return points
+    if hi[0] < minx or hi[1] < miny or lo[0] > maxx or lo[1] > maxy:
+        return None
+    ring = points[:-1] if len(points) > 1 and np.array_equal(points[0], points[-1]) else points
+    # (座標軸, 境界, 内側が大きい側か)
+    for axis, bound, above in ((0, minx, True), (0, maxx, False), (1, miny, True), (1, maxy, False)):
+        if not len(ring):
+            return None
+        prev = np.roll(ring, 1, axis=0)
+        inside = ring[:, axis] >= bound if above else ring[:, axis] <= bound
+        prev_inside = np.roll(inside, 1)
+        out = []
+        for k in range(len(ring)):
+            if inside[k] != prev_inside[k]:
+                a, b = prev[k], ring[k]
+                t = (bound - a[axis]) / (b[axis] - a[axis])
+                out.append(a + t * (b - a))
+            if inside[k]:
+                out.append(ring[k])
+        ring = np.array(out).reshape(-1, 2)
+    if len(ring) < 3:
+        return None
+    return np.vstack([ring, ring[:1]])
+
+
+def _geometry_parts(geometry):
+    """ジオメトリを (種別, [パート...]) に分解する。パートは座標のリスト"""
+    kind = geometry.get('type')
+    coords = geometry.get('coordinates') or []
+    if kind == 'LineString':
+        return 'LineString', [coords]
+    if kind == 'MultiLineString':
+        return 'LineString', list(coords)
+    if kind == 'Polygon':
+        return 'Polygon', [ring for ring in coords]
+    if kind == 'MultiPolygon':
+        return 'Polygon', [ring for polygon in coords for ring in polygon]
+    return None, []
+
+
+class TileSet:
+    """
+    レイヤを四分木タイルに切り出す
+    座標は transform で Three.js の座標系に変換し、ズームごとに簡略化する
+    作ったタイルは cache_dir/<layer>/<元ファイルのsha1>/z/x/y.json に保存して再利用する
+    source を渡すと path のJSONの代わりに source() が返す (種別, パートのリスト) を使う
+    （path は更新検知とハッシュのみ）。transform が None なら座標はそのまま
+    """
+
+    def __init__(self, name, path, transform, cache_dir, max_zoom=5, resolution=256, source=None):
+        self.name = name
+        self.path = path
+        self.transform = transform
+        self.source = source
+        self.cache_dir = cache_dir
+        self.max_zoom = max_zoom
+        self.resolution = resolution  # タイル1辺あたりの解像度（簡略化の許容誤差の基準）
+        self._mtime = None
+        self._loaded = False
+
+    def _refresh(self):
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            mtime = None
+        if self._loaded and mtime == self._mtime:
+            return
+
+        geometries = []
+        digest = hashlib.sha1()
+        if mtime is not None:
+            with open(self.path, 'rb') as f:
+                raw = f.read()
+            digest.update(raw)
+            if self.source is not None:
+                geometries = self.source()
+            else:
+                geometries = (_geometry_parts((feature or {}).get('geometry') or {}) for feature in json.loads(raw))
+
+        # フィーチャごとのパートをビューア座標に変換
+        self.kinds = []
+        self.parts = []
+        boxes = []
+        for kind, parts in geometries:
+            parts = [np.asarray(p, dtype=np.float64)[:, :2] for p in parts if len(p) >= 2]
+            if self.transform is not None:
+                parts = [self.transform(p) for p in parts]
+            if not parts:
+                kind = None
+            self.kinds.append(kind)
+            self.parts.append(parts)
+            if kind is None:
+                boxes.append((np.inf, np.inf, -np.inf, -np.inf))
+            else:
+                stacked = np.concatenate(parts)
+                boxes.append((*stacked.min(axis=0), *stacked.max(axis=0)))
+        self.boxes = np.array(boxes, dtype=np.float64).reshape(-1, 4)
+
+        valid = np.isfinite(self.boxes[:, 0])
+        if np.any(valid):
+            lo = self.boxes[valid, :2].min(axis=0)
+            hi = self.boxes[valid, 2:].max(axis=0)
+        else:
+            lo, hi = np.zeros(2), np.ones(2)
+        self.origin = lo
+        self.size = float(max(hi - lo)) * 1.001 or 1.0
+
+        self.source_hash = digest.hexdigest()
+        self._mtime = mtime
+        self._loaded = True
+
+    def meta(self):
+        self._refresh()
+        return {
+            'layer': self.name,
+            'origin': self.origin.tolist(),
+            'size': self.size,
+            'max_zoom': self.max_zoom,
+            'source': self.source_hash,
+        }
+
+    def extent(self):
+        """レイヤ全体の範囲 (minx, miny, maxx, maxy)。フィーチャが無ければNone"""
+        self._refresh()
+        valid = np.isfinite(self.boxes[:, 0])
+        if not np.any(valid):
+            return None
+        return (*self.boxes[valid, :2].min(axis=0).tolist(), *self.boxes[valid, 2:].max(axis=0).tolist())
+
+    def tile_path(self, z, x, y):
+        self._refresh()
+        return os.path.join(self.cache_dir, self.name, self.source_hash, str(z), str(x), f'{y}.json')
+
+    def get(self, z, x, y):
+        """タイルのファイルパスを返す（無ければ作って保存する）。範囲外ならNone"""
+        if not (0 <= z <= self.max_zoom and 0 <= x < 2 ** z and 0 <= y < 2 ** z):
+            return None
+        path = self.tile_path(z, x, y)
+        if not os.path.exists(path):
+            body = json.dumps(self.build(z, x, y), separators=(',', ':')).encode('utf-8')
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp = f'{path}.{os.getpid()}.tmp'
+            with open(tmp, 'wb') as f:
+                f.write(body)
+            os.replace(tmp, path)
+        return path
+
+    def build(self, z, x, y):
+        """
+        タイル(z, x, y)に掛かるフィーチャをタイルの範囲で切り、簡略化して集める
+        切るのはタイルを buffer だけ広げた範囲（clip）。ポリゴンの切り口の辺はその境界上に乗るので、
+        輪郭だけを描くクライアントは clip の辺上の線分を描かなければよい
+        """
+        self._refresh()
+        step = self.size / 2 ** z
+        x0 = self.origin[0] + x * step
+        y0 = self.origin[1] + y * step
+        bbox = [x0, y0, x0 + step, y0 + step]
+        tolerance = step / self.resolution if z < self.max_zoom else 0.0
+        buffer = 4 * step / self.resolution
+        clip = [bbox[0] - buffer, bbox[1] - buffer, bbox[2] + buffer, bbox[3] + buffer]
+
+        b = self.boxes
+        hit = np.nonzero((b[:, 0] <= bbox[2]) & (b[:, 2] >= bbox[0]) &
+                         (b[:, 1] <= bbox[3]) & (b[:, 3] >= bbox[1]))[0]
+        features = []
+        for i in hit.tolist():
+            # 許容誤差より小さいフィーチャはこのズームでは省く
+            if max(b[i, 2] - b[i, 0], b[i, 3] - b[i, 1]) < tolerance:
+                continue
+            kind = self.kinds[i]
+            parts = []
+            for part in self.parts[i]:
+                if kind == 'Polygon':
+                    ring = clip_ring(part, clip)
+                    pieces = [] if ring is None else [ring]
+                else:
+                    pieces = clip_line(part, clip)
+                for piece in pieces:
+                    simplified = simplify(piece, tolerance)
+                    if kind == 'Polygon' and len(simplified) < 4:
+                        continue
+                    parts.append(np.round(simplified, 2).tolist())
+            if parts:
+                features.append({'id': i, 'type': kind, 'parts': parts})
+        return {'layer': self.name, 'z': z, 'x': x, 'y': y, 'bbox': bbox, 'clip': clip, 'features': features}
@@ -0,0 +1,85 @@
+import numpy as np
+
+from road_index import SegmentLookup
+
+
+class TrafficCounter:
+    """
+    道路ごとの車両数の集計
+    フレームごとに全エージェントを SegmentLookup で道路に割り当て、道路ごとの台数を np.bincount で数える
+    グループ（「矢橋通り」など複数の道路のまとまり）ごとの台数は、変化したフレームだけを
+    固定長のリング配列に記録する（グラフは階段状に描く）
+    """
+
+    def __init__(self, index, segment_road, road_labels, groups=None, window=600, pixel=None):
+        self.segment_road = np.asarray(segment_road, dtype=np.int64)
+        self.road_labels = list(road_labels)
+        self.num_roads = len(self.road_labels)
+        self.lookup = SegmentLookup(index, pixel=pixel, labels=self.segment_road)
+
+        # groups: [(名前, 道路番号のリスト)]。省略時は全道路の合計
+        if not groups:
+            groups = [('全道路', list(range(self.num_roads)))]
+        self.group_names = [name for name, _ in groups]
+        # 道路 → グループの対応（1つの道路が複数のグループに入ってもよい）
+        self.member_road = np.concatenate([np.asarray(roads, dtype=np.int64) for _, roads in groups])
+        self.member_group = np.repeat(np.arange(len(groups)), [len(roads) for _, roads in groups])
+
+        self.window = int(window)
+        self.frames = np.zeros(self.window, dtype=np.int64)
+        self.series = np.zeros((self.window, len(groups)), dtype=np.int32)
+        self.head = 0   # 次に書き込む位置
+        self.size = 0
+        self.road_counts = np.zeros(self.num_roads, dtype=np.int64)
+        self.group_counts = None
+        self.frame = None
+        self.off_road = 0
+
+    def update(self, frame, xs, ys):
+        """
+        1フレーム分の位置を集計する
+        グループの台数が前回から変わったときだけ update_plot 用の差分を返す（変わらなければNone）
+        """
+        segment = self.lookup.lookup(xs, ys)
+        on_road = segment >= 0
+        self.off_road = int(len(segment) - np.count_nonzero(on_road))
+        self.road_counts = np.bincount(self.segment_road[segment[on_road]], minlength=self.num_roads)
+        counts = np.bincount(self.member_group, weights=self.road_counts[self.member_road],
+                             minlength=len(self.group_names)).astype(np.int32)
+        self.frame = frame
+        if self.group_counts is not None and np.array_equal(counts, self.group_counts):
+            return None
+
+        self.group_counts = counts
+        self.frames[self.head] = frame
+        self.series[self.head] = counts
+        self.head = (self.head + 1) % self.window
+        self.size = min(self.size + 1, self.window)
+        return {'frame': int(frame), 'counts': counts.tolist()}
+
+    def history(self):
+        """リング配列の中身を古い順に (frames, series) で返す"""
+        order = (np.arange(self.size) + self.head - self.size) % self.window
+        return self.frames[order], self.series[order]
+
+    def graph_data(self, graph_name):
+        """graph.js の /get_graph_data 形式"""
+        frames, series = self.history()
+        return {
+            'graph_name': graph_name,
+            'y1': graph_name,
+            'y2': None,
+            'x_data': frames.tolist(),
+            'y_data1': [{'name': name, 'y': series[:, k].tolist()} for k, name in enumerate(self.group_names)],
+            'y_data2': [],
+            'window': self.window,
+        }
+
+    def road_table(self):
+        """道路ごとの現在の台数"""
+        return {
+            'frame': self.frame,
+            'off_road': self.off_road,
+            'roads': [{'road': label, 'count': int(count)}
+                      for label, count in zip(self.road_labels, self.road_counts.tolist()) if count],
+        }
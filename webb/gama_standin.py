@@ -0,0 +1,107 @@
+# webb/gama_standin.py
+# GAMA の代わりに sample_flask.py の /params をロングポーリングで待ち、届いたパラメータを表示する
+# GAMA を起動せずに画面の操作からシミュレーション側への反映を確かめるためのもの
+#
+#   python gama_standin.py                      # 変更を待ち続けて表示する
+#   python gama_standin.py --measure 50         # 自分で50回更新し、変更から受信までの時間を測る
+import argparse
+import json
+import threading
+import time
+import urllib.request
+
+
+def get_json(url, timeout):
+    with urllib.request.urlopen(url, timeout=timeout) as response:
+        return json.loads(response.read())
+
+
+def post_json(url, data):
+    request = urllib.request.Request(url, data=json.dumps(data).encode('utf-8'),
+                                     headers={'Content-Type': 'application/json'})
+    with urllib.request.urlopen(request, timeout=5) as response:
+        return json.loads(response.read())
+
+
+class GamaStandin:
+    """GAMA 側の受け手。version を覚えておき、それより新しい値が来るまで /params で待つ"""
+
+    def __init__(self, url, timeout=30.0):
+        self.url = url
+        self.timeout = timeout
+        self.version = None
+        self.epoch = None
+        self.params = {}
+
+    def sync(self):
+        """待たずに現在の値を取る（起動時）"""
+        snapshot = get_json(f'{self.url}/params', self.timeout)
+        self.epoch, self.version, self.params = snapshot['epoch'], snapshot['version'], snapshot['params']
+        return snapshot
+
+    def wait(self):
+        """次の変更まで待ち、変わったキーを反映する。タイムアウトなら changed は空"""
+        snapshot = get_json(f'{self.url}/params?since={self.version}&epoch={self.epoch}&timeout={self.timeout}',
+                            self.timeout + 5)
+        for key in snapshot['changed']:
+            self.params[key] = snapshot['params'][key]
+        self.epoch, self.version = snapshot['epoch'], snapshot['version']
+        return snapshot
+
+
+def measure(url, count, interval):
+    """count 回 car_size を変えて、POST してから待っている側が受け取るまでの時間を測る"""
+    standin = GamaStandin(url)
+    standin.sync()
+    posted = {}   # version → POST した時刻
+    latencies = []
+
+    def writer():
+        for k in range(count):
+            time.sleep(interval)
+            started = time.perf_counter()
+            version = post_json(f'{url}/params', {'car_size': 1 + k % 20, 'sim_speed': k / count})['version']
+            posted[version] = started
+
+    thread = threading.Thread(target=writer, daemon=True)
+    thread.start()
+    received = 0
+    while thread.is_alive() or standin.version < max(posted, default=0):
+        snapshot = standin.wait()
+        if snapshot['changed']:
+            received += 1
+            arrived = time.perf_counter()
+            # まとめて届いた場合は一番新しい更新までの時間
+            if snapshot['version'] in posted:
+                latencies.append(arrived - posted[snapshot['version']])
+    latencies.sort()
+    if latencies:
+        print(f"updates: {count}, responses: {received}, "
+              f"p50: {latencies[len(latencies) // 2] * 1000:.1f} ms, max: {latencies[-1] * 1000:.1f} ms")
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description='GAMA の代わりにパラメータの変更を受け取る')
+    parser.add_argument('--url', default='http://localhost:8000')
+    parser.add_argument('--timeout', type=float, default=30.0)
+    parser.add_argument('--measure', type=int, help='自分で更新して変更から受信までの時間を測る回数')
+    parser.add_argument('--interval', type=float, default=0.1, help='--measure での更新の間隔（秒）')
+    args = parser.parse_args()
+
+    if args.measure:
+        measure(args.url, args.measure, args.interval)
+        return
+
+    standin = GamaStandin(args.url, args.timeout)
+    print("initial:", standin.sync())
+    while True:
+        snapshot = standin.wait()
+        if snapshot['changed']:
+            delay = time.time() - snapshot['updated_at']
+            print(f"v{snapshot['version']} ({delay * 1000:.0f} ms)",
+                  {key: snapshot['params'][key] for key in snapshot['changed']})
+
+
+if __name__ == '__main__':
+    main()
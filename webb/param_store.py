@@ -0,0 +1,81 @@
+import os
+import threading
+import time
+
+
+class ParameterStore:
+    """
+    GAMA に渡すパラメータ（car_size, sim_speed, policies, heatmap_flag など）をバージョン付きで持つ
+    update() で値が変わったときだけバージョンを1つ進め、wait() で待っている GAMA 側に知らせる
+    キーごとに最後に変わったバージョンを覚えておき、since 以降に変わったキーだけを返せる
+    バージョンは再起動で 0 に戻るので、プロセスごとの epoch を付けて返す。epoch が違う since や
+    現在より新しい since は再起動前のものなので、待たずに全部のキーを返す
+    """
+
+    def __init__(self, initial):
+        self._cond = threading.Condition()
+        self.epoch = os.urandom(4).hex()
+        self.version = 0
+        self.updated_at = time.time()
+        self.params = dict(initial)
+        self._key_version = {key: 0 for key in self.params}
+        self.updates = 0   # update() の呼び出し回数（変化なしも含む）
+
+    def update(self, changes):
+        """
+        changes: {キー: 値}。まとめて1つのバージョンにする（値が変わらなければ進めない）
+        戻り値: 現在のバージョン
+        """
+        with self._cond:
+            self.updates += 1
+            changed = [key for key, value in changes.items() if self.params.get(key, object()) != value]
+            if changed:
+                self.version += 1
+                self.updated_at = time.time()
+                for key in changed:
+                    self.params[key] = changes[key]
+                    self._key_version[key] = self.version
+                self._cond.notify_all()
+            return self.version
+
+    def _stale(self, since, epoch):
+        """since が再起動前のバージョンか"""
+        return since is not None and ((epoch is not None and epoch != self.epoch) or since > self.version)
+
+    def snapshot(self, since=None, epoch=None):
+        """{'epoch', 'version', 'updated_at', 'params', 'changed'}。changed は since より後に変わったキー"""
+        with self._cond:
+            if self._stale(since, epoch):
+                since = None
+            changed = [key for key, version in self._key_version.items() if since is None or version > since]
+            return {
+                'epoch': self.epoch,
+                'version': self.version,
+                'updated_at': self.updated_at,
+                'params': dict(self.params),
+                'changed': changed,
+            }
+
+    def wait(self, since, timeout=30.0, settle=0.01, epoch=None):
+        """
+        バージョンが since より新しくなるまで最大 timeout 秒待ってから snapshot(since) を返す
+        （タイムアウトしたら changed は空。since が再起動前のものなら待たずに全部のキーを返す）
+        変化を見つけたあと settle 秒は続く更新を待ち、スライダーを動かし続けたときの
+        連続した更新は1回の応答にまとめる
+        """
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            if self._stale(since, epoch):
+                return self.snapshot()
+            while self.version <= since:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return self.snapshot(since)
+                self._cond.wait(remaining)
+            # 直前の更新から settle 秒、新しい更新が来なくなるまでまとめる（最大 timeout まで）
+            while settle > 0:
+                seen = self.version
+                remaining = min(settle, deadline - time.monotonic())
+                if remaining <= 0 or not self._cond.wait(remaining) or self.version == seen:
+                    break
+            return self.snapshot(since)
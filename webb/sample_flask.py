@@ -1,16 +1,23 @@
 from flask import *
 from flask_cors import CORS
 import json
-import pyautogui
 import time
 
+from param_store import ParameterStore
+
 app = Flask(__name__, static_folder='.', static_url_path='')
 
-# データ
-car_size = 6 #車のサイズ
-sim_speed = 0.0 #シミュレーションの速度
-policies = {'switch1': False, 'switch2': False, 'switch3': False, 'switch4':False}
-heatmap_flag = False #ヒートマップ
+# データ（GAMA に渡すパラメータ。変更のたびにバージョンが進む）
+params = ParameterStore({
+    'car_size': 6, #車のサイズ
+    'sim_speed': 0.0, #シミュレーションの速度
+    'policies': {'switch1': False, 'switch2': False, 'switch3': False, 'switch4':False},
+    'heatmap_flag': False, #ヒートマップ
+})
+# ロングポーリングで待つ最大の秒数, 続く更新をまとめる秒数
+LONG_POLL_TIMEOUT = 30.0
+LONG_POLL_SETTLE = 0.01
+
 @app.route('/')
 def index():
     return app.send_static_file('index.html')
@@ -18,64 +25,42 @@ def index():
 @app.route('/send-json', methods=['POST'])
 def receive_json():
     inputData = request.json
-    policies = inputData
-   
-    print(policies, "policies")
-    
-    with open('../minakusa_GA/includes/data.json', 'w') as json_file:
-        json.dump(inputData, json_file)
-    kekka = {"neko":"猫"}
-    
-    # display_info = pyautogui.displayInfo()
-    # print(display_info)
-    mouse_x, mouse_y = pyautogui.position()
-    print(f'Mouse clicked at Screen Coordinates: ({mouse_x}, {mouse_y})')
-
-    
-
-    # 座標(1000, 500)に移動してクリック ---ここからgui操作---
-    pyautogui.click(1000, 500, button="left")
-    pyautogui.press('enter')
-    pyautogui.click()
-    pyautogui.keyDown("command")
-    pyautogui.keyDown("r")
-    pyautogui.keyUp("r")
-    pyautogui.keyUp("command")
-    pyautogui.press('enter')
-    pyautogui.moveTo(100, 100)
-    
-    
+    version = params.update({'policies': inputData})
+    print(inputData, "policies", version)
+
+    # GAMA はモデルの初期化時にこのファイルを読むので残す（実行中の反映は /params で行う）
+    try:
+        with open('../minakusa_GA/includes/data.json', 'w') as json_file:
+            json.dump(inputData, json_file)
+    except OSError as e:
+        print("data.json not written:", e)
+    kekka = {"neko":"猫", "version": version}
     return jsonify(kekka)
 
-# スライドバー(carsize)の処理
+# 以前は GUI 操作で GAMA をリロードしていた。今は /params を待っている GAMA にすぐ届くので、現在の値を返すだけ
 @app.route('/auto_reload', methods=['GET'])
 def auto_reload():
-    # 座標(1000, 500)に移動してクリック ---ここからgui操作---
-    pyautogui.click(1000, 500, button="left")
-    pyautogui.press('enter')
-    pyautogui.click()
-    pyautogui.keyDown("command")
-    pyautogui.keyDown("r")
-    pyautogui.keyUp("r")
-    pyautogui.keyUp("command")
-    pyautogui.press('enter')
-    pyautogui.moveTo(100, 100)
-
-    global car_size
-    global sim_speed
-    global policies
-    global heatmap_flag
-    gama_response = {}
-    gama_response["car_size"] = car_size
-    gama_response["sim_speed"] = sim_speed
-    gama_response["policies"] = policies
-    gama_response["heatmap_flag"] = heatmap_flag
-    return gama_response
-
-
-    
-
-
+    return params.snapshot()['params']
+
+# GAMA 用のロングポーリング: since より新しいバージョンになるまで待ち、値と変わったキーを返す
+#   GET /params?since=<前回の version>&epoch=<前回の epoch>&timeout=<秒>
+# タイムアウトしたときは同じ version で changed が空。since を省くとすぐ現在の値を返す
+# サーバが再起動していれば（epoch が違う, since が現在より新しい）待たずに全部のキーを返す
+@app.route('/params', methods=['GET'])
+def get_params():
+    since = request.args.get('since', type=int)
+    if since is None:
+        return jsonify(params.snapshot())
+    timeout = min(request.args.get('timeout', LONG_POLL_TIMEOUT, type=float), LONG_POLL_TIMEOUT)
+    return jsonify(params.wait(since, timeout, LONG_POLL_SETTLE, epoch=request.args.get('epoch')))
+
+# 複数のパラメータをまとめて1つのバージョンとして更新する
+@app.route('/params', methods=['POST'])
+def post_params():
+    changes = request.get_json(silent=True)
+    if not isinstance(changes, dict):
+        return jsonify({"status": "error", "message": "Expected an object of parameters"}), 400
+    return jsonify({"status": "success", "version": params.update(changes)})
 
 
 # スライドバー(carsize)の処理
@@ -84,10 +69,9 @@ def send_slidebar():
     if request.method == 'POST':
         res = request.json
         # print(res , "aaaaa")
-        global car_size
         car_size = int(res["value"])
+        params.update({'car_size': car_size})
         print(car_size, "carsize")
-        slider_value = request.form['slider']  # スライダーの値を受け取る
 
         # スライダーの値に基づいてリダイレクト先のURLを生成
         # redirect_url = url_for('new_page', value=slider_value)
@@ -100,8 +84,8 @@ def send_slidebar():
 def send_sp_slidebar():
     if request.method == 'POST':
         res = request.json
-        global sim_speed
         sim_speed = float(res["value"])
+        params.update({'sim_speed': sim_speed})
         
         print(sim_speed, "sim_speed")
         # print(car_size, "carsize")
@@ -119,8 +103,8 @@ def send_heat_map():
     if request.method == 'POST':
         res = request.json
         # print(res , "aaaaa")
-        global heatmap_flag
         heatmap_flag = res["heat"]
+        params.update({'heatmap_flag': heatmap_flag})
         print(heatmap_flag)
         print(type(heatmap_flag))
 
@@ -135,27 +119,20 @@ def send_heat_map():
 
 
 
+# 従来のポーリング用（待たずに現在の値を返す）
 @app.route('/gama-carsize', methods=['GET'])
 def send_carsize():
-    global car_size
-    global sim_speed
-    global policies
-    global heatmap_flag
-    gama_response = {}
-    gama_response["car_size"] = car_size
-    gama_response["sim_speed"] = sim_speed
-    gama_response["policies"] = policies
-    gama_response["heatmap_flag"] = heatmap_flag
-    return gama_response
+    return params.snapshot()['params']
 
 
 @app.route('/policy', methods=['POST'])
 def policy():
-    global policies
     inputData = request.json
-    policies = inputData
+    params.update({'policies': inputData})
     # print(inputData)
     return inputData
 
 
-app.run(port=8000, debug=False, host='0.0.0.0')
+if __name__ == '__main__':
+    # ロングポーリング中のリクエストがスレッドを1つずつ占有するので threaded で動かす
+    app.run(port=8000, debug=False, host='0.0.0.0', threaded=True)